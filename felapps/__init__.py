@@ -1,25 +1,58 @@
-from .utils import felutils
-from .utils import funutils
-from .utils import resutils
-from .utils import scanutils
-from .utils import datautils
-from .utils import matchutils
-from .utils import imageutils
-from .utils import uiutils
-from .utils import myui
-from .utils import analysisframe
-from .physics import felcalc
-from .physics import felbase
-from .facilities import dcls
-from .apps.imageviewer  import imageviewer
-from .apps.cornalyzer   import cornalyzer
-from .apps.felformula   import felformula
-from .apps.dataworkshop import dataworkshop
-from .apps.matchwizard  import matchwizard
-from .apps.appdrawer    import appdrawer
-from .apps.wxmpv        import wxmpv
-
-__version__ = appdrawer.__version__
+import importlib
+
+from .utils import miscutils
+
+# submodules are imported on first access (``felapps.imageviewer``, etc.),
+# thus ``felapps.physics`` could be used without wx and epics, e.g. by the
+# batch tools on compute nodes
+_submodules = {
+    'felutils': '.utils.felutils',
+    'funutils': '.utils.funutils',
+    'resutils': '.utils.resutils',
+    'scanutils': '.utils.scanutils',
+    'datautils': '.utils.datautils',
+    'matchutils': '.utils.matchutils',
+    'imageutils': '.utils.imageutils',
+    'uiutils': '.utils.uiutils',
+    'myui': '.utils.myui',
+    'analysisframe': '.utils.analysisframe',
+    'felcalc': '.physics.felcalc',
+    'felbase': '.physics.felbase',
+    'felbatch': '.physics.felbatch',
+    'felexplore': '.physics.felexplore',
+    'felsurrogate': '.physics.felsurrogate',
+    'felsens': '.physics.felsens',
+    'felinverse': '.physics.felinverse',
+    'hghg': '.physics.hghg',
+    'fldprop': '.physics.fldprop',
+    'chicane': '.physics.chicane',
+    'dcls': '.facilities.dcls',
+    'imageviewer': '.apps.imageviewer.imageviewer',
+    'cornalyzer': '.apps.cornalyzer.cornalyzer',
+    'felformula': '.apps.felformula.felformula',
+    'dataworkshop': '.apps.dataworkshop.dataworkshop',
+    'matchwizard': '.apps.matchwizard.matchwizard',
+    'appdrawer': '.apps.appdrawer.appdrawer',
+    'wxmpv': '.apps.wxmpv.wxmpv',
+}
+
+
+def __getattr__(name):
+    try:
+        path = _submodules[name]
+    except KeyError:
+        raise AttributeError("module %r has no attribute %r" %
+                             (__name__, name))
+    module = importlib.import_module(path, __name__)
+    globals()[name] = module
+    return module
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_submodules))
+
+
+__version__ = miscutils.AppVersions().getVersion('appdrawer')
 __author__ = "Tong Zhang"
 
 __doc__ = """Python package created for the commissioning of free-electron 
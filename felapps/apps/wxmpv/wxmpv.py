@@ -21,6 +21,8 @@ from ...utils import analysisframe
 from ...utils import miscutils
 from ...utils import funutils
 from ...utils import resutils
+from ...utils import writeservice
+from ...utils import textio
 
 
 __version__ =  miscutils.AppVersions().getVersion('wxmpv')
@@ -106,9 +108,15 @@ class MainFrame(analysisframe.AnalysisFrame):
             self.save_data(savefile_name, data)
 
     def save_data(self, fname, data):
-        try:
-            f = h5py.File(fname, 'w')
+        """ save data in writer thread, report when done
+        """
+        writeservice.getWriter().submit(
+            self._write_data, fname, data,
+            callback=lambda res: wx.CallAfter(self._save_done, fname, True),
+            errback=lambda err: wx.CallAfter(self._save_done, fname, False))
 
+    def _write_data(self, fname, data):
+        with h5py.File(fname, 'w') as f:
             rg = f.create_group('data')
             rg.attrs['timestamp'] = time.strftime('%Y-%m-%d %H:%M:%S %Z', time.localtime())
             for k, v in data['attr'].items():
@@ -128,27 +136,28 @@ class MainFrame(analysisframe.AnalysisFrame):
             fit_y = np.stack([data['fit']['prof_y'][0], data['fit']['prof_y'][1]], 1)
             dset = f.create_dataset('data/fit/y', shape=fit_y.shape, dtype=fit_y.dtype)
             dset[...] = fit_y
-            
+
             im_data = data['image']
             dset = f.create_dataset('data/image', shape=im_data.shape, dtype=im_data.dtype)
             dset[...] = im_data
-            f.close()
 
+    def _save_done(self, fname, success):
+        if not self:
+            return
+        if success:
             dial = wx.MessageDialog(
                 self,
                 message="Saved data into \n" + fname + ".",
                 caption="Save Done",
                 style=wx.OK | wx.CENTRE | wx.ICON_WARNING)
-            if dial.ShowModal() == wx.ID_OK:
-                self.Destroy()
-        except:
+        else:
             dial = wx.MessageDialog(
                 self,
                 message="Saving data into \n" + fname + " fails.",
                 caption="Save Warning",
                 style=wx.OK | wx.CENTRE | wx.ICON_WARNING)
-            if dial.ShowModal() == wx.ID_OK:
-                self.Destroy()
+        dial.ShowModal()
+        dial.Destroy()
 
     def _get_image_data(self, datafile):
         """ read datafile (hdf5, txt, asc, jpg, etc.) into array
@@ -171,7 +180,7 @@ class MainFrame(analysisframe.AnalysisFrame):
         return data
     
     def _get_data_txt(self, fname):
-        data = np.loadtxt(fname)
+        data = textio.loadText(fname, dtype=float)
         return data
     
     def _get_data_pic(self, fname):
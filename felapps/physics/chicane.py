@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Model of four-dipole magnetic chicane: R56 from dipole field and the
+inverse, dipole field for target R56, vectorized over beam energy, field
+and geometry; design tables of R56 scan are cached by beam energy.
+
+R56 = 2 theta^2 (2/3 L_m + L_d), sin(theta) = e B L_m / (m c sqrt(gamma^2 - 1))
+
+Usage:
+>>> chi = Chicane(imagl=0.150, idril=0.285)
+>>> chi.getR56(587.87, [0.1, 0.2, 0.3])
+>>> chi.getField(587.87, 0.15e-3)
+>>> table = chi.getTable(587.87, r56max=0.5e-3, npts=5000)
+>>> table['field']  # dipole field for every R56 of table['r56']
+>>> chi = getChicane(0.150, 0.285)  # shared instance of the geometry
+>>> r56chi(587.87, 0.14), bchi(587.87, 0.15e-3)  # by shared instances
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .felbase import PhysicalConstants
+
+
+class Chicane(PhysicalConstants):
+    """ Four-dipole chicane
+
+    :param imagl: dipole length, [m]
+    :param idril: drift length between the first (last) two dipoles, [m]
+    :param ncache: design tables to be cached
+
+    ``imagl`` and ``idril`` could be arrays, broadcast with energy/field
+    """
+
+    def __init__(self, imagl=0.150, idril=0.285, ncache=32):
+        self.imagl = imagl
+        self.idril = idril
+        self.ncache = ncache
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _rigidity(self, gam0):
+        """ beam rigidity B*rho, [T*m]
+        """
+        return np.sqrt(np.asarray(gam0, dtype=float)**2 - 1) * self.m0 * \
+            self.c0 / self.e0
+
+    def _leff(self):
+        return 2.0 * (2.0 / 3.0 * np.asarray(self.imagl) + self.idril)
+
+    def getAngle(self, gam0, ibfield):
+        """ bending angle [rad] of each dipole, NaN if the beam is reflected
+
+        :param gam0: Lorentz factor of beam
+        :param ibfield: dipole field, [T]
+        """
+        s = np.asarray(ibfield, dtype=float) * self.imagl / self._rigidity(
+            gam0)
+        with np.errstate(invalid='ignore'):
+            return np.arcsin(np.where(np.abs(s) <= 1, s, np.nan))
+
+    def getR56(self, gam0, ibfield):
+        """ R56 [m] of chicane, arrays broadcast together
+        """
+        return self._leff() * self.getAngle(gam0, ibfield)**2
+
+    def getField(self, gam0, r56):
+        """ dipole field [T] for target R56 [m], closed form inverse of
+        ``getR56``, NaN if not reachable (negative or bending angle over
+        pi/2)
+        """
+        with np.errstate(invalid='ignore'):
+            theta = np.sqrt(np.asarray(r56, dtype=float) / self._leff())
+        theta = np.where(theta <= np.pi / 2, theta, np.nan)
+        return np.sin(theta) * self._rigidity(gam0) / self.imagl
+
+    def getTable(self, gam0, r56max, npts=1001):
+        """ design table of R56 scan from 0 to ``r56max`` [m] at beam energy
+        ``gam0``, cached by (gam0, r56max, npts) and geometry
+
+        :return: dict of 'r56' [m], 'field' [T] and 'theta' [rad] arrays
+                 (read-only), shape (npts, )
+        """
+        key = (float(gam0), float(r56max), int(npts),
+               np.asarray(self.imagl).tobytes(),
+               np.asarray(self.idril).tobytes())
+        with self._lock:
+            table = self._tables.get(key)
+            if table is not None:
+                self._tables.move_to_end(key)
+                return table
+        r56 = np.linspace(0, r56max, npts)
+        field = self.getField(gam0, r56)
+        table = {'r56': r56, 'field': field,
+                 'theta': self.getAngle(gam0, field)}
+        for v in table.values():
+            v.flags.writeable = False
+        with self._lock:
+            self._tables[key] = table
+            if len(self._tables) > self.ncache:
+                self._tables.popitem(last=False)
+        return table
+
+
+_chicanes = {}
+_clock = threading.Lock()
+
+
+def getChicane(imagl=0.150, idril=0.285):
+    """ return shared ``Chicane`` of the geometry, thus its design tables
+    are reused by all callers; array geometry is not shared
+    """
+    if np.ndim(imagl) or np.ndim(idril):
+        return Chicane(imagl, idril)
+    key = (float(imagl), float(idril))
+    with _clock:
+        chi = _chicanes.get(key)
+        if chi is None:
+            chi = _chicanes[key] = Chicane(*key)
+    return chi
+
+
+def r56chi(gam0, ibfield, imagl=0.150, idril=0.285):
+    """
+    return r56 of chicane, ibfield: [T], arrays broadcast together
+    """
+    return getChicane(imagl, idril).getR56(gam0, ibfield)
+
+
+def bchi(gam0, r56, imagl=0.150, idril=0.285):
+    """
+    return dipole field [T] of chicane for r56 [m], inverse of r56chi
+    NaN for unreachable r56
+    """
+    return getChicane(imagl, idril).getField(gam0, r56)
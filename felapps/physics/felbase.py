@@ -4,9 +4,19 @@ Python module for the basis of free-electron laser calculation.
 """
 from __future__ import print_function
 
+import math
+import threading
+from collections import OrderedDict
+
 import numpy as np
 import scipy.special as sp
-from scipy.optimize import fsolve
+
+# input parameters of FELcalc, in the order of positional arguments
+FEL_PARAMS = ('beamEnergy', 'relativeEnergySpread', 'unduPeriodLength',
+              'avgBetaFunc', 'radWavelength', 'normEmittance', 'peakCurrent',
+              'bunchCharge', 'undulatorLength', 'bunchShape', 'undulatorType')
+# parameters given as strings rather than numbers
+STR_PARAMS = ('bunchShape', 'undulatorType')
 
 
 class PhysicalConstants(object):
@@ -31,6 +41,9 @@ class PhysicalConstants(object):
 
 class HalbachPerm(object):
     """
+    Undulator peak field of Halbach permanent magnet as the function of gap,
+    :math:`B_u = a e^{b g/\lambda_u + c (g/\lambda_u)^2}`
+
     Input parameters:
 
     :param _a: first Halbach parameter
@@ -38,6 +51,9 @@ class HalbachPerm(object):
     :parma _c: third Halbach parameter
     :param _lambdau: undulator period length, [mm]
     :parma _Bu: undulator magnetic field, [T]
+
+    All the parameters could be arrays that broadcast together, e.g.
+    per-element coefficients for undulators of different families.
     """
 
     def __init__(self, _a=3.33, _b=-5.47, _c=1.80, _lambdau=20, _Bu=1.0):
@@ -47,15 +63,64 @@ class HalbachPerm(object):
         self.lambdau = _lambdau
         self.Bu = _Bu
 
-    def findGap(self, gap0=10):
+    def findField(self, gap):
+        """
+        Calculate undulator field from gap value, the inverse of ``findGap``
+
+        :param gap: gap value, [mm]
+        :return: undulator magnetic field, [T]
         """
-	Solve undulator gap value
+        x = np.asarray(gap, dtype=float) / self.lambdau
+        return self.coef1 * np.exp(self.coef2 * x + self.coef3 * x**2)
+
+    def findGap(self, gap0=10, full_output=False):
+        """
+        Solve undulator gap value
+
+        Taking the logarithm, :math:`c x^2 + b x - \ln(B_u/a) = 0` with
+        :math:`x = g/\lambda_u` is solved in closed form, the physical root
+        is the one on the branch where field decreases with gap (b < 0),
+        written in the cancellation-free form
+        :math:`x = 2\ln(B_u/a) / (b - \sqrt{b^2 + 4c\ln(B_u/a)})`.
+
+        :param gap0: initial gap value, not used, kept for compatibility
+        :param full_output: if True, also return bool mask of reachable fields
+        :return: gap value in [mm], NaN where the field cannot be reached,
+                 i.e. beyond the field at zero gap or below the minimum field
+        """
+        lnb = np.log(np.asarray(self.Bu, dtype=float) / self.coef1)
+        b, c = self.coef2, self.coef3
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = b**2 + 4.0 * c * lnb
+            x = 2.0 * lnb / (b - np.sqrt(delta))
+            valid = (delta >= 0) & (x >= 0)
+            gap = np.where(valid, x * self.lambdau, np.nan)
+        if gap.ndim == 0:
+            gap, valid = gap[()], valid[()]
+        if full_output:
+            return gap, valid
+        return gap
+
+
+def aupmu(gap, xlamd, a=3.44, b=-5.00, c=1.54):
+    """
+    gap, xlamd: [mm]
+    field model is shared with HalbachPerm, see gapau for inverse
+    """
+    bfield = HalbachPerm(a, b, c, xlamd).findField(gap)
+    au = 0.934 * (xlamd / 10) * bfield / np.sqrt(2)
 
-	:param gap0: initial gap value vector, [mm]
-	:return: gap value in [mm]
-	"""
-        fbg = lambda x: self.Bu - self.coef1 * np.exp(self.coef2 * x / self.lambdau + self.coef3 * (x / self.lambdau)**2)
-        return fsolve(fbg, x0=gap0 * np.ones(np.size(self.Bu)))
+    return au
+
+
+def gapau(au, xlamd, a=3.44, b=-5.00, c=1.54, full_output=False):
+    """
+    return gap from au, inverse of aupmu, xlamd: [mm]
+    NaN for unreachable au, if full_output, also return reachable mask
+    """
+    bfield = au * np.sqrt(2) / 0.934 / (xlamd / 10)
+    return HalbachPerm(a, b, c, xlamd, bfield).findGap(
+        full_output=full_output)
 
 
 class FELcalc(PhysicalConstants):
@@ -74,7 +139,13 @@ class FELcalc(PhysicalConstants):
     :param p8: bunchCharge      [C]
     :param p9: undulatorLength  [m]
     :param p10: bunchShape, 'gaussian' or 'flattop'
-    :return res: dict, keys: "au", "bu", "gap", "sigmar", "rho1D", "rho3D", "Lg1D", "Lg3D", "Psat", "Pshot", "Pss"
+    :param p11: undulatorType, 'planar' or 'helical'
+    :return res: dict, keys: "au", "bu", "gap", "sigmar", "rho1D", "rho3D", "Lg1D", "Lg3D", "Psat", "Pshot", "Pss",
+                 ..., "satConverged" (bool, False where the saturation
+                 length did not converge)
+
+    All the parameters could be arrays that broadcast together, see also
+    ``felsweep`` for grid scans.
     """
 
     def __init__(self,
@@ -103,10 +174,23 @@ class FELcalc(PhysicalConstants):
         self.bunchShape = _bunchShape
         self.undulatorType = _undulatorType
 
-        if self.bunchShape == 'gaussian':
-            self.bunchratio = np.sqrt(2.0 * np.pi)
-        elif self.bunchShape == 'flattop':
-            self.bunchratio = 1.0
+        # bunchShape/undulatorType could also be arrays of strings
+        bunchShape = np.asarray(self.bunchShape)
+        unknown = ~np.isin(bunchShape, ('gaussian', 'flattop'))
+        if np.any(unknown):
+            raise ValueError("unknown bunchShape: %s" % ', '.join(
+                sorted(set(bunchShape[unknown].ravel().tolist()))))
+        self.bunchratio = np.where(
+            bunchShape == 'flattop', 1.0, np.sqrt(2.0 * np.pi))
+        if self.bunchratio.ndim == 0:
+            self.bunchratio = float(self.bunchratio)
+
+    def getShape(self):
+        """ return the broadcast shape of all input parameters,
+        () if all inputs are scalars
+        """
+        return np.broadcast(*[np.asarray(getattr(self, k))
+                              for k in FEL_PARAMS]).shape
 
     def onFELAnalyse(self):
         """
@@ -133,6 +217,8 @@ class FELcalc(PhysicalConstants):
         a18 = 2.9
         a19 = 3.2
 
+        shape = self.getShape()
+
         gamma0 = self.beamEnergy / 0.511
         eta = self.relativeEnergySpread
         lambdau = self.unduPeriodLength
@@ -145,11 +231,9 @@ class FELcalc(PhysicalConstants):
         sigmaBeam = np.sqrt(beta * epsilonn / gamma0)
         au = np.sqrt(lambdas * 2.0 * gamma0**2.0 / lambdau - 1)
 
-        if self.undulatorType == 'planar':
-            b = au**2.0 / 2.0 / (1 + au**2)
-            JJ = sp.jn(0, b) - sp.jn(1, b)
-        else:  # helical
-            JJ = 1.0
+        planar = np.asarray(self.undulatorType) == 'planar'
+        b = au**2.0 / 2.0 / (1 + au**2)
+        JJ = np.where(planar, sp.jn(0, b) - sp.jn(1, b), 1.0)  # helical: 1.0
 
         rho1D = ((1.0 / 2.0 / gamma0)**3.0 * Ipk / self.currentA *
                  (au * JJ * lambdau / 2.0 / np.pi / sigmaBeam)**2)**(1.0 / 3.0)
@@ -172,15 +256,11 @@ class FELcalc(PhysicalConstants):
 
         # update and return calculated parameters
         self.au = au
-        if self.undulatorType == 'planar':
-            self.K = au * np.sqrt(2.0)
-            self.Bu = self.K / 0.934 / (100 * lambdau)
-        else:  # helical
-            self.K = au
-            self.Bu = self.K / 0.934 / (100 * lambdau)
+        self.K = np.where(planar, au * np.sqrt(2.0), au)  # helical: au
+        self.Bu = self.K / 0.934 / (100 * lambdau)
 
         self.gu = HalbachPerm(
-            _lambdau=lambdau * 1000, _Bu=self.Bu).findGap(gap0=5)
+            _lambdau=lambdau * 1000, _Bu=self.Bu).findGap()
         self.sigmar = sigmaBeam
         self.rho1D = rho1D
         self.rho3D = rho3D
@@ -204,7 +284,7 @@ class FELcalc(PhysicalConstants):
         photonEnergy = self.h0 * self.c0 / self.e0 / lambdas  # eV
         Np = pulseEnergy / photonEnergy / self.e0  # photon per pulse
 
-        return {
+        result = {
             "01-au": self.au,
             "02-K": self.K,
             "03-Bu": self.Bu,
@@ -223,18 +303,210 @@ class FELcalc(PhysicalConstants):
             "16-PhotonEnergy": photonEnergy,
             "17-PulseEnergy": pulseEnergy * 1e6,
             "18-PhotonPerPulse": Np,
+            "19-satConverged": self.satConverged,
         }
 
+        # every quantity is expanded to the (broadcast) shape of inputs,
+        # as read-only views, scalar inputs give scalar outputs
+        for k, v in result.items():
+            v = np.broadcast_to(v, shape)
+            result[k] = v if shape else v[()]
+        return result
+
     def findSatFactor(self, nl, l3, xlamd, factor0=20):
         """ Calculator saturation length in the unit of 3D power gainlength
 
-        :param factor0: initial saturation factor, saturation length over power gain length
+        :param factor0: initial saturation factor, saturation length over power gain length,
+                        only kept for compatibility, see ``solveSatFactor``
         :param nl: electron count within one unit of FEL wavelength
         :param l3: power gain length (3D)
         :param xlamd: undulator period
+
+        the convergence mask is kept as ``satConverged``
+        """
+        x, info = solveSatFactor(nl, l3, xlamd, full_output=True)
+        self.satConverged = info['converged']
+        return x
+
+
+def solveSatFactor(nl, l3, xlamd, tol=1e-12, maxiter=8, full_output=False):
+    """ Solve saturation factor x (saturation length over 3D power gain
+    length) from :math:`6\sqrt{3\pi} N_\lambda L_g \sqrt{x} = \lambda_u e^x`
+    element by element.
+
+    With :math:`A = 6\sqrt{3\pi} N_\lambda L_g / \lambda_u`, the root on the
+    large branch is :math:`x = -W_{-1}(-2/A^2)/2`, which is then polished by
+    Newton iterations on :math:`x - \ln(x)/2 - \ln A = 0`.
+
+    :param nl: electron count within one unit of FEL wavelength
+    :param l3: power gain length (3D)
+    :param xlamd: undulator period
+    :param tol: tolerance of the residual of the logarithmic equation
+    :param maxiter: maximum Newton iterations
+    :param full_output: if True, also return dict with keys of
+                        'residual' and 'converged' (bool mask)
+    :return: saturation factor, in the broadcast shape of inputs,
+             NaN where no root exists (:math:`A^2 < 2e`)
+    """
+    lna = np.log(6.0 * np.sqrt(3.0 * np.pi) * np.asarray(nl, dtype=float) *
+                 l3 / xlamd)
+    z = -2.0 * np.exp(-2.0 * lna)
+    with np.errstate(invalid='ignore'):
+        x = np.where(z < -np.exp(-1.0), np.nan,
+                     -0.5 * sp.lambertw(np.maximum(z, -np.exp(-1.0)), k=-1).real)
+        for _ in range(maxiter):
+            res = x - 0.5 * np.log(x) - lna
+            if not (np.abs(res) > tol).any():
+                break
+            x = x - res / (1.0 - 0.5 / x)
+        res = x - 0.5 * np.log(x) - lna
+        converged = np.abs(res) <= tol
+    if x.ndim == 0:
+        x = x[()]
+    if full_output:
+        return x, {'residual': res, 'converged': converged}
+    return x
+
+
+def _checkParams(kws):
+    unknown = set(kws) - set(FEL_PARAMS)
+    if unknown:
+        raise TypeError("unexpected parameter(s): %s" % ', '.join(sorted(unknown)))
+
+
+def defaultParams():
+    """ return dict of the default input parameters of ``FELcalc``
+    """
+    return dict(zip(FEL_PARAMS, FELcalc.__init__.__defaults__))
+
+
+def makeGrid(**kws):
+    """ Expand the array-like input parameters into orthogonal axes of
+    a (sparse) grid, the axis order follows ``FEL_PARAMS``, scalars are
+    kept as they are.
+
+    :param kws: keyword arguments named as ``FEL_PARAMS``, e.g. ``beamEnergy``
+    :return: dict of parameters, which broadcast to the full grid
+    """
+    _checkParams(kws)
+    axes = [k for k in FEL_PARAMS if k in kws and np.size(kws[k]) > 1]
+    grid = dict(kws)
+    for i, k in enumerate(axes):
+        shape = [1] * len(axes)
+        shape[i] = -1
+        grid[k] = np.reshape(kws[k], shape)
+    return grid
+
+
+def felsweep(grid=True, **kws):
+    """ Evaluate M. Xie formulae over a parameter sweep, any subset of
+    ``FEL_PARAMS`` could be given as arrays, the others take the default
+    values of ``FELcalc``.
+
+    :param grid: if True, every array input spans one axis of the output
+                 grid (see ``makeGrid``), else arrays are broadcast together
+                 as they are, i.e. element-wise evaluation
+    :param kws: keyword arguments named as ``FEL_PARAMS``
+    :return: dict as ``FELcalc.onFELAnalyse``, every value is an ndarray of
+             the grid shape (read-only view)
+
+    Example (resonant 8 nm FEL with 30 mm undulator period, the defaults
+    are a hard x-ray FEL of 6 GeV, K is not real for 800-900 MeV there):
+    >>> r = felsweep(beamEnergy=np.linspace(800, 900, 11),
+    ...              peakCurrent=np.linspace(300, 600, 4),
+    ...              radWavelength=8e-9, unduPeriodLength=0.03,
+    ...              avgBetaFunc=10, normEmittance=1e-6)
+    >>> r['08-Lg3D'].shape
+    (11, 4)
+    >>> bool(np.isnan(r['08-Lg3D']).any())
+    False
+    """
+    _checkParams(kws)
+    if grid:
+        kws = makeGrid(**kws)
+    inst = FELcalc(**{'_' + k: v for k, v in kws.items()})
+    return inst.onFELAnalyse()
+
+
+class FELcache(object):
+    """
+    LRU cache of ``FELcalc.onFELAnalyse`` results for scalar inputs, the
+    numeric inputs are quantized to relative tolerance ``rtol`` to build
+    the key, i.e. nearly identical inputs share one result.
+
+    :param maxsize: maximum number of results to keep
+    :param rtol: relative tolerance for quantization of the inputs
+
+    Usage: res = FELcache().evaluate(p1, p2, ...), the same arguments as
+    ``FELcalc``; array inputs are not cached, evaluated directly.
+    """
+
+    def __init__(self, maxsize=1024, rtol=1e-9):
+        self.maxsize = maxsize
+        self.rtol = rtol
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._logstep = math.log1p(rtol) if rtol > 0 else None
+
+    def quantize(self, v):
+        """ quantize scalar v to the grid of relative step ``rtol``
+        """
+        if isinstance(v, str) or self._logstep is None or v == 0:
+            return v
+        return (v > 0, int(round(math.log(abs(v)) / self._logstep)))
+
+    def makeKey(self, *args, **kws):
+        """ return cache key of ``FELcalc`` arguments, None if not cacheable
+        """
+        params = defaultParams()
+        params.update(zip(FEL_PARAMS, args))
+        params.update((k.lstrip('_'), v) for k, v in kws.items())
+        key = []
+        for k in FEL_PARAMS:
+            v = params[k]
+            if isinstance(v, (float, int, np.number)):
+                v = float(v)
+            elif not isinstance(v, str):
+                if np.ndim(v) != 0:
+                    return None
+                v = float(v)
+            key.append(self.quantize(v))
+        return tuple(key)
+
+    def evaluate(self, *args, **kws):
+        """ return (shallow copy of) cached result, evaluate if missed
+        """
+        key = self.makeKey(*args, **kws)
+        if key is None:
+            return FELcalc(*args, **kws).onFELAnalyse()
+        with self._lock:
+            result = self._data.get(key)
+            if result is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return dict(result)
+            self.misses += 1
+        result = FELcalc(*args, **kws).onFELAnalyse()
+        with self._lock:
+            self._data[key] = result
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return dict(result)
+
+    def clear(self):
+        """ drop all the results and reset counters
+        """
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def info(self):
+        """ return dict of hits, misses, size and maxsize
         """
-        fx = lambda x: 6.0 * np.sqrt(3.0 * np.pi) * nl * l3 * np.sqrt(x) - xlamd * np.exp(x)
-        return fsolve(fx, x0=factor0 * np.ones(np.size(self.Lg3D)))
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._data), 'maxsize': self.maxsize}
 
 
 def test1():
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Headless batch evaluation of FEL estimations (M. Xie formulae) for
+parameter tables, without any GUI.
+
+Input table is CSV (header row with column names) or HDF5 (one 1-D dataset
+per column in the given group), column names should be the names of
+``felbase.FEL_PARAMS``, missing parameters take the default values of
+``felbase.FELcalc`` or the ones set by ``--set name=value``.
+
+Rows are streamed in chunks, evaluated in vectorized way and appended to
+output file (CSV or HDF5), thus memory is bounded by the chunk size.
+
+Usage: felformula-batch input.csv output.h5 --chunk 100000
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import csv
+import itertools
+import os
+import sys
+import time
+
+import numpy as np
+import h5py
+
+from . import felbase
+from .felbase import STR_PARAMS
+
+
+def _asColumn(name, values):
+    if name in STR_PARAMS:
+        return np.array(
+            [v.decode() if isinstance(v, bytes) else v for v in values])
+    return np.asarray(values, dtype=float)
+
+
+def _fileType(filename):
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in ('.h5', '.hdf5'):
+        return 'hdf5'
+    elif ext in ('.csv', '.txt', '.dat'):
+        return 'csv'
+    raise ValueError("unsupported file type: %s" % filename)
+
+
+class TableReader(object):
+    """ Read parameter table chunk by chunk
+
+    :param filename: CSV or HDF5 file
+    :param chunk: rows of each chunk
+    :param group: group of the columns in HDF5 file
+    """
+
+    def __init__(self, filename, chunk=100000, group='/'):
+        self.filename = filename
+        self.chunk = chunk
+        self.group = group
+        self.ftype = _fileType(filename)
+        self.nrows = None  # unknown for CSV
+
+    def __iter__(self):
+        if self.ftype == 'hdf5':
+            return self._readHDF5()
+        return self._readCSV()
+
+    def _readCSV(self):
+        with open(self.filename) as f:
+            reader = csv.reader(f)
+            names = [n.strip() for n in next(reader)]
+            felbase._checkParams(dict.fromkeys(names))
+            while True:
+                rows = list(itertools.islice(reader, self.chunk))
+                if not rows:
+                    break
+                cols = zip(*rows)
+                yield {n: _asColumn(n, [v.strip() for v in c])
+                       for n, c in zip(names, cols)}
+
+    def _readHDF5(self):
+        with h5py.File(self.filename, 'r') as f:
+            g = f[self.group]
+            names = list(g.keys())
+            felbase._checkParams(dict.fromkeys(names))
+            lengths = {n: g[n].shape[0] for n in names}
+            if len(set(lengths.values())) > 1:
+                raise ValueError(
+                    "columns of different lengths in %s: %s" %
+                    (self.filename, ', '.join(
+                        '%s=%d' % (n, lengths[n]) for n in names)))
+            self.nrows = lengths[names[0]] if names else 0
+            for i in range(0, self.nrows, self.chunk):
+                yield {n: _asColumn(n, g[n][i:i + self.chunk]) for n in names}
+
+
+class TableWriter(object):
+    """ Append chunks of input and result columns to CSV or HDF5 file,
+    in HDF5 file, inputs go to 'input/<name>' and results go to
+    'data/<key>' as extendable chunked datasets.
+
+    :param filename: CSV or HDF5 file
+    :param chunk: chunk size of HDF5 datasets
+    :param attrs: dict of fixed parameters, attributes of HDF5 file, or
+                  constant input columns of CSV file
+    """
+
+    def __init__(self, filename, chunk=100000, attrs=None):
+        self.filename = filename
+        self.chunk = chunk
+        self.ftype = _fileType(filename)
+        self.attrs = dict(attrs or {})
+        self.nrows = 0
+        if self.ftype == 'hdf5':
+            self.f = h5py.File(filename, 'w')
+            self.f.attrs['timestamp'] = time.strftime(
+                '%Y-%m-%d %H:%M:%S %Z', time.localtime())
+            self.f.attrs['app'] = 'felformula-batch'
+            for k, v in self.attrs.items():
+                self.f.attrs[k] = v
+        else:
+            self.f = open(filename, 'w')
+        self._names = None
+
+    def write(self, params, result):
+        """ write one chunk, params: dict of input columns,
+        result: dict returned by ``FELcalc.onFELAnalyse``
+        """
+        if self.ftype == 'hdf5':
+            inputs = params
+        else:  # no file attributes in CSV, fixed values as columns
+            inputs = dict(self.attrs)
+            inputs.update(params)
+        cols = [('input/' + k, inputs[k]) for k in felbase.FEL_PARAMS
+                if k in inputs]
+        cols += [('data/' + k, result[k]) for k in sorted(result)]
+        n = len(cols[-1][1])
+        if self.ftype == 'hdf5':
+            for name, v in cols:
+                v = np.asarray(v)
+                if v.dtype.kind == 'U':
+                    v = v.astype('S')
+                if name not in self.f:
+                    self.f.create_dataset(
+                        name, shape=(0, ), maxshape=(None, ),
+                        chunks=(min(self.chunk, max(n, 1)), ), dtype=v.dtype)
+                dset = self.f[name]
+                dset.resize((self.nrows + n, ))
+                dset[self.nrows:] = v
+        else:
+            if self._names is None:
+                self._names = [name.split('/', 1)[1] for name, _ in cols]
+                self.f.write(','.join(self._names) + '\n')
+            data = np.empty((n, len(cols)), dtype=object)
+            for j, (name, v) in enumerate(cols):
+                data[:, j] = np.broadcast_to(v, (n, ))
+            fmt = ['%s' if np.asarray(v).dtype.kind == 'U' else '%.8e'
+                   for _, v in cols]
+            np.savetxt(self.f, data, fmt=fmt, delimiter=',')
+        self.nrows += n
+
+    def close(self):
+        self.f.close()
+
+
+def evaluate(params, fixed=None):
+    """ Evaluate one chunk of parameter rows
+
+    :param params: dict of 1-D input columns, keys of ``FEL_PARAMS``
+    :param fixed: dict of parameters applied to all rows
+    :return: dict as ``FELcalc.onFELAnalyse``
+    """
+    kws = dict(fixed or {})
+    kws.update(params)
+    return felbase.felsweep(grid=False, **kws)
+
+
+def run(infile, outfile, chunk=100000, group='/', fixed=None,
+        verbose=True, stream=sys.stderr):
+    """ Evaluate parameter table from infile and save to outfile
+
+    :param infile: CSV or HDF5 parameter table
+    :param outfile: CSV or HDF5 output file
+    :param chunk: rows evaluated each time
+    :param group: group of the columns in HDF5 input file
+    :param fixed: dict of parameters applied to all rows
+    :return: total rows processed
+    """
+    reader = TableReader(infile, chunk=chunk, group=group)
+    writer = TableWriter(outfile, chunk=chunk, attrs=fixed)
+    t0 = time.time()
+    try:
+        for params in reader:
+            writer.write(params, evaluate(params, fixed))
+            if verbose:
+                dt = time.time() - t0
+                total = '' if reader.nrows is None else '/%d' % reader.nrows
+                print("%d%s rows, %.1f s, %.0f rows/s" %
+                      (writer.nrows, total, dt, writer.nrows / max(dt, 1e-9)),
+                      file=stream)
+    finally:
+        writer.close()
+    return writer.nrows
+
+
+def _parseFixed(items):
+    fixed = {}
+    for item in items or []:
+        k, v = item.split('=', 1)
+        k = k.strip()
+        fixed[k] = v.strip() if k in STR_PARAMS else float(v)
+    felbase._checkParams(fixed)
+    return fixed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Batch FEL estimation (M. Xie formulae) for parameter " +
+        "tables, without GUI.",
+        epilog="parameters: " + ', '.join(felbase.FEL_PARAMS))
+    parser.add_argument('infile', help="input parameter table, CSV or HDF5.")
+    parser.add_argument('outfile', help="output file, CSV or HDF5.")
+    parser.add_argument('--chunk', type=int, default=100000,
+                        help="rows evaluated each time, default: 100000.")
+    parser.add_argument('--group', default='/',
+                        help="group of input columns in HDF5 file.")
+    parser.add_argument('--set', dest='fixed', action='append',
+                        metavar='NAME=VALUE',
+                        help="set parameter for all rows, could be repeated.")
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help="do not report progress.")
+    args = parser.parse_args(argv)
+
+    nrows = run(args.infile, args.outfile, chunk=args.chunk,
+                group=args.group, fixed=_parseFixed(args.fixed),
+                verbose=not args.quiet)
+    return 0 if nrows else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -15,6 +15,7 @@ from wx.lib.wordwrap import wordwrap
 from . import felbase
 from ..utils import funutils
 from ..utils import parseutils
+from ..utils import writeservice
 import numpy as np
 
 import matplotlib
@@ -100,6 +101,9 @@ ychoice = {
     '18-PhotonPerPulse': [
         '$\mathrm{Photon\ \#/pulse}$', 'FEL photon number per pulse.'
     ],
+    '19-satConverged': [
+        '$\mathrm{Converged}$', 'Saturation length converged (1) or not (0).'
+    ],
 }
 
 #------------------------------------------------------------------------#
@@ -114,6 +118,7 @@ class MainFrame(wx.Frame):
             parent=parent, size=size, id=wx.ID_ANY, **kwargs)
         self.parent = parent
         self.appversion = appversion
+        self.felcache = felbase.FELcache(maxsize=256)
         #self.paramdict = {'00-info':{}, ''} # hierach dict to keep input & output parameters
         self.initUI()
 
@@ -355,7 +360,7 @@ class MainFrame(wx.Frame):
         self.paramdict['02-electron_beam'][
             'peak_current(A)'] = self.b1tc5.GetValue()
         self.paramdict['02-electron_beam'][
-            'bunch_shape'] = self.b1cb10.GetStringSelection()
+            'bunch_shape'] = self.b1cb10.GetValue()
         ## output
         self.paramdict['02-electron_beam'][
             'transverse_beam_size(m)'] = self.b2sb1vst7.GetLabel()
@@ -371,7 +376,7 @@ class MainFrame(wx.Frame):
         self.paramdict['03-undulator'][
             'total_length(m)'] = self.b1tc9.GetValue()
         self.paramdict['03-undulator'][
-            'type'] = self.b1cb11.GetStringSelection()
+            'type'] = self.b1cb11.GetValue()
         ## output
         self.paramdict['03-undulator'][
             'peak_field(T)'] = self.b2sb1vst1.GetLabel()
@@ -1141,17 +1146,16 @@ class MainFrame(wx.Frame):
         FELwvlth = float(self.b1tc7.GetValue())
         bunchCharge = float(self.b1tc8.GetValue())
         unduLength = float(self.b1tc9.GetValue())
-        bunchShape = self.b1cb10.GetStringSelection()
-        utype = self.b1cb11.GetStringSelection()
+        bunchShape = self.b1cb10.GetValue()
+        utype = self.b1cb11.GetValue()
 
         if not self.chkbox31.IsChecked():
-            instFEL = felbase.FELcalc(beamEnergy, energySpread, unduPeriod,
-                                      avgBeta, FELwvlth, normEmit, peakCurrent,
-                                      bunchCharge, unduLength, bunchShape,
-                                      utype)
-            result = instFEL.onFELAnalyse()
+            result = self.felcache.evaluate(beamEnergy, energySpread,
+                                            unduPeriod, avgBeta, FELwvlth,
+                                            normEmit, peakCurrent, bunchCharge,
+                                            unduLength, bunchShape, utype)
             self.b2sb1vst1.SetLabel('%.3f' % (result['03-Bu']))
-            self.b2sb1vst2.SetLabel('%.3f' % (result['04-gap'][0]))
+            self.b2sb1vst2.SetLabel('%.3f' % (result['04-gap']))
             self.b2sb1vst3.SetLabel('%.3f' % (result['02-K']))
             self.b2sb1vst4.SetLabel('%.3f' % (result['01-au']))
             self.b2sb1vst5.SetLabel('%.1f' % (result['14-sigmat']))
@@ -2118,23 +2122,47 @@ class DataSaveFrame(wx.Frame):
                           wx._controls.CheckBox) and v['obj'].IsChecked():
                 cols_selected_val.append(v['val'])
                 cols_selected_name.append(k)
-        if self.fmt == 'txt':
+        # write in writer thread, arrays of calculation are not modified
+        # in place, thus no copy
+        datafilename = self.datafilename
+        queued = writeservice.getWriter().submit(
+            self.writeData,
+            datafilename,
+            self.fmt,
+            cols_selected_val,
+            cols_selected_name,
+            callback=lambda res: wx.CallAfter(
+                self.onSaveDone, 'Saved data to ' + datafilename),
+            errback=lambda err: wx.CallAfter(
+                self.onSaveDone, 'Saving data to ' + datafilename +
+                ' fails: ' + str(err)),
+            block=False)
+        if not queued:
+            self.onSaveDone('Writer is busy, ' + datafilename +
+                            ' was not saved.')
+
+    @staticmethod
+    def writeData(datafilename, fmt, cols_selected_val, cols_selected_name):
+        if fmt == 'txt':
             np.savetxt(
-                self.datafilename,
+                datafilename,
                 np.vstack(cols_selected_val).T,
                 header=' '.join(cols_selected_name),
                 fmt='%.8e')
         else:  # hdf5
-            f = h5py.File(self.datafilename, 'w')
+            f = h5py.File(datafilename, 'w')
             for data, name in zip(cols_selected_val, cols_selected_name):
                 dset = f.create_dataset(
                     'data/' + name, shape=data.shape, dtype=data.dtype)
                 dset[...] = data
             f.close()
 
+    def onSaveDone(self, msg):
+        if not self:
+            return
         dial = wx.MessageDialog(
             self,
-            message='Saved data to ' + self.datafilename,
+            message=msg,
             caption="Data Saved Message",
             style=wx.OK)
         if dial.ShowModal() == wx.ID_YES:
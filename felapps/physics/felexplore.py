@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Multi-process parameter-space explorer for M. Xie formulae.
+
+The parameter grid (see ``felbase.makeGrid``) is split into blocks, each
+block is a hyperslab of the grid and is evaluated by ``FELcalc.onFELAnalyse``
+in a pool of worker processes, results are saved into one HDF5 file:
+
+- 'axes/<name>': values of each scanned parameter (grid axis)
+- 'data/<key>': results of the full grid shape, chunked by block
+- 'done': flag of each finished block, used to resume the run
+
+Usage:
+>>> exp = FELExplorer('scan.h5', chunk=200000,
+...                   beamEnergy=np.linspace(800, 1200, 101),
+...                   peakCurrent=np.linspace(300, 1000, 71), ...)
+>>> exp.run()  # run again to resume after interruption
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import itertools
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+import h5py
+
+from . import felbase
+
+
+def _evalBlock(params, axes, block):
+    """ evaluate one block of the grid, run in worker process
+    """
+    kws = dict(params)
+    for name, sl in zip(axes, block):
+        kws[name] = np.atleast_1d(kws[name][sl])
+    result = felbase.felsweep(grid=True, **kws)
+    return {k: np.ascontiguousarray(v) for k, v in result.items()}
+
+
+class FELExplorer(object):
+    """ Explore FEL parameter space in parallel
+
+    :param outfile: HDF5 file to save results
+    :param chunk: maximum grid points of one block
+    :param workers: number of worker processes, default: cpu count
+    :param kws: parameters of ``felbase.FEL_PARAMS``, arrays span grid axes
+    """
+
+    def __init__(self, outfile, chunk=100000, workers=None, **kws):
+        felbase._checkParams(kws)
+        self.outfile = outfile
+        self.chunk = max(int(chunk), 1)
+        self.workers = workers
+        self.axes = [k for k in felbase.FEL_PARAMS
+                     if k in kws and np.size(kws[k]) > 1]
+        self.params = {k: np.ravel(v) if k in self.axes else v
+                       for k, v in kws.items()}
+        self.shape = tuple(self.params[k].size for k in self.axes)
+        self.blocks = self.getBlocks()
+
+    def getBlocks(self):
+        """ split the grid into hyperslabs, each has at most ``chunk`` points,
+        return list of tuples of slices
+        """
+        shape = self.shape
+        if not shape:
+            return [()]
+        # the first axis k, along which ranges are taken
+        for k in range(len(shape)):
+            if int(np.prod(shape[k + 1:])) <= self.chunk:
+                break
+        m = max(1, self.chunk // int(np.prod(shape[k + 1:])))
+        lead = itertools.product(*[range(n) for n in shape[:k]])
+        blocks = []
+        for idx in lead:
+            for j in range(0, shape[k], m):
+                blocks.append(
+                    tuple(slice(i, i + 1) for i in idx) +
+                    (slice(j, j + m), ) +
+                    tuple(slice(None) for _ in shape[k + 1:]))
+        return blocks
+
+    def _diffParams(self, f):
+        """ names of parameters of which the saved axis values or fixed
+        value differ from the current ones
+        """
+        diff = []
+        for k, v in self.params.items():
+            if k in self.axes:
+                saved = f['axes/' + k][...] if 'axes/' + k in f else None
+            else:
+                saved = f.attrs.get(k)
+            v = np.asarray(v)
+            if saved is None:
+                diff.append(k)
+            elif v.dtype.kind == 'U':
+                saved = np.asarray(saved)
+                if saved.dtype.kind == 'S':
+                    saved = np.char.decode(saved)
+                if saved.shape != v.shape or np.any(saved != v):
+                    diff.append(k)
+            elif np.shape(saved) != v.shape or not np.allclose(
+                    saved, v, rtol=1e-12, atol=0):
+                diff.append(k)
+        return diff
+
+    def _initFile(self, resume):
+        """ open or create output file, return file object and done flags
+        """
+        if resume and os.path.isfile(self.outfile):
+            f = h5py.File(self.outfile, 'a')
+            axes = [a.decode() if isinstance(a, bytes) else a
+                    for a in f.attrs['axes']]
+            if axes != self.axes or tuple(f.attrs['shape']) != self.shape \
+                    or f['done'].shape != (len(self.blocks), ):
+                f.close()
+                raise ValueError(
+                    "%s is from another parameter grid." % self.outfile)
+            diff = self._diffParams(f)
+            if diff:
+                f.close()
+                raise ValueError(
+                    "%s is from other parameters: %s, remove it or run with "
+                    "resume=False." % (self.outfile, ', '.join(diff)))
+            return f, f['done'][...]
+
+        f = h5py.File(self.outfile, 'w')
+        f.attrs['timestamp'] = time.strftime('%Y-%m-%d %H:%M:%S %Z',
+                                             time.localtime())
+        f.attrs['app'] = 'felexplore'
+        f.attrs['axes'] = np.array(self.axes, dtype='S')
+        f.attrs['shape'] = self.shape
+        for k, v in self.params.items():
+            v = np.asarray(v)
+            if v.dtype.kind == 'U':
+                v = v.astype('S')
+            if k in self.axes:
+                f.create_dataset('axes/' + k, data=v)
+            else:
+                f.attrs[k] = v
+        bshape = tuple(
+            len(range(*sl.indices(n))) for sl, n in zip(self.blocks[0],
+                                                        self.shape))
+        keys = felbase.felsweep(**{k: np.asarray(v).ravel()[:1]
+                                   for k, v in self.params.items()}).keys()
+        for k in keys:
+            f.create_dataset(
+                'data/' + k,
+                shape=self.shape,
+                dtype=np.float64,
+                chunks=bshape or None,
+                fillvalue=np.nan)
+        f.create_dataset('done', shape=(len(self.blocks), ), dtype=bool)
+        return f, np.zeros(len(self.blocks), dtype=bool)
+
+    def run(self, resume=True, verbose=True, stream=sys.stderr):
+        """ evaluate all the (remaining) blocks, the parent process writes
+        each finished block into its hyperslab and flags it as done
+
+        :param resume: if True, skip blocks done in existing outfile, which
+                       must be of the same axes and fixed parameters
+                       (ValueError otherwise)
+        :return: number of blocks evaluated in this run
+        """
+        f, done = self._initFile(resume)
+        todo = [i for i in range(len(self.blocks)) if not done[i]]
+        ndone, nblk = int(done.sum()), len(self.blocks)
+        t0, count, points = time.time(), 0, 0
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                maxpending = 2 * (self.workers or os.cpu_count() or 1)
+                pending, todo = {}, iter(todo)
+                while True:
+                    for i in itertools.islice(todo,
+                                              maxpending - len(pending)):
+                        fut = pool.submit(_evalBlock, self.params, self.axes,
+                                          self.blocks[i])
+                        pending[fut] = i
+                    if not pending:
+                        break
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for fut in finished:
+                        i = pending.pop(fut)
+                        for k, v in fut.result().items():
+                            f['data/' + k][self.blocks[i]] = v
+                        f['done'][i] = True
+                        f.flush()
+                        count += 1
+                        points += v.size
+                        if verbose:
+                            dt = time.time() - t0
+                            print("%d/%d blocks, %.1f s, %.0f points/s" %
+                                  (ndone + count, nblk, dt,
+                                   points / max(dt, 1e-9)),
+                                  file=stream)
+        finally:
+            f.close()
+        return count
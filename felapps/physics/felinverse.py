@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Inverse FEL design: solve a subset of ``FELcalc`` inputs for targets on
+its outputs, e.g. undulator period and beta function for the given
+saturation length and photon energy.
+
+Many independent design problems are solved at once by Levenberg-Marquardt
+iterations, the objective and its Jacobian (forward differences) of all
+the problems are evaluated in one vectorized ``felbase.felsweep`` call.
+
+Beside the inputs of ``felbase.FEL_PARAMS``, undulator gap 'gap' [mm]
+could be one unknown, which defines the radiation wavelength through the
+``HalbachPerm`` field model; the gap of every solution is checked against
+the same model (coefficients ``halbach``) for feasibility.
+
+Usage:
+>>> r = felDesign({'12-Lsat': [16, 18, 20], '16-PhotonEnergy': 40.0},
+...               {'unduPeriodLength': (0.015, 0.05), 'gap': (4, 30)},
+...               fixed={'beamEnergy': 800, 'peakCurrent': 600,
+...                      'undulatorLength': 30},
+...               mingap=4.0)
+>>> np.round(r['unduPeriodLength'], 4), np.round(r['gap'], 2)
+(array([0.0325, 0.0379, 0.0434]), array([ 8.58, 12.19, 16.27]))
+>>> r['success'], r['feasible']
+(array([ True,  True,  True]), array([ True,  True,  True]))
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import numpy as np
+
+from . import felbase
+
+# status of each problem returned by ``felDesign``
+STATUS_SUCCESS = 0  # cost <= tol
+STATUS_NOT_CONVERGED = 1  # best solution found, cost > tol
+STATUS_FAILED = 2  # no finite step could be solved, e.g. NaN Jacobian
+
+
+def gap2wavelength(gap, lambdau, energy, halbach=None, utype='planar'):
+    """ resonant wavelength [m] from undulator gap [mm], period [m] and
+    beam energy [MeV], field model ``HalbachPerm`` with coefficients of
+    ``halbach`` (a, b, c)
+    """
+    a, b, c = halbach or felbase.HalbachPerm.__init__.__defaults__[:3]
+    bu = felbase.HalbachPerm(a, b, c, lambdau * 1000).findField(gap)
+    K = 0.934 * bu * lambdau * 100
+    au = np.where(np.asarray(utype) == 'planar', K / np.sqrt(2.0), K)
+    gamma0 = energy / 0.511
+    return lambdau * (1.0 + au**2) / 2.0 / gamma0**2
+
+
+def field2gap(bu, lambdau, halbach=None):
+    """ undulator gap [mm] from field [T] and period [m], field model
+    ``HalbachPerm`` with coefficients of ``halbach`` (a, b, c), inverse of
+    the field model of ``gap2wavelength``
+    """
+    a, b, c = halbach or felbase.HalbachPerm.__init__.__defaults__[:3]
+    return felbase.HalbachPerm(a, b, c, np.asarray(lambdau) * 1000,
+                               bu).findGap()
+
+
+class _Problem(object):
+    """ maps normalized unknowns u in [0, 1] to the relative residuals
+    of all the problems
+    """
+
+    def __init__(self, targets, unknowns, fixed, weights, halbach):
+        self.keys = sorted(targets)
+        self.names = sorted(unknowns)
+        self.fixed = dict(fixed)
+        self.halbach = halbach
+        bounds = np.array([unknowns[k][:2] for k in self.names], dtype=float)
+        self.lo, self.hi = bounds[:, 0], bounds[:, 1]
+        tgt = np.broadcast_arrays(*[np.asarray(targets[k], dtype=float)
+                                    for k in self.keys])
+        self.npts = int(np.broadcast(
+            tgt[0], *[np.asarray(v) for v in self.fixed.values()]).size)
+        self.targets = np.stack(
+            [np.broadcast_to(t, (self.npts, )) for t in tgt], axis=-1)
+        w = weights or {}
+        self.weights = np.array([w.get(k, 1.0) for k in self.keys])
+
+    def inputs(self, u):
+        """ inputs dict from u of shape (points, ..., unknowns)
+        """
+        x = self.lo + u * (self.hi - self.lo)
+        extra = (1, ) * (u.ndim - 2)
+        kws = {k: np.reshape(np.broadcast_to(np.asarray(v), (self.npts, )),
+                             (self.npts, ) + extra)
+               for k, v in self.fixed.items()}
+        for i, k in enumerate(self.names):
+            kws[k] = x[..., i]
+        if 'gap' in kws:
+            p = felbase.defaultParams()
+            p.update(kws)
+            kws['radWavelength'] = gap2wavelength(
+                kws.pop('gap'), p['unduPeriodLength'], p['beamEnergy'],
+                self.halbach, p['undulatorType'])
+        return kws
+
+    def evaluate(self, u):
+        """ return FELcalc results and weighted relative residuals,
+        shape (points, ..., targets)
+        """
+        result = felbase.felsweep(grid=False, **self.inputs(u))
+        f = np.stack([result[k] for k in self.keys], axis=-1)
+        tgt = self.targets.reshape(
+            (self.npts, ) + (1, ) * (u.ndim - 2) + (len(self.keys), ))
+        return result, self.weights * (f - tgt) / tgt
+
+
+def felDesign(targets,
+              unknowns,
+              fixed=None,
+              weights=None,
+              x0=None,
+              mingap=None,
+              halbach=None,
+              maxiter=100,
+              tol=1e-10,
+              rstep=1e-6):
+    """ Solve FELcalc inputs for targets on outputs
+
+    :param targets: dict of output key (e.g. '12-Lsat') to target values,
+                    arrays broadcast to the number of problems
+    :param unknowns: dict of input name (``FEL_PARAMS`` or 'gap' [mm]) to
+                     bounds (lower, upper)
+    :param fixed: dict of the other inputs, arrays broadcast to problems
+    :param weights: dict of output key to weight of its relative residual
+    :param x0: dict of initial values of unknowns, default: bounds center
+    :param mingap: minimum undulator gap [mm] for feasibility
+    :param halbach: (a, b, c) of ``HalbachPerm``, default model if None
+    :param maxiter: maximum iterations
+    :param tol: tolerance of the cost (sum of squared relative residuals)
+    :param rstep: step for finite differences, relative to bounds width
+    :return: dict of solved unknowns, 'result' (FELcalc outputs at
+             solution), 'cost', 'success' (cost <= tol), 'feasible'
+             (finite outputs, reachable gap not smaller than ``mingap``,
+             saturation within undulator length) and 'status' (see
+             ``STATUS_*``); unknowns, results and cost of failed problems
+             (no finite step) are NaN, the other problems are not affected
+    """
+    fixed = dict(fixed or {})
+    felbase._checkParams(dict(
+        fixed, **{k: None for k in unknowns if k != 'gap'}))
+    if 'gap' in unknowns and 'radWavelength' in unknowns:
+        raise ValueError("'gap' and 'radWavelength' are not independent.")
+    prob = _Problem(targets, unknowns, fixed, weights, halbach)
+    n, npts = len(prob.names), prob.npts
+
+    u = np.full((npts, n), 0.5)
+    for i, k in enumerate(prob.names):
+        if x0 is not None and k in x0:
+            u[:, i] = (np.asarray(x0[k], dtype=float) - prob.lo[i]) / (
+                prob.hi[i] - prob.lo[i])
+    u = np.clip(u, 0.0, 1.0)
+
+    def cost_of(r):
+        c = np.sum(r**2, axis=-1)
+        return np.where(np.isfinite(c), c, np.inf)
+
+    _, r = prob.evaluate(u)
+    cost = cost_of(r)
+    lam = np.full(npts, 1e-3)
+    eye = np.eye(n)
+    failed = np.zeros(npts, dtype=bool)
+    for _ in range(maxiter):
+        active = (cost > tol) & ~failed
+        if not active.any():
+            break
+        # forward differences, u and u + h e_i stacked: (points, n + 1, n)
+        us = np.repeat(u[:, None, :], n + 1, axis=1)
+        h = np.where(u > 0.5, -rstep, rstep)
+        us[:, 1:, :] += h[:, None, :] * eye
+        _, rs = prob.evaluate(us)
+        jac = (rs[:, 1:, :] - rs[:, :1, :]) / h[:, :, None]
+        jac = np.swapaxes(jac, 1, 2)  # (points, targets, n)
+        jac = np.where(np.isfinite(jac), jac, 0.0)
+        r0 = np.where(np.isfinite(rs[:, 0, :]), rs[:, 0, :], 0.0)
+        jtj = np.einsum('pti,ptj->pij', jac, jac)
+        jtr = np.einsum('pti,pt->pi', jac, r0)
+        a = jtj + lam[:, None, None] * (jtj * eye + 1e-12 * eye)
+        du = -_solveSteps(a, jtr)
+        failed |= active & ~np.all(np.isfinite(du), axis=-1)
+        active &= ~failed
+        du = np.where(active[:, None], du, 0.0)
+        unew = np.clip(u + du, 0.0, 1.0)
+        _, rnew = prob.evaluate(unew)
+        cnew = cost_of(rnew)
+        better = active & (cnew < cost)
+        u = np.where(better[:, None], unew, u)
+        cost = np.where(better, cnew, cost)
+        lam = np.where(better, lam * 0.3, lam * 10.0)
+        if not (active & (lam < 1e12)).any():
+            break
+
+    result, _ = prob.evaluate(u)
+    x = prob.lo + u * (prob.hi - prob.lo)
+    x[failed] = np.nan
+    cost = np.where(failed, np.nan, cost)
+    result = {k: np.where(failed, np.nan, v) if np.asarray(v).dtype.kind
+              == 'f' else v for k, v in result.items()}
+    ret = {k: x[:, i] for i, k in enumerate(prob.names)}
+
+    feasible = np.all(np.isfinite([result[k] for k in prob.keys]), axis=0)
+    bu = result['03-Bu']
+    if 'gap' in ret:
+        gap = ret['gap']
+    else:  # gap of the field, by the same model as gap2wavelength
+        p = felbase.defaultParams()
+        p.update(prob.inputs(u))
+        gap = field2gap(bu, p['unduPeriodLength'], halbach)
+    feasible &= np.isfinite(gap) & np.isfinite(bu)
+    if mingap is not None:
+        feasible &= gap >= mingap
+    ulen = prob.inputs(u).get('undulatorLength',
+                              felbase.defaultParams()['undulatorLength'])
+    feasible &= result['12-Lsat'] <= ulen
+    feasible &= ~failed
+    success = cost <= tol
+    status = np.where(success, STATUS_SUCCESS, STATUS_NOT_CONVERGED)
+    status[failed] = STATUS_FAILED
+    ret.update(result=result, cost=cost, success=success,
+               feasible=feasible, status=status)
+    return ret
+
+
+def _solveSteps(a, b):
+    """ solve a x = b of every problem, a: (points, n, n), b: (points, n),
+    least squares for singular a, NaN for the problems still unsolvable
+    """
+    try:
+        return np.linalg.solve(a, b[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        pass
+    x = np.full(b.shape, np.nan)
+    for i in range(a.shape[0]):
+        if not (np.all(np.isfinite(a[i])) and np.all(np.isfinite(b[i]))):
+            continue
+        try:
+            x[i] = np.linalg.lstsq(a[i], b[i], rcond=None)[0]
+        except np.linalg.LinAlgError:
+            pass
+    return x
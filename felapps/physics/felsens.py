@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Sensitivity analysis of M. Xie formulae, i.e. derivatives of the outputs
+of ``FELcalc.onFELAnalyse`` with respect to the inputs, for tolerance
+studies.
+
+All the perturbed inputs of a batch of operating points are stacked into
+one array, evaluated by one vectorized ``felbase.felsweep`` call, and then
+differentiated by central differences. Complex-step is not applicable
+since the formulae go through non-analytic functions (Lambert W, abs,
+branch selection).
+
+Usage:
+>>> jac = felJacobian({'beamEnergy': e, 'peakCurrent': i},
+...                   outputs=['08-Lg3D', '09-Psat', '12-Lsat'])
+>>> jac.shape  # (points, outputs, inputs)
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import numpy as np
+
+from . import felbase
+
+# parameters could be differentiated against
+NUM_PARAMS = tuple(k for k in felbase.FEL_PARAMS
+                   if k not in felbase.STR_PARAMS)
+
+
+def felJacobian(points, inputs=None, outputs=None, rstep=1e-5,
+                hessian=False, hstep=1e-4, chunk=20000):
+    """ Jacobian of FEL outputs at a batch of operating points
+
+    :param points: dict of input parameters, arrays broadcast together to
+                   the points (1-D), missing ones take ``FELcalc`` defaults
+    :param inputs: names to differentiate against, default: ``NUM_PARAMS``
+    :param outputs: result keys, default: all the real-valued keys, sorted
+    :param rstep: relative finite difference step (absolute for zero input)
+    :param hessian: if True, also return the diagonal of Hessian
+    :param hstep: relative step for Hessian, larger than ``rstep`` to
+                  suppress round-off error of second differences
+    :param chunk: points evaluated in one batch, to bound memory
+    :return: array of shape (points, outputs, inputs), with diagonal of
+             Hessian of the same shape if ``hessian`` is True
+    """
+    felbase._checkParams(points)
+    inputs = list(NUM_PARAMS if inputs is None else inputs)
+    bad = set(inputs) - set(NUM_PARAMS)
+    if bad:
+        raise ValueError("cannot differentiate against: %s" %
+                         ', '.join(sorted(bad)))
+    params = felbase.defaultParams()
+    params.update(points)
+    npts = np.broadcast(*[np.asarray(v) for v in params.values()]).size
+    params = {k: np.broadcast_to(np.asarray(v), (npts, ))
+              for k, v in params.items()}
+    if outputs is None:
+        outputs = sorted(k for k, v in felbase.FELcalc().onFELAnalyse().items()
+                         if np.asarray(v).dtype.kind == 'f')
+
+    nin, nout = len(inputs), len(outputs)
+    jac = np.empty((npts, nout, nin))
+    hess = np.empty((npts, nout, nin)) if hessian else None
+    for i0 in range(0, npts, chunk):
+        sl = slice(i0, min(i0 + chunk, npts))
+        p = {k: v[sl] for k, v in params.items()}
+        f0, fp, fm, h = _diffChunk(p, inputs, outputs, rstep)
+        jac[sl] = (fp - fm) / (2.0 * h)
+        if hessian:
+            f0, fp, fm, h = _diffChunk(p, inputs, outputs, hstep)
+            hess[sl] = (fp - 2.0 * f0 + fm) / h**2
+    if hessian:
+        return jac, hess
+    return jac
+
+
+def _diffChunk(params, inputs, outputs, rstep):
+    """ evaluate one chunk of points with stacked perturbed inputs, columns:
+    [x, x + h_0, x - h_0, x + h_1, x - h_1, ...], return f(x), f(x + h),
+    f(x - h) and the actual steps h (after rounding)
+    """
+    nin = len(inputs)
+    kws = {k: v[:, None] for k, v in params.items()}
+    steps = []
+    for i, k in enumerate(inputs):
+        x = np.asarray(params[k], dtype=float)
+        h = rstep * np.where(x != 0, np.abs(x), 1.0)
+        xs = np.repeat(x[:, None], 2 * nin + 1, axis=1)
+        xs[:, 2 * i + 1] += h
+        xs[:, 2 * i + 2] -= h
+        steps.append(0.5 * (xs[:, 2 * i + 1] - xs[:, 2 * i + 2]))
+        kws[k] = xs
+    steps = np.stack(steps, axis=-1)[:, None, :]  # (points, 1, inputs)
+    result = felbase.felsweep(grid=False, **kws)
+    f = np.stack([result[k] for k in outputs], axis=1)
+    return f[:, :, :1], f[:, :, 1::2], f[:, :, 2::2], steps
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Interpolation surrogate of M. Xie formulae for real-time evaluation.
+
+The outputs of ``FELcalc.onFELAnalyse`` are tabulated on a grid over the
+chosen inputs (e.g. beam energy, peak current, emittance), the grid is
+refined adaptively until the interpolation error at the cell midpoints
+is below tolerance, then queries are served by vectorized interpolation.
+Positive quantities are tabulated in logarithm, which is much closer to
+linear for the power-law like Xie formulae.
+
+Usage:
+>>> s = FELsurrogate({'beamEnergy': (800, 1200),
+...                   'peakCurrent': (300, 1000)},
+...                  fixed={'radWavelength': 30e-9})
+>>> s.build(tol=1e-3)
+>>> s.converged  # False (with RuntimeWarning) if stopped before tol
+True
+>>> s.save('surrogate.npz')
+>>> s = FELsurrogate.load('surrogate.npz')
+>>> s.evaluate(beamEnergy=e, peakCurrent=i)['08-Lg3D']
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import warnings
+
+import numpy as np
+from scipy.interpolate import RegularGridInterpolator
+
+from . import felbase
+
+
+class FELsurrogate(object):
+    """ Surrogate of ``FELcalc.onFELAnalyse`` over a regular grid
+
+    :param axes: dict of input name to (min, max) or initial nodes (array)
+    :param fixed: dict of other inputs, fixed values
+    :param keys: result keys to tabulate, default: all the real-valued
+                 ones (not the '19-satConverged' mask)
+    :param method: interpolation method of ``RegularGridInterpolator``,
+                   'linear' (default), 'cubic', 'pchip', etc., spline
+                   methods need finite results over the whole domain
+    """
+
+    def __init__(self, axes, fixed=None, keys=None, method='linear'):
+        fixed = dict(fixed or {})
+        felbase._checkParams(dict(axes, **fixed))
+        if set(axes) & set(fixed):
+            raise ValueError("parameters both scanned and fixed: %s" %
+                             ', '.join(sorted(set(axes) & set(fixed))))
+        # axis order follows felbase.FEL_PARAMS, as makeGrid does
+        self.names = [k for k in felbase.FEL_PARAMS if k in axes]
+        self.nodes = []
+        for k in self.names:
+            v = np.asarray(axes[k], dtype=float)
+            if v.size == 2:
+                v = np.linspace(v[0], v[1], 5)
+            self.nodes.append(np.unique(v))
+        self.fixed = fixed
+        self.keys = keys
+        self.method = method
+        self.table = None
+        self.logscale = None
+        self.error = None
+        self.converged = None
+        self._interp = None
+
+    def _exact(self, nodes):
+        """ evaluate the exact formulae on grid of nodes,
+        return array of shape (*grid, nkeys)
+        """
+        kws = dict(self.fixed)
+        kws.update(zip(self.names, nodes))
+        result = felbase.felsweep(grid=True, **kws)
+        if self.keys is None:
+            self.keys = sorted(k for k, v in result.items()
+                               if v.dtype.kind == 'f')
+        return np.stack([result[k] for k in self.keys], axis=-1)
+
+    def _transform(self, values):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.logscale, np.log(values), values)
+
+    def _inverse(self, values):
+        return np.where(self.logscale, np.exp(values), values)
+
+    def _setTable(self, values):
+        if self.logscale is None:
+            self.logscale = np.all(values > 0, axis=tuple(
+                range(values.ndim - 1)))
+        self.table = self._transform(values)
+        self._initInterp()
+
+    def _initInterp(self):
+        self._interp = RegularGridInterpolator(
+            self.nodes,
+            self.table,
+            method=self.method,
+            bounds_error=False,
+            fill_value=np.nan)
+
+    def _relerr(self, approx, exact):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.abs(approx - exact) / np.abs(exact)
+
+    def _midSplits(self, tol):
+        """ nodes to insert along each axis: midpoints of the intervals
+        whose maximum relative error exceeds ``tol``, all axes checked on
+        the current grid
+        """
+        splits = []
+        for d in range(len(self.names)):
+            mid = 0.5 * (self.nodes[d][1:] + self.nodes[d][:-1])
+            nodes = list(self.nodes)
+            nodes[d] = mid
+            pts = np.stack(np.meshgrid(*nodes, indexing='ij'), axis=-1)
+            err = self._relerr(self.evaluateTable(pts), self._exact(nodes))
+            # maximum error of each interval along axis d, NaN ignored
+            err = np.fmax.reduce(
+                np.moveaxis(err, d, 0).reshape(mid.size, -1), axis=1)
+            splits.append(mid[err > tol])
+        return splits
+
+    def _sampleSplits(self, pts, err, tol):
+        """ nodes to insert along each axis: midpoints of the cells
+        containing sample points ``pts`` whose error ``err`` exceeds ``tol``
+        """
+        bad = np.fmax.reduce(err, axis=-1) > tol
+        splits = []
+        for x, p in zip(self.nodes, pts):
+            i = np.clip(np.searchsorted(x, p[bad]) - 1, 0, x.size - 2)
+            splits.append(0.5 * (x[i] + x[i + 1]))
+        return splits
+
+    def build(self, tol=1e-3, maxiter=8, maxpoints=10**6, nvalid=2000):
+        """ tabulate the formulae, refine the grid until the relative error
+        at cell midpoints and at ``nvalid`` random points is below ``tol``
+
+        :param tol: relative error tolerance
+        :param maxiter: maximum refinement iterations
+        :param maxpoints: maximum grid points
+        :param nvalid: random points to estimate the error bound
+        :return: dict of estimated maximum relative error of each key
+
+        ``converged`` is set False (and RuntimeWarning issued) if
+        ``maxiter`` or ``maxpoints`` stopped the refinement before the
+        error is below ``tol``.
+        """
+        self._setTable(self._exact(self.nodes))
+        self.converged = False
+        for it in range(maxiter + 1):
+            splits = self._midSplits(tol)
+            if not any(x.size for x in splits):
+                pts, err = self._sample(nvalid, seed=it)
+                splits = self._sampleSplits(pts, err, tol)
+                if not any(x.size for x in splits):
+                    self.converged = True
+                    break
+            nodes = [np.union1d(x, split)
+                     for x, split in zip(self.nodes, splits)]
+            if it == maxiter or np.prod([x.size for x in nodes]) > maxpoints:
+                break
+            self.nodes = nodes
+            self._setTable(self._exact(self.nodes))
+        self.error = self.validate(nvalid, seed=maxiter + 1)
+        if self.converged and any(e > tol for e in self.error.values()):
+            self.converged = False
+        if not self.converged:
+            warnings.warn(
+                "surrogate not converged to tol=%g, grid %s, maximum error "
+                "%s" % (tol, 'x'.join(str(x.size) for x in self.nodes),
+                        ', '.join('%s: %.3g' % (k, e)
+                                  for k, e in self.error.items() if e > tol)),
+                RuntimeWarning)
+        return self.error
+
+    def _sample(self, npoints, seed=None):
+        """ random points in domain, as list of arrays of each axis,
+        and relative error of shape (npoints, nkeys), NaN where the exact
+        or interpolated result is not finite
+        """
+        rng = np.random.RandomState(seed)
+        pts = [rng.uniform(x[0], x[-1], npoints) for x in self.nodes]
+        kws = dict(self.fixed)
+        kws.update(zip(self.names, pts))
+        exact = felbase.felsweep(grid=False, **kws)
+        exact = np.stack([exact[k] for k in self.keys], axis=-1)
+        approx = self.evaluateTable(np.stack(pts, axis=-1))
+        return pts, self._relerr(approx, exact)
+
+    def validate(self, npoints=2000, seed=None):
+        """ estimate maximum relative error at random points in domain,
+        return dict of key to error, NaN for keys without finite results
+        """
+        err = np.fmax.reduce(self._sample(npoints, seed)[1], axis=0)
+        return dict(zip(self.keys, err.tolist()))
+
+    def evaluateTable(self, pts):
+        """ interpolate at points of shape (..., ndim),
+        return array of shape (..., nkeys)
+        """
+        return self._inverse(self._interp(pts))
+
+    def evaluate(self, **kws):
+        """ interpolate at the given inputs (broadcast together), NaN for
+        points outside of the domain
+
+        :param kws: values of all the scanned inputs
+        :return: dict of result keys to arrays
+        """
+        missing = set(self.names) - set(kws)
+        if missing:
+            raise TypeError("missing parameter(s): %s" %
+                            ', '.join(sorted(missing)))
+        vals = np.broadcast_arrays(*[np.asarray(kws[k], dtype=float)
+                                     for k in self.names])
+        res = self.evaluateTable(np.stack(vals, axis=-1))
+        return {k: res[..., i] for i, k in enumerate(self.keys)}
+
+    def save(self, filename):
+        """ save the table to .npz file
+        """
+        data = {'axis_' + k: x for k, x in zip(self.names, self.nodes)}
+        data.update({'fixed_' + k: np.asarray(v)
+                     for k, v in self.fixed.items()})
+        np.savez(
+            filename,
+            names=np.array(self.names),
+            keys=np.array(self.keys),
+            method=np.array(self.method),
+            table=self.table,
+            logscale=self.logscale,
+            error=np.array([self.error.get(k, np.nan) for k in self.keys])
+            if self.error else np.array([]),
+            **data)
+
+    @classmethod
+    def load(cls, filename):
+        """ load table from .npz file saved by ``save``
+        """
+        with np.load(filename) as f:
+            names = [str(k) for k in f['names']]
+            fixed = {k[6:]: f[k][()] for k in f.files if k.startswith('fixed_')}
+            fixed = {k: str(v) if isinstance(v, np.str_) else v
+                     for k, v in fixed.items()}
+            inst = cls({k: f['axis_' + k] for k in names}, fixed=fixed,
+                       keys=[str(k) for k in f['keys']],
+                       method=str(f['method']))
+            inst.nodes = [f['axis_' + k] for k in names]
+            inst.logscale = f['logscale']
+            inst.table = f['table']
+            if f['error'].size:
+                inst.error = dict(zip(inst.keys, f['error'].tolist()))
+        inst._initInterp()
+        return inst
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Propagation of radiation fields (e.g. Genesis .dfl slices) on a fixed
+transverse grid: far-field intensity, and Fresnel propagation over free
+space by the angular spectrum method.
+
+One ``FieldPropagator`` serves one grid size, workspaces, the shift mask
+and the transfer functions of distances are allocated once and reused,
+FFTs are done by ``scipy.fft`` (pocketfft, plans cached internally for
+the repeated shape) with multiple threads; stacks of slices (..., n, n)
+are transformed in one call.
+
+Usage:
+>>> prop = getPropagator(512)
+>>> farfield = prop.farfield(efield)        # one slice or a stack
+>>> fields = prop.propagate(efield, [0.5, 1.0, 2.0], dx=1e-5, wavelength=1e-8)
+>>> intensity, farfield = readfld('rad.out.dfl', ncar=121)  # Genesis file
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import scipy.fft
+
+
+class FieldPropagator(object):
+    """ Propagator of complex fields on n x n grid
+
+    :param ncar: grid points of each dimension
+    :param workers: threads of FFT, default: all cores
+    :param ncache: transfer functions (distances) to be cached
+    """
+
+    def __init__(self, ncar, workers=None, ncache=16):
+        self.ncar = ncar
+        self.workers = workers or os.cpu_count() or 1
+        self.ncache = ncache
+        self._lock = threading.Lock()
+        self._work = np.empty((ncar, ncar), dtype=np.complex128)
+        # for even ncar, fftshift of the spectrum is done by multiplying
+        # (-1)^(i+j) in the near field, thus no extra copy
+        if ncar % 2 == 0:
+            i = np.arange(ncar)
+            self._mask = 1.0 - 2.0 * ((i[:, None] + i[None, :]) % 2)
+        else:
+            self._mask = None
+        self._tf = OrderedDict()
+
+    def _check(self, efield):
+        efield = np.asarray(efield)
+        if efield.shape[-2:] != (self.ncar, self.ncar):
+            raise ValueError("field shape %s does not match grid %d x %d" %
+                             (efield.shape, self.ncar, self.ncar))
+        return efield
+
+    def _spectrum(self, efield, shift):
+        """ 2D FFT of field(s), shifted zero frequency to center if
+        ``shift``, slices of 2D field reuse workspace
+        """
+        if efield.ndim == 2:
+            work = self._work
+            if shift and self._mask is not None:
+                np.multiply(efield, self._mask, out=work)
+            else:
+                work[...] = efield
+            wexy = scipy.fft.fft2(work, overwrite_x=True,
+                                  workers=self.workers)
+        else:
+            copied = shift and self._mask is not None
+            if copied:
+                efield = efield * self._mask
+            wexy = scipy.fft.fft2(efield, overwrite_x=copied,
+                                  workers=self.workers)
+        if shift and self._mask is None:
+            wexy = scipy.fft.fftshift(wexy, axes=(-2, -1))
+        return wexy
+
+    def farfield(self, efield, out=None):
+        """ far-field intensity, |FFT(E)|^2 with zero frequency at center
+
+        :param efield: complex field of shape (ncar, ncar), or stack of
+                       fields (..., ncar, ncar)
+        :param out: output array of the same shape, optional
+        """
+        efield = self._check(efield)
+        with self._lock:
+            wexy = self._spectrum(efield, True)
+            if out is None:
+                out = np.empty(wexy.shape)
+            np.multiply(wexy.real, wexy.real, out=out)
+            out += wexy.imag**2
+        return out
+
+    def intensity(self, efield):
+        """ near-field intensity, sum of |E|^2 over the grid (last two axes)
+        """
+        efield = self._check(efield)
+        e = efield.reshape(efield.shape[:-2] + (-1, ))
+        if e.ndim == 1:
+            return np.vdot(e, e).real
+        return np.einsum('...i,...i->...', e.real, e.real) + np.einsum(
+            '...i,...i->...', e.imag, e.imag)
+
+    def transfer(self, z, dx, wavelength):
+        """ transfer function of free space over distance ``z`` [m], in the
+        FFT order, cached by (z, dx, wavelength)
+
+        :param dx: grid spacing [m]
+        :param wavelength: radiation wavelength [m]
+        """
+        key = (float(z), float(dx), float(wavelength))
+        tf = self._tf.get(key)
+        if tf is not None:
+            self._tf.move_to_end(key)
+            return tf
+        f = scipy.fft.fftfreq(self.ncar, d=dx)
+        f2 = f[:, None]**2 + f[None, :]**2
+        tf = np.exp(-1j * np.pi * wavelength * z * f2)
+        self._tf[key] = tf
+        if len(self._tf) > self.ncache:
+            self._tf.popitem(last=False)
+        return tf
+
+    def propagate(self, efield, z, dx, wavelength):
+        """ Fresnel propagation of field(s) over distance(s)
+
+        :param efield: field (ncar, ncar) or stack (..., ncar, ncar)
+        :param z: distance [m], or 1-D array of distances
+        :param dx: grid spacing [m]
+        :param wavelength: radiation wavelength [m]
+        :return: field(s) at ``z``, distances as the leading axis if ``z``
+                 is an array, i.e. shape (nz, ..., ncar, ncar)
+        """
+        efield = self._check(efield)
+        zs = np.atleast_1d(z)
+        with self._lock:
+            spec = self._spectrum(efield, False)
+            tfs = np.stack([self.transfer(zi, dx, wavelength) for zi in zs])
+            tfs = tfs.reshape((zs.size, ) + (1, ) * (efield.ndim - 2) +
+                              tfs.shape[1:])
+            # spectrum of 2D field could be the workspace, used up before
+            # releasing the lock
+            spec = spec * tfs
+        fields = scipy.fft.ifft2(spec, overwrite_x=True, workers=self.workers)
+        return fields if np.ndim(z) else fields[0]
+
+
+_propagators = {}
+_plock = threading.Lock()
+
+
+def getPropagator(ncar, workers=None):
+    """ return shared ``FieldPropagator`` of the grid size ``ncar``
+    """
+    with _plock:
+        prop = _propagators.get((ncar, workers))
+        if prop is None:
+            prop = _propagators[(ncar, workers)] = FieldPropagator(
+                ncar, workers=workers)
+    return prop
+
+
+def openfld(filename, ncar=121):
+    """
+    memory-map Genesis radiation field file (.dfl) as complex array of
+    shape (nslice, ncar, ncar), no data is read until accessed
+    """
+    fld = np.memmap(filename, dtype=np.complex128, mode='r')
+    return fld.reshape(-1, ncar, ncar)
+
+
+def fldslice(efield):
+    """
+    return near-field intensity (sum of |E|^2) and far-field (|FFT(E)|^2)
+    of one slice of complex field
+    """
+    prop = getPropagator(efield.shape[-1])
+    return prop.intensity(efield), prop.farfield(efield)
+
+
+def iterfld(filename, ncar=121, start=0, stop=None, step=1):
+    """
+    generator of (intensity, farfield) of time slices of .dfl file,
+    only one slice is in memory at a time
+    """
+    fld = openfld(filename, ncar)
+    for i in range(*slice(start, stop, step).indices(fld.shape[0])):
+        yield fldslice(fld[i])
+
+
+def fldhistory(filename, ncar=121, chunk=16):
+    """
+    return near-field intensity of every slice (array) and far-field
+    summed over all slices, streamed by ``chunk`` slices at a time
+    """
+    fld = openfld(filename, ncar)
+    prop = getPropagator(ncar)
+    intp, farsum = [], np.zeros((ncar, ncar))
+    for i in range(0, fld.shape[0], chunk):
+        efield = fld[i:i + chunk]
+        intp.append(prop.intensity(efield))
+        farsum += prop.farfield(efield).sum(axis=0)
+    return np.concatenate(intp), farsum
+
+
+def readfld(filename, ncar=121, islice=0):
+    """
+    return near-field intensity and far-field of one slice (first one
+    by default) of .dfl file
+    """
+    return fldslice(openfld(filename, ncar)[islice])
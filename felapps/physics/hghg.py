@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Macro-particle engine for the longitudinal phase space of HGHG
+(high-gain harmonic generation): energy modulation by the seed laser in
+the modulator, then dispersion by the chicane.
+
+Phase space coordinates are laser phase theta [rad] and normalized energy
+deviation p = (gamma - gamma0) / sigma_gamma, particle arrays are
+allocated once and updated in place, thus the modulator and the chicane
+could be scanned at interactive rates.
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import numpy as np
+import scipy.special as sp
+
+from .felbase import PhysicalConstants
+
+
+class HGHGPhaseSpace(PhysicalConstants):
+    """
+    Longitudinal phase space of HGHG
+
+    :param npart: number of macro-particles
+    :param gam0: central Lorentz factor
+    :param sigg: rms energy spread, in the unit of gamma
+    :param nlambda: phase range of particles, in laser wavelength
+    :param seed: seed of random numbers
+    :param power: laser peak power, [W]
+    :param waist: laser beam waist size, [m]
+    :param wavelength: laser wavelength, [m]
+
+    Laser and modulator parameters are attributes, could be changed before
+    calling ``modulate``: ``power``, ``waist``, ``wavelength``, and
+
+    :param xlamd: modulator period length, [m]
+    :param nwig: modulator period number
+    """
+
+    def __init__(self, npart=100000, gam0=587.87, sigg=0.01174, nlambda=1,
+                 seed=None, power=1.0e6, waist=1.0e-3, wavelength=300e-9):
+        self.gam0 = gam0
+        self.sigg = sigg
+        self.power = power
+        self.waist = waist
+        self.wavelength = wavelength
+        self.xlamd = 0.05
+        self.nwig = 10
+
+        rng = np.random.RandomState(seed)
+        self.theta0 = rng.uniform(0, 2.0 * np.pi * nlambda, npart)
+        self.p0 = rng.standard_normal(npart)
+        self.pmod = self.p0.copy()  # after modulator
+        self.thetachi = self.theta0.copy()  # after chicane
+        self._buf = np.empty(npart)
+        self.amod = 0.0  # modulation amplitude, in the unit of sigg
+        self.bchi = 0.0  # dispersion strength, k_L * R56 * sigg / gam0
+
+    def getModAmplitude(self, au):
+        """ energy modulation amplitude, in the unit of sigg,
+        :math:`\\Delta\\gamma = \\sqrt{P_L/P_0} \\cdot 2 K L_u [JJ] / (\\gamma_0 w_0)`,
+        :math:`P_0 = I_A m c^2 / e` (planar modulator)
+
+        :param au: rms undulator parameter, i.e. K / sqrt(2)
+        """
+        K = au * np.sqrt(2.0)
+        xi = K**2 / (4.0 + 2.0 * K**2)
+        jj = sp.jn(0, xi) - sp.jn(1, xi)
+        p0 = self.currentA * 0.511e6  # W
+        lu = self.xlamd * self.nwig
+        return np.sqrt(self.power / p0) * 2.0 * K * lu * jj / (
+            self.gam0 * self.waist) / self.sigg
+
+    def modulate(self, au=None, amp=None, phase=0.0):
+        """ energy modulation in modulator, in place: p = p0 + A sin(theta + phi)
+
+        :param au: rms undulator parameter of modulator
+        :param amp: modulation amplitude A (unit of sigg), overrides ``au``
+        :param phase: laser phase, [rad]
+        """
+        self.amod = self.getModAmplitude(au) if amp is None else amp
+        np.add(self.theta0, phase, out=self._buf)
+        np.sin(self._buf, out=self._buf)
+        np.multiply(self._buf, self.amod, out=self._buf)
+        np.add(self.p0, self._buf, out=self.pmod)
+        self.disperse(bchi=self.bchi)
+
+    def disperse(self, r56=None, bchi=None):
+        """ dispersion by chicane, in place: theta = theta0 + B p
+
+        :param r56: R56 of chicane, [m]
+        :param bchi: dimensionless dispersion B, overrides ``r56``
+        """
+        if bchi is None:
+            bchi = 2.0 * np.pi / self.wavelength * r56 * self.sigg / self.gam0
+        self.bchi = bchi
+        np.multiply(self.pmod, bchi, out=self._buf)
+        np.add(self.theta0, self._buf, out=self.thetachi)
+
+    def bunching(self, harmonics=1):
+        """ bunching factor |<exp(-i n theta)>| of dispersed beam at
+        harmonic(s) n
+        """
+        harm = np.atleast_1d(harmonics)
+        b = np.empty(harm.shape)
+        for i, n in enumerate(harm):
+            np.multiply(self.thetachi, n, out=self._buf)
+            c = np.cos(self._buf).mean()
+            s = np.sin(self._buf).mean()
+            b[i] = np.hypot(c, s)
+        return b if np.ndim(harmonics) else b[0]
+
+    def bunchingTheory(self, harmonics=1):
+        """ analytical bunching factor, |J_n(-nAB)| exp(-n^2 B^2 / 2)
+        """
+        n = np.asarray(harmonics, dtype=float)
+        a, b = self.amod, self.bchi
+        return np.abs(sp.jv(n, -n * a * b)) * np.exp(-0.5 * (n * b)**2)
+
+    def getPhaseSpace(self, stage='mod', nmax=8192):
+        """ return (theta, p) views of phase space, at most ``nmax`` particles
+        for display
+
+        :param stage: 'mod' (after modulator) or 'chi' (after chicane)
+        """
+        step = max(1, -(-self.p0.size // nmax))
+        if stage == 'mod':
+            return self.theta0[::step], self.pmod[::step]
+        return self.thetachi[::step], self.pmod[::step]
@@ -128,11 +128,8 @@ class AnalysisFrame(myui.PlotFrame):
             self.plotpanel.axes.set_ylabel('$y$', fontsize=self.fontsize + 4)
             self.plotpanel.refresh()
 
-            # lines
-            self.plotpanel.set_lines()
-
-            # set output
-            self.set_fit_output()
+            # lines, set output when fits are done
+            self.plotpanel.set_lines(callback=self.set_fit_output)
 
             # grid color
             self.grid_color = '#000000'
@@ -7,9 +7,12 @@ import epics
 import time
 from datetime import datetime
 import numpy as np
+import h5py
 
+from . import writeservice
 from .uiutils import EditListFrame, EditFrame
 from .funutils import ScanDataFactor, set_staticbmp_color, pick_color
+from .funutils import getFileToSave
 from .funclistframe import FuncListFrame
 
 
@@ -234,7 +237,54 @@ class DataScanFrame(dsfui.DataScanFrame):
 
     # menu items events leave to be implemented
     def save_mitemOnMenuSelection(self, event):
-        pass
+        """ save scan data into hdf5 file, in writer thread
+        """
+        if getattr(self, 'scan_output_all', None) is None:
+            return
+        savetofilename = getFileToSave(self, ext='hdf5')
+        if savetofilename is None:
+            return
+        # scan arrays are updated in place (retake), save a copy
+        data = {
+            'var1': self.var1_range_array.copy(),
+            'output': self.scan_output_all.reshape(
+                self.var1_range_num, self.shotnum_val, 2).copy(),
+        }
+        attrs = {
+            'var1_pv': self.var1_set_PV.pvname,
+            'var2_pv': self.var2_get_PV.pvname,
+            'shotnum': self.shotnum_val,
+            'stop_timestamp': getattr(self, 'stop_timestamp', ''),
+        }
+        queued = writeservice.getWriter().submit(
+            self._write_scan_data, savetofilename, data, attrs,
+            callback=lambda res: wx.CallAfter(
+                self._log_save, 'Scan data saved to %s.\n' % savetofilename,
+                wx.BLUE),
+            errback=lambda err: wx.CallAfter(
+                self._log_save, 'Saving scan data to %s fails: %s\n' %
+                (savetofilename, err), wx.RED),
+            block=False)
+        if not queued:
+            self._log_save('Writer is busy, %s was not saved.\n' %
+                           savetofilename, wx.RED)
+
+    @staticmethod
+    def _write_scan_data(filename, data, attrs):
+        with h5py.File(filename, 'w') as f:
+            rg = f.create_group('scan')
+            rg.attrs['timestamp'] = time.strftime('%Y-%m-%d %H:%M:%S %Z',
+                                                  time.localtime())
+            for k, v in attrs.items():
+                rg.attrs[k] = v
+            for k, v in data.items():
+                rg.create_dataset(k, data=v)
+
+    def _log_save(self, msg, color):
+        if not self:
+            return
+        self.mode_tc.SetDefaultStyle(wx.TextAttr(color))
+        self.mode_tc.AppendText(msg)
 
     def exit_mitemOnMenuSelection(self, event):
         pass
@@ -22,6 +22,7 @@ from . import funutils
 from . import pltutils
 from . import imageutils
 from . import resutils
+from . import fitservice
 
 
 class DataWorkshop(wx.Frame):
@@ -715,12 +716,15 @@ class StatPanel(wx.Frame):
         self.Bind(wx.EVT_BUTTON, self.onCentralPosStat, showxypos_btn)
         self.Bind(wx.EVT_BUTTON, self.onRadiusStat, showradius_btn)
         self.Bind(wx.EVT_BUTTON, self.onExit, exit_btn)
+        # enabled when fits are done
+        self.fit_btns = (showxypos_btn, showradius_btn)
 
     def onExit(self, event):
         self.Close(True)
 
     def postInit(self):
-        self.data_fit = self.gaussian_fit_all()
+        self.data_fit = None
+        self.gaussian_fit_all()
 
     def onIntensityStatHist(self, event):
         self.statIntArray = np.array([
@@ -784,21 +788,60 @@ class StatPanel(wx.Frame):
         self.plotpanel.refresh()
 
     def gaussian_fit_all(self):
-        x0_list = []
-        y0_list = []
-        sx_list = []
-        sy_list = []
-        for f in self.datafiles:
-            data = h5py.File(f, 'r')['image']['data'][...]
-            hx, hy = data.sum(0), data.sum(1)
-            x, y = np.arange(hx.size), np.arange(hy.size)
-            x0, sx = funutils.gaussian_fit(x, hx, mode='simple')
-            y0, sy = funutils.gaussian_fit(y, hy, mode='simple')
-            x0_list.append(x0)
-            y0_list.append(y0)
-            sx_list.append(sx)
-            sy_list.append(sy)
-        return {'x0': x0_list, 'y0': y0_list, 'sx': sx_list, 'sy': sy_list}
+        """ gaussian fits of projections of all data files, files read in
+        worker thread and fitted in parallel by the fitting service, without
+        blocking the GUI, ``data_fit`` is set by ``onFitDone`` when all the
+        fits are done
+        """
+        for btn in self.fit_btns:
+            btn.Disable()
+        thread = threading.Thread(
+            target=self._fitFiles, args=(list(self.datafiles), ),
+            name='statfit')
+        thread.daemon = True
+        thread.start()
+
+    def _fitFiles(self, datafiles):
+        profiles = []
+        try:
+            for f in datafiles:
+                with h5py.File(f, 'r') as h5:
+                    data = h5['image']['data'][...]
+                hx, hy = data.sum(0), data.sum(1)
+                x, y = np.arange(hx.size), np.arange(hy.size)
+                profiles.extend([(x, hx), (y, hy)])
+        except (OSError, IOError, KeyError) as err:
+            wx.CallAfter(self.onFitDone, None, err)
+            return
+        fitservice.getService().fitManyAsync(
+            profiles, lambda results: wx.CallAfter(self.onFitDone, results))
+
+    def onFitDone(self, results, err=None):
+        if not self:  # closed while fitting
+            return
+        if err is not None:
+            dial = wx.MessageDialog(
+                self,
+                message=u"Cannot read data files for fitting: %s" % err,
+                caption=u"Fitting Error",
+                style=wx.OK | wx.ICON_ERROR | wx.CENTRE)
+            dial.ShowModal()
+            dial.Destroy()
+            return
+
+        def value(r, name):  # NaN (not plotted) for failed fits
+            if r is None or not r.success:
+                return np.nan
+            return r.params[name].value
+
+        self.data_fit = {
+            'x0': [value(r, 'x0') for r in results[0::2]],
+            'sx': [value(r, 'xstd') for r in results[0::2]],
+            'y0': [value(r, 'x0') for r in results[1::2]],
+            'sy': [value(r, 'xstd') for r in results[1::2]],
+        }
+        for btn in self.fit_btns:
+            btn.Enable()
 
 
 #class PlotPanel(pltutils.ImagePanelxy):
@@ -19,10 +19,13 @@ import wx
 import epics
 import time
 import os
+import subprocess
+import threading
 import numpy as np
 from . import funutils
 from . import pltutils
 from . import resutils
+from ..physics import hghg
 import matplotlib.pyplot as plt
 
 ID_POWER = wx.NewId()
@@ -54,6 +57,13 @@ class ModdsPanel(wx.Frame):
         super(self.__class__, self).__init__(
             parent=parent, id=wx.ID_ANY, **kwargs)
         self.parent = parent
+        self.hghg = hghg.HGHGPhaseSpace(npart=100000)
+        self.modgap = None  # last modulator gap [mm]
+        self.chifield = None  # last chicane field [T] and geometry
+        self.laserphase = 0.0  # seed laser phase [rad]
+        self._diag_lock = threading.Lock()
+        self._diag_thread = None
+        self._diag_pending = False
         self.InitUI()
 
 #------------------------------------------------------------------------#
@@ -327,45 +337,106 @@ class ModdsPanel(wx.Frame):
 
 # update phasespace after mod and chi
 
-    def OnUpdatePS(self, psid='mod', newval=0):
-        import numpy as np
-        import os
-        gam0 = 587.87
-        sigg = 0.01174
+    def OnUpdatePS(self, psid='mod', newval=0, geometry=None):
+        """ update phase space plots by in-process macro-particle tracking,
+        psid: 'mod', newval is modulator gap [mm];
+              'chi', newval is chicane field [T], geometry is (imagl, idril)
+              of chicane [m], from chicane panel (or default) if None
+        """
+        self.syncLaser()
         if psid == 'mod':  ## modulation
+            self.modgap = newval
             au = funutils.aupmu(newval, 50)
-            modfilecmd = 'sed -i "s/aw0.*/aw0=' + str(
-                au) + '/;s/awd.*/awd=' + str(au) + '/i" ../sim/mod.in'
-            os.system(modfilecmd)
-            os.system('cd ../sim; bash runmod.sh')
-            file = open('../sim/mod.out.dpa', 'rb')
-            data = np.fromfile(file, dtype='double').reshape(6, 8192)
-            self.psmodgraph.x, self.psmodgraph.y = data[1, :], (
-                data[0, :] - gam0) / sigg
+            self.hghg.modulate(au, phase=self.laserphase)
+            self.psmodgraph.x, self.psmodgraph.y = self.hghg.getPhaseSpace(
+                'mod')
             self.psmodgraph.repaint()
 
         elif psid == 'chi':  ## dispersed
-            modfilecmd = 'sed -i "s/ibfield.*/ibfield=' + str(
-                newval) + '/i" ../sim/modp.in'
-            os.system(modfilecmd)
-            os.system('cd ../sim; bash runchi.sh')
-            file = open('../sim/modp.out.dpa', 'rb')
-            data = np.fromfile(file, dtype='double').reshape(6, 8192)
-            self.pschigraph.x, self.pschigraph.y = data[1, :], (
-                data[0, :] - gam0) / sigg
+            if geometry is None and getattr(self, 'chipanel', None):
+                geometry = self.chipanel.getGeometry()
+            geometry = tuple(geometry or ())
+            self.chifield = (newval, geometry)
+            r56 = funutils.r56chi(self.hghg.gam0, newval, *geometry)
+            self.hghg.disperse(r56)
+            self.pschigraph.x, self.pschigraph.y = self.hghg.getPhaseSpace(
+                'chi')
             self.pschigraph.repaint()
 
-            ## update pv
-            os.system('cd ../sim; bash rundiag.sh')
-            intp, farfield = funutils.readfld('../sim/rad_diag.out.dfl')
-            #print intp, farfield.size
+            ## update pv, simulation in background
+            self.startDiag()
+
+#------------------------------------------------------------------------#
 
-            import epics
-            fieldarrpv = epics.PV('DCLS:DIAG:PROF:ARR')
-            fieldintpv = epics.PV('DCLS:DIAG:PROF:INT:SET')
-            farfieldarr = np.array(farfield, dtype=np.double).flatten()
-            fieldarrpv.put(farfieldarr)
-            fieldintpv.put(intp)
+    def syncLaser(self):
+        """ laser parameters of phase space from laser panel, if opened
+        """
+        if getattr(self, 'laserpanel', None):
+            try:
+                power, waist, wavelength, phase = self.laserpanel.getLaser()
+            except ValueError:  # invalid input, keep the last ones
+                return
+            self.laserphase = phase
+            self.hghg.power = power
+            self.hghg.waist = waist
+            self.hghg.wavelength = wavelength
+
+#------------------------------------------------------------------------#
+
+    def setLaser(self):
+        """ laser parameters changed, update phase space
+        """
+        if self.modgap is not None:
+            self.OnUpdatePS(psid='mod', newval=self.modgap)
+        if self.chifield is not None:
+            self.OnUpdatePS('chi', *self.chifield)
+
+#------------------------------------------------------------------------#
+
+    def startDiag(self, simdir='../sim'):
+        """ run radiation diagnostic simulation and update PVs, simulation
+        in worker thread, requests while running are merged into one more
+        run
+        """
+        with self._diag_lock:
+            if self._diag_thread is not None:
+                self._diag_pending = True
+                return
+            self._diag_thread = threading.Thread(
+                target=self._runDiag, args=(simdir, ), name='rundiag')
+            self._diag_thread.daemon = True
+        self._diag_thread.start()
+
+    def _runDiag(self, simdir):
+        while True:
+            with self._diag_lock:
+                self._diag_pending = False
+            try:
+                retcode = subprocess.call(['bash', 'rundiag.sh'], cwd=simdir)
+                if retcode != 0:
+                    raise OSError("rundiag.sh exited with status %d" % retcode)
+                intp, farfield = funutils.readfld(
+                    os.path.join(simdir, 'rad_diag.out.dfl'))
+            except (OSError, IOError, ValueError) as err:
+                wx.CallAfter(self._diagDone, None, None, err)
+            else:
+                wx.CallAfter(self._diagDone, intp, farfield, None)
+            with self._diag_lock:
+                if not self._diag_pending:
+                    self._diag_thread = None
+                    return
+
+    def _diagDone(self, intp, farfield, err):
+        if not self:
+            return
+        if err is not None:
+            self.sb.SetStatusText('Diagnostic simulation failed: %s' % err)
+            return
+        fieldarrpv = epics.PV('DCLS:DIAG:PROF:ARR')
+        fieldintpv = epics.PV('DCLS:DIAG:PROF:INT:SET')
+        farfieldarr = np.array(farfield, dtype=np.double).flatten()
+        fieldarrpv.put(farfieldarr)
+        fieldintpv.put(intp)
 
 #------------------------------------------------------------------------#
 
@@ -1171,6 +1242,8 @@ class LaserConfigPanel(wx.Frame):
         self.Bind(wx.EVT_TEXT_ENTER, self.OnTextEnter, self.imgsrc_tc)
         self.Bind(wx.EVT_TEXT_ENTER, self.OnUpdateParams, self.item12tc)
         self.Bind(wx.EVT_TEXT_ENTER, self.OnUpdateParams, self.item32tc)
+        self.Bind(wx.EVT_TEXT_ENTER, self.OnUpdateParams, self.item52tc)
+        self.Bind(wx.EVT_TEXT_ENTER, self.OnUpdateParams, self.item62tc)
 
         ## create a timer
         self.timer = wx.Timer(self)
@@ -1199,6 +1272,19 @@ class LaserConfigPanel(wx.Frame):
             epics.PV('OPA:POWER:SET').put(obj.GetValue())
         elif obj.GetId() == ID_OMEGA:
             epics.PV('OPA:OMEGA:SET').put(obj.GetValue())
+        self.parent.setLaser()
+
+#------------------------------------------------------------------------#
+
+    def getLaser(self):
+        """ return laser peak power [W], waist size [m], wavelength [m] and
+        phase [rad]
+        """
+        power = float(self.item12tc.GetValue())
+        waist = float(self.item32tc.GetValue())
+        wavelength = float(self.item62tc.GetValue()) * 1e-9
+        phase = float(self.item52tc.GetValue())
+        return power, waist, wavelength, phase
 
 #------------------------------------------------------------------------#
 
@@ -2149,11 +2235,19 @@ class ChiConfigPanel(wx.Frame):
 
         ## bind events
         self.Bind(wx.EVT_SPINCTRLDOUBLE, self.OnUpdateParams, self.item32sc)
+        self.Bind(wx.EVT_TEXT_ENTER, self.OnSetR56, self.item42tc)
 
         ## create a timer
         #self.timer = wx.Timer(self)
         #self.Bind(wx.EVT_TIMER, self.OnUpdate, self.timer)
 
+#------------------------------------------------------------------------#
+
+    def getGeometry(self):
+        imagl = float(self.item12tc.GetValue())
+        idril = float(self.item22tc.GetValue())
+        return imagl, idril
+
 #------------------------------------------------------------------------#
 
     def OnUpdateParams(self, event):
@@ -2163,10 +2257,45 @@ class ChiConfigPanel(wx.Frame):
 
         curval = epics.PV('DCLS:CHIFIELD').get()
         gam0 = 587.87
-        r56 = funutils.r56chi(gam0, curval) * 1e3
-        self.parent.OnUpdatePS(psid='chi', newval=curval)
+        r56 = funutils.r56chi(gam0, curval, *self.getGeometry()) * 1e3
+        self.parent.OnUpdatePS(
+            psid='chi', newval=curval, geometry=self.getGeometry())
         self.item42tc.SetValue('%.3f' % (r56))
 
+#------------------------------------------------------------------------#
+
+    def OnSetR56(self, event):
+        """ set dipole field from the input R56 [mm]
+        """
+        gam0 = 587.87
+        try:
+            r56 = float(self.item42tc.GetValue()) * 1e-3
+        except ValueError:
+            dial = wx.MessageDialog(
+                self,
+                message=u"R56 should be a number in mm.",
+                caption=u"R56 Input Error",
+                style=wx.OK | wx.ICON_ERROR | wx.CENTRE)
+            dial.ShowModal()
+            dial.Destroy()
+            return
+        ibfield = funutils.bchi(gam0, r56, *self.getGeometry())
+        bmin, bmax = self.item32sc.GetMin(), self.item32sc.GetMax()
+        if not (np.isfinite(ibfield) and bmin <= ibfield <= bmax):
+            dial = wx.MessageDialog(
+                self,
+                message=u"R56 of %.3f mm is not reachable, dipole field "
+                u"should be within %.2f-%.2f T." % (r56 * 1e3, bmin, bmax),
+                caption=u"R56 Input Error",
+                style=wx.OK | wx.ICON_ERROR | wx.CENTRE)
+            dial.ShowModal()
+            dial.Destroy()
+            return
+        self.item32sc.SetValue(float(ibfield))
+        epics.PV('DCLS:CHIFIELD:SET').put(float(ibfield))
+        self.parent.OnUpdatePS(
+            psid='chi', newval=float(ibfield), geometry=self.getGeometry())
+
 #------------------------------------------------------------------------#
 
     def OnHelp(self, event):
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+fitting service, gaussian fits of profiles in worker pool:
+    fitGaussian: fit one profile, warm start from given parameters
+    FitResult  : fitting result, with ``params`` (lmfit.Parameters) as
+                 the result of lmfit.minimize, usable by FitModels
+    FitService : request queue of fits, one pending request per source
+                 (only the latest frame is fitted), results delivered by
+                 callback in the worker thread
+"""
+
+from __future__ import division
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+import lmfit
+
+
+class FitResult(object):
+    """ result of one profile fit
+
+    :param params: fitted parameters, lmfit.Parameters
+    :param success: if converged with finite parameters
+    :param nfev: number of function evaluations
+    :param message: message of minimizer
+    """
+
+    def __init__(self, params, success, nfev=0, message=''):
+        self.params = params
+        self.success = success
+        self.nfev = nfev
+        self.message = message
+
+    def values(self):
+        return {k: p.value for k, p in self.params.items()}
+
+
+def _gaussian(p, x):
+    v = p.valuesdict()
+    return v['a'] * np.exp(-(x - v['x0'])**2 / 2.0 / v['xstd']**2) + v['y0']
+
+
+def _residual(p, x, y):
+    return _gaussian(p, x) - y
+
+
+def gaussianGuess(x, y):
+    """ initial parameters of gaussian from moments of profile
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x0 = np.sum(x * y) / np.sum(y)
+        xstd = (np.sum((x - x0)**2 * y) / np.sum(y))**0.5
+    return {'a': np.max(y), 'x0': x0, 'xstd': xstd, 'y0': 0.0}
+
+
+def fitGaussian(x, y, p0=None, maxfev=200):
+    """ gaussian fit of profile, a * exp(-(x-x0)^2/2/xstd^2) + y0
+
+    :param x: coordinates
+    :param y: profile
+    :param p0: dict of initial parameters (a, x0, xstd, y0), e.g. from the
+               fit of the previous frame, moment guess if None
+    :param maxfev: maximum function evaluations, bounds the fitting time
+    :return: FitResult
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    p0 = p0 or gaussianGuess(x, y)
+    params = lmfit.Parameters()
+    for k in ('a', 'x0', 'xstd', 'y0'):
+        params.add(k, value=p0[k])
+    try:
+        res = lmfit.minimize(_residual, params, method='leastsq',
+                             args=(x, y), max_nfev=maxfev)
+    except (ValueError, TypeError) as err:
+        return FitResult(params, False, 0, str(err))
+    values = np.array([p.value for p in res.params.values()])
+    success = bool(res.success) and bool(np.all(np.isfinite(values)))
+    return FitResult(res.params, success, res.nfev, res.message)
+
+
+def _fitProfiles(profiles, p0s, maxfev):
+    return [
+        fitGaussian(x, y, p0, maxfev) for (x, y), p0 in zip(profiles, p0s)
+    ]
+
+
+class FitService(object):
+    """ gaussian fitting service in worker pool
+
+    Requests are keyed by source (e.g. image PV name), while a fit of one
+    source is running, new requests of the same source replace the pending
+    one, thus only the latest frame is fitted; each fit starts from the
+    converged parameters of the previous fit of the same source and
+    profile, or from the moments if it did not converge.
+
+    :param workers: number of workers
+    :param processes: use process pool (only picklable data and callbacks
+                      in parent), thread pool by default
+    :param maxfev: maximum function evaluations of one fit
+    """
+
+    def __init__(self, workers=1, processes=False, maxfev=200):
+        pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        self._pool = pool(max_workers=workers)
+        self.maxfev = maxfev
+        self._lock = threading.Lock()
+        self._running = set()
+        self._pending = {}
+        self._last = {}
+        self.submitted = 0
+        self.coalesced = 0
+        self.completed = 0
+
+    def submit(self, source, profiles, callback, warm=True):
+        """ request fits of profiles, return immediately
+
+        :param source: key of data source
+        :param profiles: list of (x, y) profiles
+        :param callback: called as callback(results) in worker thread,
+                         results is list of FitResult; GUI callers should
+                         forward to main thread, e.g. by wx.CallAfter
+        :param warm: warm start from the last converged fit of source
+        """
+        profiles = [(np.array(x, dtype=float), np.array(y, dtype=float))
+                    for x, y in profiles]
+        with self._lock:
+            self.submitted += 1
+            if source in self._running:
+                if source in self._pending:
+                    self.coalesced += 1
+                self._pending[source] = (profiles, callback, warm)
+                return
+            self._running.add(source)
+        self._start(source, profiles, callback, warm)
+
+    def _start(self, source, profiles, callback, warm):
+        last = self._last.get(source, []) if warm else []
+        p0s = [last[i] if i < len(last) else None
+               for i in range(len(profiles))]
+        future = self._pool.submit(_fitProfiles, profiles, p0s, self.maxfev)
+        future.add_done_callback(
+            lambda f: self._done(source, f, callback))
+
+    def _done(self, source, future, callback):
+        try:
+            results = future.result()
+        except Exception:
+            results = None
+        if results is not None:
+            self._last[source] = [
+                r.values() if r.success else None for r in results
+            ]
+        with self._lock:
+            self.completed += 1
+            nextjob = self._pending.pop(source, None)
+            if nextjob is None:
+                self._running.discard(source)
+        if nextjob is not None:
+            self._start(source, *nextjob)
+        if results is not None:
+            callback(results)
+
+    def fitManyAsync(self, profiles, callback):
+        """ fit many independent profiles in the pool, return immediately,
+        ``callback(results)`` is called in worker thread when all are done,
+        results is list of FitResult in order, None for the failed fits;
+        GUI callers should forward to main thread, e.g. by wx.CallAfter
+        """
+        futures = [
+            self._pool.submit(_fitProfiles, [p], [None], self.maxfev)
+            for p in profiles
+        ]
+        if not futures:
+            callback([])
+            return
+        lock = threading.Lock()
+        remaining = [len(futures)]
+
+        def done(future):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            callback([None if f.exception() is not None else f.result()[0]
+                      for f in futures])
+
+        for f in futures:
+            f.add_done_callback(done)
+
+    def isBusy(self, source=None):
+        with self._lock:
+            if source is None:
+                return bool(self._running)
+            return source in self._running
+
+    def shutdown(self, wait=False):
+        with self._lock:
+            self._pending.clear()
+        self._pool.shutdown(wait=wait)
+
+
+_service = None
+_slock = threading.Lock()
+
+
+def getService():
+    """ return shared FitService of the application
+    """
+    global _service
+    with _slock:
+        if _service is None:
+            _service = FitService(workers=2)
+    return _service
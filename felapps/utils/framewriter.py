@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+append frames of image to one HDF5 file per saving session:
+    FrameWriter: chunked, extendable datasets along the frame axis, file
+                 opened once in SWMR mode, could be read while writing
+    storageOptions: compression, chunk and storage type of image data,
+                    e.g. from the 'Save' group of imageviewer.xml
+
+Layout of file:
+    image/data      : frames, shape (n, rows, cols)
+    image/timestamp : acquisition time of frames, [s] since epoch
+    image/sumint    : sum of frames
+    image/maxint    : max of frames
+    image/xypos     : (x, y) of the peaks of projections, shape (n, 2)
+
+Attribute 'clipped' of image/data counts the pixels out of the range of
+integer storage type (saturated when stored), 0 if none.
+
+Read while acquiring (another process):
+>>> f = h5py.File(fname, 'r', libver='latest', swmr=True)
+>>> dset = f['image/data']
+>>> dset.refresh()  # see new frames
+"""
+
+from __future__ import division
+
+import time
+import warnings
+
+import numpy as np
+import h5py
+
+
+class FrameWriter(object):
+    """ append-mode HDF5 writer of image frames
+
+    :param fname: file name, overwritten if exists
+    :param shape: frame shape, (rows, cols)
+    :param dtype: frame data type
+    :param app: application name, attribute of 'image' group
+    :param chunk: frames per chunk of 'image/data', chunks are whole
+                  frames for frame-wise access
+    :param compression: compression filter of 'image/data', e.g. 'gzip',
+                        'lzf', None (no compression)
+    :param compression_opts: options of compression filter
+    :param shuffle: apply byte shuffle filter before compression
+    :param store_dtype: data type in file, e.g. uint16 for float waveform
+                        of 16 bit camera, ``dtype`` if None
+    :param flush_every: flush to disk every N frames, new frames are
+                        visible to SWMR readers after flush
+
+    Storage options could be given by ``storageOptions``.
+    """
+
+    def __init__(self, fname, shape, dtype=np.float64, app='imageviewer',
+                 chunk=1, compression=None, compression_opts=None,
+                 shuffle=False, store_dtype=None, flush_every=1):
+        self.fname = fname
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.flush_every = max(1, int(flush_every))
+        self.app = app
+        self.chunk = max(1, int(chunk))
+        self.compression = compression
+        self.compression_opts = compression_opts
+        self.shuffle = shuffle
+        self.store_dtype = self.dtype if store_dtype is None else np.dtype(
+            store_dtype)
+        self.count = 0
+        self.clipped = 0
+        self.file = None
+
+    def open(self):
+        """ create file and datasets, called by the first ``append`` if not
+        opened, thus all file operations could be done in writer thread
+        """
+        if self.file is not None:
+            return
+        f = h5py.File(self.fname, 'w', libver='latest')
+        rg = f.create_group('image')
+        rg.attrs['timestamp'] = time.strftime('%Y-%m-%d %H:%M:%S %Z',
+                                              time.localtime())
+        rg.attrs['app'] = self.app
+        self.data = rg.create_dataset(
+            'data',
+            shape=(0, ) + self.shape,
+            maxshape=(None, ) + self.shape,
+            chunks=(self.chunk, ) + self.shape,
+            dtype=self.store_dtype,
+            compression=self.compression,
+            compression_opts=self.compression_opts,
+            shuffle=self.shuffle)
+        self.data.attrs['clipped'] = 0
+        ncol = max(64, self.chunk)
+        self.columns = {
+            'timestamp': rg.create_dataset(
+                'timestamp', shape=(0, ), maxshape=(None, ), chunks=(ncol, ),
+                dtype=np.float64),
+            'sumint': rg.create_dataset(
+                'sumint', shape=(0, ), maxshape=(None, ), chunks=(ncol, ),
+                dtype=np.float64),
+            'maxint': rg.create_dataset(
+                'maxint', shape=(0, ), maxshape=(None, ), chunks=(ncol, ),
+                dtype=np.float64),
+            'xypos': rg.create_dataset(
+                'xypos', shape=(0, 2), maxshape=(None, 2), chunks=(ncol, 2),
+                dtype=np.int64),
+        }
+        # all datasets created, readers could attach from now on
+        f.swmr_mode = True
+        self.file = f
+
+    def append(self, image, timestamp=None, histx=None, histy=None):
+        """ append one frame, return its index in file
+
+        :param image: 2D array of shape ``shape``
+        :param timestamp: acquisition time, [s], now if None
+        :param histx: projection of image along axis 0, computed if None
+        :param histy: projection of image along axis 1, computed if None
+        """
+        image = np.asarray(image)
+        if image.shape != self.shape:
+            raise ValueError("frame shape %s does not match %s" %
+                             (image.shape, self.shape))
+        self.open()
+        histx = image.sum(axis=0) if histx is None else histx
+        histy = image.sum(axis=1) if histy is None else histy
+        i = self.count
+        n = i + 1
+        self.data.resize(n, axis=0)
+        self.data[i], nclipped = toStorage(image, self.store_dtype, True)
+        if nclipped:
+            self.clipped += nclipped
+            self.data.attrs['clipped'] = self.clipped
+        for dset in self.columns.values():
+            dset.resize(n, axis=0)
+        self.columns['timestamp'][i] = time.time(
+        ) if timestamp is None else timestamp
+        self.columns['sumint'][i] = np.sum(histx)
+        self.columns['maxint'][i] = image.max()
+        self.columns['xypos'][i] = (np.argmax(histx), np.argmax(histy))
+        self.count = n
+        if n % self.flush_every == 0:
+            self.file.flush()
+        return i
+
+    def flush(self):
+        if self.file:
+            self.file.flush()
+
+    def isOpen(self):
+        return self.file is not None and bool(self.file)
+
+    def close(self):
+        if self.isOpen():
+            self.file.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def storageOptions(compression='none', level=4, shuffle=False, chunk=1,
+                   dtype='native'):
+    """ storage options of image data, strings (of config file) accepted
+
+    :param compression: 'none', 'gzip' or 'lzf'
+    :param level: gzip level, 0-9
+    :param shuffle: byte shuffle filter before compression, effective for
+                    multi-byte integers
+    :param chunk: frames per chunk of frame stacks
+    :param dtype: data type in file, 'native' (as acquired), 'uint8' or
+                  'uint16' (values clipped to the range, counted by
+                  attribute 'clipped' of the data)
+    :return: dict of keyword arguments of ``FrameWriter``
+    """
+    compression = str(compression).lower()
+    if compression in ('none', ''):
+        compression, opts = None, None
+    elif compression == 'gzip':
+        opts = int(level)
+        if not 0 <= opts <= 9:
+            raise ValueError("gzip level should be 0-9, not %d" % opts)
+    elif compression == 'lzf':
+        opts = None
+    else:
+        raise ValueError("unknown compression: %s" % compression)
+    if isinstance(shuffle, str):
+        shuffle = shuffle.strip().lower() in ('true', '1', 'yes')
+    dtype = str(dtype).lower()
+    if dtype in ('native', 'none', ''):
+        store_dtype = None
+    elif dtype in ('uint8', 'uint16'):
+        store_dtype = np.dtype(dtype)
+    else:
+        raise ValueError("unsupported storage type: %s" % dtype)
+    return {
+        'compression': compression,
+        'compression_opts': opts,
+        'shuffle': bool(shuffle) and compression is not None,
+        'chunk': max(1, int(chunk)),
+        'store_dtype': store_dtype,
+    }
+
+
+def datasetOptions(options, shape):
+    """ keyword arguments of ``h5py.Group.create_dataset`` for one array of
+    ``shape`` from ``storageOptions``, chunked as a whole if filtered
+    """
+    options = options or {}
+    compression = options.get('compression')
+    if compression is None or 0 in shape or len(shape) == 0:
+        return {}
+    return {
+        'chunks': tuple(shape),
+        'compression': compression,
+        'compression_opts': options.get('compression_opts'),
+        'shuffle': options.get('shuffle', False),
+    }
+
+
+def toStorage(data, store_dtype=None, full_output=False):
+    """ convert data to storage type, rounded and clipped to the range of
+    integer type (RuntimeWarning issued if clipped), no copy if the type
+    is the same
+
+    :param full_output: if True, return (data, number of clipped values)
+    """
+    data = np.asarray(data)
+    nclipped = 0
+    if store_dtype is not None and data.dtype != store_dtype:
+        store_dtype = np.dtype(store_dtype)
+        if store_dtype.kind in 'ui':
+            info = np.iinfo(store_dtype)
+            if data.dtype.kind == 'f':
+                data = np.rint(data)
+            # NaN counted as clipped, stored as 0
+            inrange = (data >= info.min) & (data <= info.max)
+            nclipped = int(data.size - np.count_nonzero(inrange))
+            if nclipped:
+                warnings.warn("%d of %d values clipped to %s range" %
+                              (nclipped, data.size, store_dtype),
+                              RuntimeWarning)
+                data = np.clip(np.where(np.isnan(data), 0, data),
+                               info.min, info.max)
+        data = data.astype(store_dtype)
+    return (data, nclipped) if full_output else data
@@ -30,6 +30,13 @@ import string
 
 from . import EnhancedStatusBar as ESB
 from . import uiutils
+from . import fitservice
+from . import framewriter
+from . import textio
+# physics functions, kept here for compatibility
+from ..physics.felbase import aupmu, gapau
+from ..physics.chicane import r56chi, bchi
+from ..physics.fldprop import openfld, fldslice, iterfld, fldhistory, readfld
 
 import lmfit
 
@@ -375,47 +382,6 @@ def createwxStaticBox(parent,
     return sbox
 
 
-def aupmu(gap, xlamd, a=3.44, b=-5.00, c=1.54):
-    """
-    gap, xlamd: [mm]
-    """
-    bfield = a * np.exp(b * (gap / xlamd) + c * (gap / xlamd)**2)
-    au = 0.934 * (xlamd / 10) * bfield / np.sqrt(2)
-
-    return au
-
-
-def r56chi(
-        gam0,
-        ibfield,
-        imagl=0.150,
-        idril=0.285, ):
-    """
-    return r56 of chicane, ibfield: [T]
-    """
-    c0 = 299792458.0
-    m0 = 9.10938188e-31
-    e0 = 1.60218e-19
-    r56 = (2.0 / 3.0 * imagl + idril) * 2 * (
-        np.arcsin(imagl * e0 * ibfield / np.sqrt(gam0**2 - 1) / m0 / c0))**2
-
-    return r56
-
-
-def readfld(filename, ncar=121):
-    fid = open(filename, 'rb')
-    data = np.fromfile(fid, 'double').reshape(ncar * ncar, 2)
-    realp = data[:, 0]
-    imagp = data[:, 1]
-    intp = sum(realp**2 + imagp**2)
-    efield = np.array([complex(realp[i], imagp[i])
-                       for i in range(realp.size)]).reshape(ncar, ncar)
-    wexy = np.fft.fftshift(np.fft.fft2(efield))
-    farfield = abs(wexy)**2
-
-    return intp, farfield
-
-
 def getResPath(filename, cwd='.', resdir='../resources'):
     """
     return absolute path for resources, e.g. images, data
@@ -548,22 +514,39 @@ def getFileToSave(parent, ext='*'):
 
 
 class SaveData(object):
-    def __init__(self, data, fname, type, app='imageviewer'):
+    def __init__(self, data, fname, type, app='imageviewer', writer=None,
+                 h5opts=None, **kws):
         """
         type: asc, hdf5, sdds
+        writer: writeservice.WriterService, save in writer thread if given,
+                data should not be modified afterwards;
+                kws (callback, errback, block, timeout) are passed to
+                ``writer.submit``
+        h5opts: storage options of hdf5 format (compression, data type),
+                see ``framewriter.storageOptions``, uncompressed if None
         """
         self.data = data
         self.fname = fname
+        self.type = type
         self.app = app
+        self.h5opts = h5opts or {}
 
+        self.queued = False
+        if writer is None:
+            self.save()
+        else:
+            self.queued = writer.submit(self.save, **kws)
+
+    def save(self):
         self.onDataProcess()
 
-        if type == ".asc":
+        if self.type == ".asc":
             self.onSaveASC()
-        elif type == '.hdf5':
+        elif self.type == '.hdf5':
             self.onSaveHDF5()
-        elif type == '.sdds':
+        elif self.type == '.sdds':
             self.onSaveSDDS()
+        return self.fname
 
     def onDataProcess(self):
         xx, yy = np.sum(self.data, 0), np.sum(self.data, 1)
@@ -573,7 +556,7 @@ class SaveData(object):
         self.sumint = self.data.sum()
 
     def onSaveASC(self):
-        np.savetxt(self.fname, self.data, fmt='%.16e', delimiter=' ')
+        textio.writeText(self.fname, self.data)
 
     def onSaveHDF5(self):
         f = h5py.File(self.fname, 'w')
@@ -583,9 +566,15 @@ class SaveData(object):
                                               time.localtime())
         rg.attrs['app'] = self.app
 
+        data, nclipped = framewriter.toStorage(
+            self.data, self.h5opts.get('store_dtype'), True)
         dset = f.create_dataset(
-            'image/data', shape=self.data.shape, dtype=self.data.dtype)
-        dset[...] = self.data
+            'image/data',
+            shape=data.shape,
+            dtype=data.dtype,
+            **framewriter.datasetOptions(self.h5opts, data.shape))
+        dset[...] = data
+        dset.attrs['clipped'] = nclipped
         dset.attrs['xypos'] = (self.xpos, self.ypos)
         dset.attrs['sumint'] = self.sumint
         dset.attrs['maxint'] = self.maxint
@@ -596,15 +585,26 @@ class SaveData(object):
 
 
 class ExportData(object):
-    def __init__(self, data_raw, data_fit, model_x, model_y, fname):
-
-        self.data_raw = data_raw
-        self.data_fit = data_fit
+    def __init__(self, data_raw, data_fit, model_x, model_y, fname,
+                 writer=None, h5opts=None, **kws):
+        """
+        writer: writeservice.WriterService, save in writer thread if given,
+                kws are passed to ``writer.submit``
+        h5opts: storage options (compression), see
+                ``framewriter.storageOptions``, uncompressed if None
+        """
+        self.data_raw = dict(data_raw)
+        self.data_fit = dict(data_fit)
+        self.h5opts = h5opts or {}
         self.model_x = model_x
         self.model_y = model_y
         self.fname = fname
         self.onProcess()
-        self.onSave()
+        self.queued = False
+        if writer is None:
+            self.onSave()
+        else:
+            self.queued = writer.submit(self.onSave, **kws)
 
     def onProcess(self):
         # fit:
@@ -627,7 +627,7 @@ class ExportData(object):
                 'data/raw/' + k,
                 shape=v.shape,
                 dtype=v.dtype,
-                compression=None)
+                **framewriter.datasetOptions(self.h5opts, v.shape))
             dset[...] = v
 
         dg = f.create_group('data/fit')
@@ -640,10 +640,11 @@ class ExportData(object):
                 'data/fit/' + k,
                 shape=v.shape,
                 dtype=v.dtype,
-                compression=None)
+                **framewriter.datasetOptions(self.h5opts, v.shape))
             dset[...] = v
 
         f.close()
+        return self.fname
 
 
 class FloatSlider(wx.Slider):
@@ -1001,6 +1002,12 @@ class FitModels(object):
     def get_fit_result(self):
         return self._fit_result
 
+    def set_fit_result(self, res):
+        """ set fitting result done elsewhere, e.g. by fitservice,
+        res should have ``params`` as lmfit.Parameters
+        """
+        self._fit_result = res
+
     def fit(self):
         p = self._params
         f = self._fitfunc[self._model]
@@ -1127,6 +1134,7 @@ class AnalysisPlotPanel(uiutils.MyPlotPanel):
             #data = np.zeros([50, 50])
         self.data = data
         self.cmap = 'jet'
+        self.res_x, self.res_y = None, None  # fitting results
 
         # axis directions
         self.xaxis_direction = True  # left->right: small->big
@@ -1347,57 +1355,32 @@ class AnalysisPlotPanel(uiutils.MyPlotPanel):
             self.line_list = [self.linex_fit, self.liney_fit]
         self.refresh()
 
-    def set_lines(self):
+    def set_lines(self, callback=None):
+        """ set profile lines, and the fitted lines when the fits by
+        fitservice are done, then callback() is called if given
+        """
         if self.data is None:
             return
         data = self.data
         hx, hy = np.sum(data, 0), np.sum(data, 1)
-        idxmaxx, idxmaxy = np.where(hx == hx.max()), np.where(hy == hy.max())
-        maxidx, maxidy = idxmaxx[0][0], idxmaxy[0][0]
+        maxidx, maxidy = hx.argmax(), hy.argmax()
         x, y = np.arange(hx.size), np.arange(hy.size)
         hx = hx / hx.max() * maxidy
         hy = hy / hy.max() * maxidx
 
-        res_x, fm_x = gaussian_fit(x, hx)
-        res_y, fm_y = gaussian_fit(y, hy)
-
         self.linex, = self.axes.plot(x, hx)
         self.liney, = self.axes.plot(hy, y)
 
-        self.linex.set_color(self.line_color)
-        self.liney.set_color(self.line_color)
-
-        self.linex.set_marker('')
-        self.linex.set_markersize(5)
-        self.linex.set_mec(self.mec)
-        self.linex.set_mfc(self.mfc)
-
-        self.liney.set_marker('')
-        self.liney.set_markersize(5)
-        self.liney.set_mec(self.mec)
-        self.liney.set_mfc(self.mfc)
-
-        # fitted lines
-        x_fit = np.linspace(x.min(), x.max(), 200)
-        y_fit = np.linspace(y.min(), y.max(), 200)
-        fx, tx = fm_x.get_fitfunc(res_x.params)
-        fy, ty = fm_y.get_fitfunc(res_y.params)
-
-        self.linex_fit, = self.axes.plot(x_fit, fx(res_x.params, x_fit))
-        self.liney_fit, = self.axes.plot(fy(res_y.params, y_fit), y_fit)
-
-        self.linex_fit.set_color(self.line_color)
-        self.liney_fit.set_color(self.line_color)
+        # fitted lines, data are set when fits are done
+        self.linex_fit, = self.axes.plot([], [])
+        self.liney_fit, = self.axes.plot([], [])
 
-        self.linex_fit.set_marker('')
-        self.linex_fit.set_markersize(5)
-        self.linex_fit.set_mec(self.mec)
-        self.linex_fit.set_mfc(self.mfc)
-
-        self.liney_fit.set_marker('')
-        self.liney_fit.set_markersize(5)
-        self.liney_fit.set_mec(self.mec)
-        self.liney_fit.set_mfc(self.mfc)
+        for line in (self.linex, self.liney, self.linex_fit, self.liney_fit):
+            line.set_color(self.line_color)
+            line.set_marker('')
+            line.set_markersize(5)
+            line.set_mec(self.mec)
+            line.set_mfc(self.mfc)
 
         self.axes.set_xlim([x.min(), x.max()])
         self.axes.set_ylim([y.min(), y.max()])
@@ -1409,17 +1392,35 @@ class AnalysisPlotPanel(uiutils.MyPlotPanel):
         self.liney_fit.set_visible(False)
 
         self.refresh()
-        self.res_x, self.res_y = res_x, res_y
+        self.res_x, self.res_y = None, None
         self.line_list = []
 
+        fitservice.getService().submit(
+            'analysisplot-%d' % id(self), [(x, hx), (y, hy)],
+            lambda results: wx.CallAfter(self._set_fit_lines, results, x, y,
+                                         callback))
+
+    def _set_fit_lines(self, results, x, y, callback=None):
+        res_x, res_y = results
+        fm = FitModels()
+        fx, tx = fm.get_fitfunc(res_x.params)
+        x_fit = np.linspace(x.min(), x.max(), 200)
+        y_fit = np.linspace(y.min(), y.max(), 200)
+        self.linex_fit.set_data(x_fit, fx(res_x.params, x_fit))
+        self.liney_fit.set_data(fx(res_y.params, y_fit), y_fit)
+        self.res_x, self.res_y = res_x, res_y
+        self.refresh()
+        if callback is not None:
+            callback()
+
     def get_fit_report(self, xoy='x'):
         """ return fitting report if success,
             else return None
         """
-        if xoy == 'x':
-            p = self.res_x.params
-        else:
-            p = self.res_y.params
+        res = self.res_x if xoy == 'x' else self.res_y
+        if res is None:
+            return None
+        p = res.params
         retstr2 = "f(x) = a*exp(-(x-x0)^2/2/sx^2)+y0" + "\n"
         retstr4 = " {a0_k:<3s}: {a0_v:>10.4f}\n".format(
             a0_k='a', a0_v=p['a'].value)
@@ -1572,10 +1573,11 @@ class AnalysisPlotPanel(uiutils.MyPlotPanel):
         data['raw']['prof_y'] = self.liney.get_data()
         data['fit']['prof_x'] = self.linex_fit.get_data()
         data['fit']['prof_y'] = self.liney_fit.get_data()
-        data['attr']['x0'] = self.res_x.params['x0'].value
-        data['attr']['sx'] = self.res_x.params['xstd'].value
-        data['attr']['y0'] = self.res_y.params['x0'].value
-        data['attr']['sy'] = self.res_y.params['xstd'].value
+        for res, k0, ks in ((self.res_x, 'x0', 'sx'),
+                            (self.res_y, 'y0', 'sy')):
+            p = res.params if res is not None else None
+            data['attr'][k0] = p['x0'].value if p is not None else np.nan
+            data['attr'][ks] = p['xstd'].value if p is not None else np.nan
         return data
 
 
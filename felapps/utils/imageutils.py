@@ -17,6 +17,7 @@ import wx
 import numpy as np
 import time
 from . import funutils
+from . import textio
 from . import analysisframe
 
 import wx.lib.scrolledpanel as scrolled
@@ -41,7 +42,9 @@ def data2Image(filename,
     :param filename: data filename, f.
     :param datatype: data format, 
         'hdf5' or 'h5': image data could be extracted by fid = h5py.File(f); fid['image']['data'].
-        'asc' or 'dat': image data could be extracted by np.loadtxt(f).
+        'asc' or 'dat': image data could be extracted by textio.loadText(f),
+        int64 array if the text has only integers (e.g. saved from integral
+        images by SaveData), float64 otherwise.
     :param figtype: 'jpg', 'png' or others.
     :param wdir: working directory, to put generated jpg figures, if None, use cwd.
     :param width:  image size in w, if None, take original values.
@@ -54,7 +57,7 @@ def data2Image(filename,
         f = h5py.File(os.path.expanduser(filename))
         data = f['image']['data']
     elif datatype == 'asc' or datatype == 'dat':
-        data = np.loadtxt(filename)
+        data = textio.loadText(filename)
 
     if wdir is None:
         wdir = os.getcwd()
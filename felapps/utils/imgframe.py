@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+image frame from camera waveform, e.g. EPICS areaDetector array PV:
+    ImageFrame: read-only view of one acquired frame, the image, ROI and
+                projections are views or computed once on demand
+    FrameRing : preallocated ring buffer of frames with timestamps,
+                filled by acquisition thread, read by GUI or consumers
+    PVAcquirer: fill FrameRing from PV monitor callbacks
+    ImagePyramid: block-decimated levels of image for display
+    beamStats : centroid, rms size, FWHM and second-moment ellipse of image
+"""
+
+from __future__ import division
+
+import threading
+import time
+
+import numpy as np
+
+
+class ImageFrame(object):
+    """ one frame of image data, no copy of the fetched buffer
+
+    :param raw: 1-D waveform of the frame (e.g. ``pv.get(as_numpy=True)``)
+    :param shape: image shape, (width, height) in pixels
+    :param roixy: region of interest, [i0, i1, j0, j1], whole image if None
+    :param timestamp: acquisition time, [s], now if None
+    """
+
+    def __init__(self, raw, shape, roixy=None, timestamp=None):
+        raw = np.asarray(raw).view()
+        raw.flags.writeable = False
+        self.raw = raw
+        self.shape = tuple(shape)
+        self.roixy = list(roixy) if roixy is not None else [
+            0, self.shape[0], 0, self.shape[1]
+        ]
+        self.timestamp = timestamp
+        self._intensity = None
+        self._histx = None
+        self._histy = None
+        self._pyramids = {}
+        self._stats = {}
+
+    @property
+    def image(self):
+        """ full image, view of shape ``shape``
+        """
+        return self.raw[0:self.shape[0] * self.shape[1]].reshape(self.shape)
+
+    @property
+    def roi(self):
+        """ ROI of image, view
+        """
+        i0, i1, j0, j1 = self.roixy
+        return self.image[i0:i1, j0:j1]
+
+    @property
+    def intensity(self):
+        """ sum of the whole waveform
+        """
+        if self._intensity is None:
+            self._intensity = np.sum(self.raw)
+        return self._intensity
+
+    @property
+    def histx(self):
+        """ projection of ROI along the first axis
+        """
+        if self._histx is None:
+            self._histx = self.roi.sum(axis=0)
+        return self._histx
+
+    @property
+    def histy(self):
+        """ projection of ROI along the second axis
+        """
+        if self._histy is None:
+            self._histy = self.roi.sum(axis=1)
+        return self._histy
+
+    def stats(self, threshold=0.05):
+        """ beam statistics of ROI, see ``beamStats``, computed once per
+        frame and threshold
+        """
+        if threshold not in self._stats:
+            self._stats[threshold] = beamStats(self.roi, threshold,
+                                               self.histx, self.histy)
+        return self._stats[threshold]
+
+    def pyramid(self, method='mean'):
+        """ display pyramid of ROI, built once per frame and method
+        """
+        if method not in self._pyramids:
+            self._pyramids[method] = ImagePyramid(self.roi, method)
+        return self._pyramids[method]
+
+
+def decimate(image, factor, method='mean'):
+    """ decimate 2D image by factor x factor blocks, the remainder rows and
+    columns are cropped, block average is in float32 (for display)
+
+    :param method: 'mean' (block average) or 'max' (max-pooling, keeps
+                   hot spots visible)
+    """
+    if factor <= 1:
+        return image
+    h, w = image.shape[0] // factor, image.shape[1] // factor
+    if h == 0 or w == 0:
+        return image
+    image = image[:h * factor, :w * factor]
+    # reduce rows then columns by strided views, much faster than
+    # reshape to blocks and reducing over two axes
+    if method == 'max':
+        rows = image[0::factor].copy()
+        for i in range(1, factor):
+            np.maximum(rows, image[i::factor], out=rows)
+        out = rows[:, 0::factor].copy()
+        for j in range(1, factor):
+            np.maximum(out, rows[:, j::factor], out=out)
+        return out
+    rows = image[0::factor].astype(np.float32)
+    for i in range(1, factor):
+        rows += image[i::factor]
+    out = rows[:, 0::factor].copy()
+    for j in range(1, factor):
+        out += rows[:, j::factor]
+    out *= 1.0 / factor**2
+    return out
+
+
+class ImagePyramid(object):
+    """ image pyramid for display, level k is decimated by 2^k from the
+    full resolution image (level 0), levels are computed on demand from
+    the nearest finer cached level and cached
+
+    :param image: full resolution 2D image
+    :param method: decimation method, 'mean' or 'max'
+    """
+
+    def __init__(self, image, method='mean'):
+        self.method = method
+        self.levels = {0: image}
+        rows, cols = image.shape[:2]
+        self.maxlevel = int(np.floor(np.log2(max(min(rows, cols), 1))))
+
+    def level(self, k):
+        """ image of level k, limited to the coarsest level with at least
+        one pixel
+        """
+        k = min(k, self.maxlevel)
+        if k not in self.levels:
+            j = max(i for i in self.levels if i < k)
+            self.levels[k] = decimate(self.levels[j], 2**(k - j), self.method)
+        return self.levels[k]
+
+    def fit(self, width, height):
+        """ the coarsest level of which the size is not smaller than the
+        display size, width x height pixels (columns x rows)
+        """
+        rows, cols = self.levels[0].shape[:2]
+        ratio = min(cols / max(width, 1), rows / max(height, 1))
+        k = int(np.floor(np.log2(ratio))) if ratio >= 2 else 0
+        return self.level(k)
+
+
+class FrameRing(object):
+    """ ring buffer of N frames, preallocated, one producer (acquisition)
+    and readers of the newest frame (display, ``latest``) and/or of every
+    frame in order (e.g. saving, ``get``)
+
+    :param nframes: capacity, number of frames
+    :param size: elements of one frame (waveform length)
+    :param dtype: data type of frame
+    :param ordered: if True, frames overwritten before read by ``get`` are
+                    counted as dropped
+
+    Counters: ``count`` (frames received), ``shown`` (frames returned by
+    ``latest``), ``skipped`` (frames overwritten by newer ones before
+    returned by ``latest``, in any mode), ``dropped`` (ordered mode).
+    """
+
+    def __init__(self, nframes, size, dtype=np.float64, ordered=False):
+        self.nframes = nframes
+        self.size = size
+        self.ordered = ordered
+        self.data = np.zeros((nframes, size), dtype=dtype)
+        self.timestamps = np.zeros(nframes)
+        self.head = 0  # sequence number of the next frame to put
+        self.tail = 0  # sequence number of the next frame to read in order
+        self.last = -1  # sequence number of the last frame got by latest()
+        self.shown = 0
+        self.skipped = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def put(self, value, timestamp=None):
+        """ copy one frame into the ring, return its sequence number
+        """
+        value = np.asarray(value).ravel()
+        n = min(value.size, self.size)
+        seq = self.head
+        slot = seq % self.nframes
+        with self._lock:
+            if seq - self.tail >= self.nframes:
+                if self.ordered:
+                    self.dropped += 1
+                self.tail += 1
+        self.data[slot, :n] = value[:n]
+        self.timestamps[slot] = time.time() if timestamp is None else timestamp
+        with self._lock:
+            self.head = seq + 1
+        return seq
+
+    def latest(self, new_only=True):
+        """ newest frame, as (seq, data, timestamp), data is a read-only
+        view of the ring slot, valid until the slot is reused (N - 1 frames
+        later, check by ``isValid(seq)``), None if no (new) frame
+
+        :param new_only: if True, return None when no frame has come since
+                         the last call
+        """
+        with self._lock:
+            seq = self.head - 1
+            if seq < 0 or (new_only and seq == self.last):
+                return None
+            if seq > self.last:
+                self.skipped += seq - self.last - 1
+            self.last = seq
+            self.shown += 1
+        return seq, self._view(seq), self.timestamps[seq % self.nframes]
+
+    def get(self):
+        """ next frame in order, as (seq, data, timestamp), None if all
+        frames have been read
+        """
+        with self._lock:
+            seq = self.tail
+            if seq >= self.head:
+                return None
+            self.tail = seq + 1
+        return seq, self._view(seq), self.timestamps[seq % self.nframes]
+
+    def isValid(self, seq):
+        """ if frame of sequence number ``seq`` is still in the ring
+        """
+        return 0 <= seq and self.head - self.nframes < seq < self.head
+
+    def _view(self, seq):
+        v = self.data[seq % self.nframes].view()
+        v.flags.writeable = False
+        return v
+
+    def __len__(self):
+        return min(self.head, self.nframes)
+
+    @property
+    def count(self):
+        """ total frames received
+        """
+        return self.head
+
+    def rate(self):
+        """ frame rate [Hz] estimated from timestamps in the ring
+        """
+        n = len(self)
+        if n < 2:
+            return 0.0
+        t = self.timestamps[[(self.head - 1) % self.nframes,
+                             (self.head - n) % self.nframes]]
+        return (n - 1) / (t[0] - t[1]) if t[0] > t[1] else 0.0
+
+
+class PVAcquirer(object):
+    """ acquire frames of PV into ``FrameRing`` by monitor callbacks,
+    which run in the background thread of channel access, independent of
+    the GUI event loop
+
+    :param pv: ``epics.PV`` instance, with ``auto_monitor``
+    :param ring: ``FrameRing`` instance
+    """
+
+    def __init__(self, pv, ring):
+        self.pv = pv
+        self.ring = ring
+        self._cbindex = None
+
+    def _onValue(self, value=None, timestamp=None, **kws):
+        if value is not None:
+            self.ring.put(value, timestamp)
+
+    def start(self):
+        if self._cbindex is None:
+            self._cbindex = self.pv.add_callback(self._onValue)
+
+    def stop(self):
+        if self._cbindex is not None:
+            self.pv.remove_callback(self._cbindex)
+            self._cbindex = None
+
+    def isRunning(self):
+        return self._cbindex is not None
+
+
+def fwhm(profile):
+    """ full width at half maximum of 1D profile, [pixel], linear
+    interpolation at the outermost half maximum crossings
+    """
+    profile = np.asarray(profile, dtype=float)
+    imax = profile.argmax()
+    half = 0.5 * (profile[imax] + profile.min())
+    above = np.flatnonzero(profile >= half)
+    i0, i1 = above[0], above[-1]
+    x0, x1 = float(i0), float(i1)
+    if i0 > 0:
+        x0 -= (profile[i0] - half) / (profile[i0] - profile[i0 - 1])
+    if i1 < profile.size - 1:
+        x1 += (profile[i1] - half) / (profile[i1] - profile[i1 + 1])
+    return x1 - x0
+
+
+def beamStats(image, threshold=0.05, histx=None, histy=None):
+    """ beam statistics of 2D image, vectorized, no fitting
+
+    :param image: 2D array, rows along y, columns along x
+    :param threshold: pixels below threshold * (peak - min) over min are
+                      clipped before computing moments, to suppress
+                      background noise
+    :param histx: projection of image along axis 0, computed if None
+    :param histy: projection of image along axis 1, computed if None
+    :return: dict of 'intensity', 'peak', centroid 'x0', 'y0', rms sizes
+             'sx', 'sy', correlation 'sxy', ellipse 'tilt' [rad] and
+             principal rms sizes 'su', 'sv' (from the clipped moments),
+             'fwhmx', 'fwhmy' (from projections); coordinates are pixel
+             indices starting from 1, as the projections are plotted
+    """
+    histx = image.sum(axis=0) if histx is None else histx
+    histy = image.sum(axis=1) if histy is None else histy
+    peak, vmin = image.max(), image.min()
+    w = np.asarray(image, dtype=np.float32) - np.float32(
+        vmin + threshold * (peak - vmin))
+    np.maximum(w, 0, out=w)
+    wx, wy = w.sum(axis=0, dtype=np.float64), w.sum(axis=1, dtype=np.float64)
+    total = wx.sum()
+    x = np.arange(1, wx.size + 1, dtype=np.float64)
+    y = np.arange(1, wy.size + 1, dtype=np.float64)
+    if total > 0:
+        x0, y0 = np.dot(wx, x) / total, np.dot(wy, y) / total
+        sx2 = np.dot(wx, (x - x0)**2) / total
+        sy2 = np.dot(wy, (y - y0)**2) / total
+        sxy = np.dot(w.dot((x - x0).astype(np.float32)), y - y0) / total
+    else:
+        x0 = y0 = sx2 = sy2 = sxy = np.nan
+    tilt = 0.5 * np.arctan2(2.0 * sxy, sx2 - sy2)
+    d = np.sqrt(0.25 * (sx2 - sy2)**2 + sxy**2)
+    su2, sv2 = 0.5 * (sx2 + sy2) + d, 0.5 * (sx2 + sy2) - d
+    return {
+        'intensity': float(np.sum(histx)),
+        'peak': float(peak),
+        'x0': x0,
+        'y0': y0,
+        'sx': np.sqrt(sx2),
+        'sy': np.sqrt(sy2),
+        'sxy': sxy,
+        'tilt': tilt,
+        'su': np.sqrt(su2),
+        'sv': np.sqrt(max(sv2, 0.0)) if np.isfinite(sv2) else sv2,
+        'fwhmx': fwhm(histx),
+        'fwhmy': fwhm(histy),
+    }
@@ -23,11 +23,17 @@ from matplotlib.patches import Rectangle
 import epics
 import time
 from datetime import datetime
+import io
 import os
 import xml.etree.cElementTree as ET
 from . import resutils
 from . import funutils
 from . import parseutils
+from . import imgframe
+from . import fitservice
+from . import framewriter
+from . import writeservice
+from . import replay
 
 
 class ImageConfigFile(parseutils.ConfigFile):
@@ -44,6 +50,7 @@ class ImageConfigFile(parseutils.ConfigFile):
         namelist_control = {}
         namelist_style = {}
         namelist_histplot = {}
+        namelist_save = {}
         namestring_image = [
             'width', 'height', 'savePath', 'saveImgName', 'saveImgExt',
             'saveImgDatName', 'saveImgDatExt', 'saveIntName', 'saveIntExt',
@@ -54,6 +61,10 @@ class ImageConfigFile(parseutils.ConfigFile):
             'caAddrList', 'caArrayBytes', 'pixelSize'
         ]
         namestring_histplot = ['heightRatio']
+        namestring_save = [
+            'saveCompression', 'saveCompressionLevel', 'saveShuffle',
+            'saveChunkFrames', 'saveDtype'
+        ]
         namestring_style = [
             'backgroundColor', 'fontpointsize', 'fontfamily', 'fontstyle',
             'fontweight', 'fontfacename'
@@ -79,10 +90,16 @@ class ImageConfigFile(parseutils.ConfigFile):
                     s: group.find('properties').get(s)
                     for s in namestring_histplot
                 }
+            elif group.get('name') == 'Save':
+                namelist_save = {
+                    s: group.find('properties').get(s)
+                    for s in namestring_save
+                }
         self.namelist.update(namelist_image)
         self.namelist.update(namelist_control)
         self.namelist.update(namelist_style)
         self.namelist.update(namelist_histplot)
+        self.namelist.update(namelist_save)
 
 
 class ImageViewer(wx.Frame):
@@ -130,6 +147,8 @@ class ImageViewer(wx.Frame):
         }
 
         self.rcmflag = ''  # flag for reverse colormap
+        self.ring_size = 8  # frames of acquisition ring buffer
+        self.replay = None  # replay of recorded frames, instead of PV
         self.configlist = {}  # configurations dict
         self.xmlconfig = {}  # xml config class
 
@@ -146,10 +165,12 @@ class ImageViewer(wx.Frame):
         # initialize curve fitting module
         self._fit_init()
 
-        # save data settings
+        # save data settings, files are written in writer thread
+        self.writer = writeservice.getWriter()
         self.savedict = {}
         self.saveTimerLife = 0
         self.saveTimerCounter = 0
+        self.saveDropped = 0
         self.savetimer = wx.Timer(self)
         self.Bind(wx.EVT_TIMER, self.onSaveTimer, self.savetimer)
 
@@ -163,33 +184,75 @@ class ImageViewer(wx.Frame):
         # 2 manual
         self.fit_model_x = fit_model_x
         self.fit_model_y = fit_model_y
+        self.fit_every = 10  # full fits every N frames, 0: on demand only
+        self.stat_threshold = 0.05  # clipping level of beam statistics
+        self._fit_count = 0
+        self.beamstats = None
+        self.fitservice = fitservice.getService()
 
-    def _fit_update(self, img_panel_obj):
-        x, xdata = img_panel_obj.xx, img_panel_obj.histx
-        y, ydata = img_panel_obj.yy, img_panel_obj.histy
-        x0, y0 = np.sum(x * xdata) / np.sum(xdata), np.sum(
-            y * ydata) / np.sum(xdata)
-        p0_x = {
-            'a': xdata.max(),
-            'x0': x0,
-            'xstd': (np.sum((x - x0)**2 * xdata) / np.sum(xdata))**0.5,
-            'y0': 0
-        }
-        p0_y = {
-            'a': ydata.max(),
-            'x0': y0,
-            'xstd': (np.sum((y - y0)**2 * ydata) / np.sum(ydata))**0.5,
-            'y0': 0
-        }
+    def _fit_update(self, img_panel_obj, frame=None):
+        """
+        update beam statistics report (moments, no fitting) of every frame,
+        the full gaussian fits run every self.fit_every frames only
+        (0: on demand, by the fitting popup)
+
+        :param frame: ImageFrame of img_panel_obj.z, reuse its statistics
+        """
+        if frame is not None:
+            stats = frame.stats(self.stat_threshold)
+        else:
+            stats = imgframe.beamStats(img_panel_obj.z, self.stat_threshold,
+                                       img_panel_obj.histx,
+                                       img_panel_obj.histy)
+        self.beamstats = stats
+        self._fit_count += 1
+        if self.fit_every > 0 and self._fit_count % self.fit_every == 0:
+            self._fit_full(img_panel_obj)
+
+        self.fit_report_tc.SetDefaultStyle(wx.TextAttr("black"))
+        self.fit_report_tc.SetValue('[beam statistics]\n')
+        self.fit_report_tc.AppendText('\n'.join([
+            "{k:<5s}: {v:>10.4f}".format(k=k, v=stats[k])
+            for k in ('x0', 'y0', 'sx', 'sy', 'sxy', 'tilt', 'fwhmx',
+                      'fwhmy', 'peak')
+        ]))
+        if self.fit_model_x.get_fit_result() is not None:
+            self.fit_report_tc.AppendText("\n" + "-" * 28 + "\n")
+            self._fit_report()
+
+        # update (x0,y0)
+        self.pos0_val.SetLabel('({x:.2f},{y:.2f})'.format(
+            x=stats['x0'], y=stats['y0']))
+
+    def _fit_full(self, img_panel_obj, popup=False):
+        """
+        gaussian fits of x and y projections, in the fitting service,
+        results are applied in _fit_done
+
+        :param popup: show fitting popup when fits are done
+        """
+        profiles = [(img_panel_obj.xx, img_panel_obj.histx),
+                    (img_panel_obj.yy, img_panel_obj.histy)]
+        self.fitservice.submit(
+            'imageviewer-%d' % id(self), profiles,
+            lambda results: wx.CallAfter(self._fit_done, results, profiles,
+                                         popup))
+
+    def _fit_done(self, results, profiles, popup=False):
+        res_x, res_y = results
+        if not (res_x.success and res_y.success):
+            return  # keep the last converged fits
+        (x, xdata), (y, ydata) = profiles
         self.fit_model_x.set_data(x=x, y=xdata)
-        self.fit_model_x.set_params(**p0_x)
         self.fit_model_y.set_data(x=y, y=ydata)
-        self.fit_model_y.set_params(**p0_y)
-        res_x = self.fit_model_x.fit()
-        res_y = self.fit_model_y.fit()
+        self.fit_model_x.set_fit_result(res_x)
+        self.fit_model_y.set_fit_result(res_y)
+        if popup:
+            self.onFitPopup(None)
 
+    def _fit_report(self):
         self.fit_report_tc.SetDefaultStyle(wx.TextAttr("red"))
-        self.fit_report_tc.SetValue('[profile X]\n')
+        self.fit_report_tc.AppendText('[profile X]\n')
         self.fit_report_tc.AppendText(self.fit_model_x.fit_report())
         self.fit_report_tc.SetDefaultStyle(wx.TextAttr("black"))
         self.fit_report_tc.AppendText("\n" + "-" * 28 + "\n")
@@ -197,10 +260,6 @@ class ImageViewer(wx.Frame):
         self.fit_report_tc.AppendText('[profile Y]\n')
         self.fit_report_tc.AppendText(self.fit_model_y.fit_report())
 
-        # update (x0,y0)
-        self.pos0_val.SetLabel('({x:.2f},{y:.2f})'.format(
-            x=res_x.params['x0'].value, y=res_y.params['x0'].value))
-
     def setEnvars(self):
         boolDict = {True: 'YES', False: 'NO'}
         envKeys = [
@@ -270,6 +329,14 @@ class ImageViewer(wx.Frame):
         # HistPlot
         self.heightRatio = float(namelist['heightRatio'])
 
+        # Save, storage layout of hdf5 data, uncompressed if not configured
+        self.save_h5opts = framewriter.storageOptions(
+            compression=namelist.get('saveCompression') or 'none',
+            level=namelist.get('saveCompressionLevel') or 4,
+            shuffle=namelist.get('saveShuffle') or False,
+            chunk=namelist.get('saveChunkFrames') or 1,
+            dtype=namelist.get('saveDtype') or 'native')
+
         self.configdict = namelist
 
     def printConfig(self):
@@ -293,11 +360,18 @@ class ImageViewer(wx.Frame):
         saveDatItem = fileMenu.Append(wx.ID_ANY, '&Save Image Data\tCtrl+D',
                                       'Save figure data to file')
         fileMenu.AppendSeparator()
+        replayItem = fileMenu.Append(wx.ID_ANY, '&Replay Frames\tCtrl+R',
+                                     'Replay recorded frames as image source')
+        seekItem = fileMenu.Append(wx.ID_ANY, 'Replay Seek\tCtrl+Shift+R',
+                                   'Go to frame of replay')
+        fileMenu.AppendSeparator()
         exitItem = fileMenu.Append(wx.ID_EXIT, 'E&xit\tCtrl+W',
                                    'Exit application')
         self.Bind(wx.EVT_MENU, self.onOpen, id=openItem.GetId())
         self.Bind(wx.EVT_MENU, self.onSaveImg, id=saveImgItem.GetId())
         self.Bind(wx.EVT_MENU, self.onSaveDat, id=saveDatItem.GetId())
+        self.Bind(wx.EVT_MENU, self.onReplay, id=replayItem.GetId())
+        self.Bind(wx.EVT_MENU, self.onReplaySeek, id=seekItem.GetId())
         self.Bind(wx.EVT_MENU, self.onExit, id=exitItem.GetId())
 
         ## Configurations menu
@@ -370,7 +444,7 @@ class ImageViewer(wx.Frame):
             )  # I've not found pure python way (simple) to do that yet.
         filelabel = time.strftime('%H%M%S', time.localtime())
         savetofilename = self.save_path_str + '/' + self.save_img_name_str + filelabel + self.save_img_ext_str
-        self.imgpanel.figure.savefig(savetofilename)
+        self.imgpanel.savefig(savetofilename)
         hintText = 'Image Plotting file: ' + savetofilename + ' was saved.'
         self.statusbar.appinfo.SetLabel(hintText)
         #self.statusbar.SetStatusText(hintText)
@@ -380,11 +454,41 @@ class ImageViewer(wx.Frame):
             os.system('mkdir -p' + ' ' + self.save_path_str)
         filelabel = time.strftime('%H%M%S', time.localtime())
         savetofilename = self.save_path_str + '/' + self.save_dat_name_str + filelabel + self.save_dat_ext_str
-        saveins = funutils.SaveData(self.imgpanel.z, savetofilename,
-                                    self.save_dat_ext_str)
         hintText = 'Image Data file: ' + savetofilename + ' was saved.'
-        #self.statusbar.SetStatusText(hintText)
+        # written later in writer thread, the displayed data could be a
+        # slot of frame ring which is reused, thus copied
+        saveins = funutils.SaveData(
+            np.array(self.imgpanel.z, copy=True), savetofilename,
+            self.save_dat_ext_str,
+            writer=self.writer, h5opts=self.save_h5opts,
+            **self._writerKws(hintText))
+        if not saveins.queued:
+            self._showSaveInfo('Writer is busy, ' + savetofilename +
+                               ' was not saved.', 'red')
+
+    def _writerKws(self, hintText=None, timeout=None):
+        """
+        keyword arguments of writer jobs submitted in GUI thread: no
+        waiting (or at most ``timeout`` [s]) for full queue, report result
+        to statusbar
+        """
+        if timeout is None:
+            kws = {'block': False}
+        else:
+            kws = {'block': True, 'timeout': timeout}
+        kws['errback'] = lambda err: wx.CallAfter(
+            self._showSaveInfo, 'Saving failed: %s' % err, 'red')
+        if hintText is not None:
+            kws['callback'] = lambda res: wx.CallAfter(
+                self._showSaveInfo, hintText)
+        return kws
+
+    def _showSaveInfo(self, hintText, color=None):
+        if not self:  # window destroyed
+            return
         self.statusbar.appinfo.SetLabel(hintText)
+        if color is not None:
+            self.statusbar.appinfo.SetForegroundColour(color)
 
     def onShowInt(self, event):
         self.menuShowInt = ShowIntPanel(self)
@@ -406,6 +510,42 @@ class ImageViewer(wx.Frame):
         self.menuAutoSaveFrame.SetTitle('Automatic Data-Save System')
         self.menuAutoSaveFrame.Show()
 
+    def startAutoSave(self):
+        """
+        start saving session, frames in HDF5 format are appended to one
+        file of the session, see ``framewriter.FrameWriter``
+        """
+        self.stopAutoSave()
+        self.saveTimerCounter = 0
+        self.saveDropped = 0
+        self.savetimer.Start(self.savedict['save_tfreq_msec'])
+
+    def stopAutoSave(self):
+        self.savetimer.Stop()
+        if getattr(self, 'autosaver', None) is not None:
+            self._closeAutoSave(self.autosaver)
+            self.autosaver = None
+
+    def _closeAutoSave(self, saver):
+        """
+        close session file after the queued frames, wait for the writer
+        shortly if its queue is full, report if not closed
+        """
+        if not self.writer.submit(saver.close, **self._writerKws(timeout=1.0)):
+            self._showSaveInfo('Writer is busy, ' + saver.fname +
+                               ' was not closed properly.', 'red')
+
+    def _openAutoSave(self, shape, dtype):
+        if not os.path.exists(self.savedict['save_path']):
+            os.makedirs(self.savedict['save_path'])
+        filelabel = datetime.now().strftime('%Y%m%d_%H%M%S')
+        savetofilename = self.savedict['save_path'] + os.sep + \
+            self.save_dat_name_str + filelabel + '.hdf5'
+        # file is created by the first append, in writer thread
+        self.autosaver = framewriter.FrameWriter(savetofilename, shape, dtype,
+                                                 **self.save_h5opts)
+        return self.autosaver
+
     def onSaveTimer(self, event):
         self.saveTimerCounter += 1
         """ for test only
@@ -419,36 +559,54 @@ class ImageViewer(wx.Frame):
         savetodatfilebasename = self.savedict['save_path'] + os.sep + self.save_dat_name_str + filelabel
         savetoimgfilebasename = self.savedict['save_path'] + os.sep + self.save_img_name_str + filelabel
 
-        datatosave = self.mypv.get()[0:self.wpx * self.hpx].reshape(
-            (self.wpx, self.hpx
-             ))[self.roixy[0]:self.roixy[1], self.roixy[2]:self.roixy[3]]
-        # save data
-        if self.savedict['save_datfmt_hdf5'] == 1:  # save hdf5 fmt
-            saveins = funutils.SaveData(
-                datatosave, savetodatfilebasename + '.hdf5', '.hdf5')
+        raw, timestamp = self.fetchRaw()
+        frame = imgframe.ImageFrame(raw, (self.wpx, self.hpx), self.roixy,
+                                    timestamp)
+        datatosave = frame.roi
+        # save data, in writer thread, the fetched frame is not modified
+        # thus no copy; records are dropped if the writer falls behind
+        if self.savedict['save_datfmt_hdf5'] == 1:  # append to session file
+            saver = getattr(self, 'autosaver', None)
+            if saver is None or saver.shape != datatosave.shape:
+                # new session file if ROI is changed
+                if saver is not None:
+                    self._closeAutoSave(saver)
+                saver = self._openAutoSave(datatosave.shape, datatosave.dtype)
+            if not self.writer.submit(saver.append, datatosave,
+                                      frame.timestamp, frame.histx,
+                                      frame.histy, **self._writerKws()):
+                self.saveDropped += 1
         if self.savedict['save_datfmt_asc'] == 1:  # save asc fmt
-            saveins = funutils.SaveData(datatosave,
-                                        savetodatfilebasename + '.asc', '.asc')
+            saveins = funutils.SaveData(
+                datatosave, savetodatfilebasename + '.asc', '.asc',
+                writer=self.writer, **self._writerKws())
         if self.savedict['save_datfmt_sdds'] == 1:  # save sdds fmt
             saveins = funutils.SaveData(
-                datatosave, savetodatfilebasename + '.sdds', '.sdds')
-
-        # save image
-        if self.savedict['save_imgfmt_jpg'] == 1:  # save jpg fmt
-            self.imgpanel.figure.savefig(savetoimgfilebasename + '.jpg')
-        if self.savedict['save_imgfmt_eps'] == 1:  # save eps fmt
-            self.imgpanel.figure.savefig(savetoimgfilebasename + '.eps')
-        if self.savedict['save_imgfmt_png'] == 1:  # save png fmt
-            self.imgpanel.figure.savefig(savetoimgfilebasename + '.png')
+                datatosave, savetodatfilebasename + '.sdds', '.sdds',
+                writer=self.writer, **self._writerKws())
+
+        # save image, rendered in GUI thread (figure is not thread-safe),
+        # file written in writer thread
+        for fmt in ('jpg', 'eps', 'png'):
+            if self.savedict['save_imgfmt_' + fmt] == 1:
+                buf = io.BytesIO()
+                self.imgpanel.savefig(buf, format=fmt)
+                if not self.writer.submit(
+                        writeservice.writeFile,
+                        savetoimgfilebasename + '.' + fmt, buf.getvalue(),
+                        **self._writerKws()):
+                    self.saveDropped += 1
 
 
 # show hint at statusbar
         hintText = 'Data file Record: %d was saved.' % self.saveTimerCounter
+        if self.saveDropped:
+            hintText += ' (%d dropped, writer busy)' % self.saveDropped
         self.statusbar.appinfo.SetLabel(hintText)
         self.statusbar.appinfo.SetForegroundColour('red')
 
         if self.saveTimerCounter == self.saveTimerLife:
-            self.savetimer.Stop()
+            self.stopAutoSave()
             hintText = 'Total %d records are saved to directory %s.' % (
                 self.saveTimerCounter, self.savedict['save_path'])
             self.statusbar.appinfo.SetLabel(hintText)
@@ -486,6 +644,8 @@ class ImageViewer(wx.Frame):
             caption="Exit Warning",
             style=wx.YES_NO | wx.NO_DEFAULT | wx.CENTRE | wx.ICON_QUESTION)
         if dial.ShowModal() == wx.ID_YES:
+            self.stopAcquisition()
+            self.stopAutoSave()
             self.Destroy()
 
     def onAbout(self, event):
@@ -656,6 +816,8 @@ class ImageViewer(wx.Frame):
             bgcolor=self.bkgdcolor,
             heightratio=self.heightRatio,
             func=self.imginifunc)
+        self.imgpanel.setBlit(True)
+        self.imgpanel.decimation = 'mean'
 
         vboxleft.Add(
             self.timenow_st,
@@ -1314,6 +1476,7 @@ class ImageViewer(wx.Frame):
     def onFitPopup(self, event):
         if self.fit_model_x.get_fit_result(
         ) is None or self.fit_model_y.get_fit_result() is None:
+            self._fit_full(self.imgpanel, popup=True)  # fit on demand
             return
         self.fit_popframe = FitPlotFrame(self, self.fit_model_x,
                                          self.fit_model_y)
@@ -1332,6 +1495,15 @@ class ImageViewer(wx.Frame):
     def onTickTime(self, event):
         fmt = '%Y-%m-%d %H:%M:%S %Z'
         self.timenow_st.SetLabel(time.strftime(fmt, time.localtime()))
+        if getattr(self, 'acquirer', None) is not None and \
+                self.acquirer.isRunning():
+            ring = self.framering
+            info = 'Frames received: %d (%.1f Hz), shown: %d, dropped: %d' % (
+                ring.count, ring.rate(), ring.shown, ring.skipped)
+            if self.replay is not None:
+                info += ', replay: %d/%d' % (self.replay.position,
+                                             len(self.replay.stack))
+            self.statusbar.appinfo.SetLabel(info)
 
     def onDAQbtn(self, event):
         label = event.GetEventObject().GetLabel()
@@ -1342,24 +1514,131 @@ class ImageViewer(wx.Frame):
 
         if self.timer.IsRunning():
             self.timer.Stop()
+            self.stopAcquisition()
             self.min_slider.Enable()
             self.max_slider.Enable()
             self.daqtgl_btn.SetLabel('START')
             self.daqtgl_btn.SetBackgroundColour('green')
         else:
+            self.startAcquisition()
             self.timer.Start(self.timer_msec)
             self.min_slider.Disable()
             self.max_slider.Disable()
             self.daqtgl_btn.SetLabel('STOP')
             self.daqtgl_btn.SetBackgroundColour('red')
 
+    def startAcquisition(self):
+        """
+        acquire frames of image PV into ring buffer by monitor callbacks
+        (channel access thread), the timer only renders the newest frame
+        """
+        if self.replay is not None:
+            self.acquirer = self.replay
+            self.framering = self.replay.ring
+            self.replay.start()
+            return
+        value = self.mypv.get(as_numpy=True)
+        ring = getattr(self, 'framering', None)
+        if ring is None or self.acquirer.pv is not self.mypv or \
+                ring.size != value.size or ring.data.dtype != value.dtype:
+            self.stopAcquisition()
+            ring = imgframe.FrameRing(self.ring_size, value.size, value.dtype)
+            self.framering = ring
+            self.acquirer = imgframe.PVAcquirer(self.mypv, ring)
+        ring.put(value, self.mypv.timestamp)
+        self.acquirer.start()
+
+    def stopAcquisition(self):
+        if getattr(self, 'acquirer', None) is not None:
+            self.acquirer.stop()
+
+    def getFrame(self):
+        """
+        newest frame from ring buffer if acquiring (None if no new frame),
+        or fetch one frame from image PV, read-only and no copy
+        """
+        if getattr(self, 'acquirer', None) is not None and \
+                self.acquirer.isRunning():
+            newest = self.framering.latest()
+            if newest is None:
+                return None
+            seq, raw, timestamp = newest
+        else:
+            raw, timestamp = self.fetchRaw()
+        return imgframe.ImageFrame(raw, (self.wpx, self.hpx), self.roixy,
+                                   timestamp)
+
+    def fetchRaw(self):
+        """
+        current waveform of image source, as (raw, timestamp), from replay
+        or image PV
+        """
+        if self.replay is not None:
+            return self.replay.current()
+        return self.mypv.get(as_numpy=True), self.mypv.timestamp
+
+    def onReplay(self, event):
+        """
+        replay recorded frames (HDF5 file of auto save, or .npy stack) as
+        image source, through the same path of acquisition and display
+        """
+        fname = funutils.getFileToLoad(self, ext=['hdf5', 'h5', 'npy'])
+        if fname is None:
+            return
+        speed = wx.GetTextFromUser(
+            'Replay speed, 1: recorded rate, 0: maximum rate, or scale factor',
+            caption='Replay Speed', default_value='1', parent=self)
+        try:
+            speed = float(speed)
+            stack = replay.FrameStack(fname)
+        except (ValueError, OSError, KeyError) as err:
+            self.statusbar.appinfo.SetLabel('Cannot replay %s: %s' % (fname,
+                                                                     err))
+            return
+        self.setReplay(stack, speed)
+        self.statusbar.appinfo.SetLabel('Replay %d frames of %s.' %
+                                        (len(stack), fname))
+
+    def onReplaySeek(self, event):
+        if self.replay is None:
+            return
+        index = wx.GetNumberFromUser(
+            'Go to frame', 'Frame index', 'Replay Seek',
+            self.replay.position, 0, len(self.replay.stack) - 1, self)
+        if index >= 0:
+            self.replay.seek(index)
+
+    def setReplay(self, stack, speed=1.0, loop=True):
+        """
+        use frames of ``replay.FrameStack`` as image source, back to image
+        PV if None
+        """
+        running = self.timer.IsRunning()
+        self.stopAcquisition()
+        if self.replay is not None:
+            self.replay.stack.close()
+            self.replay = None
+            self.wpx, self.hpx = self._live_shape
+            self.roixy = [0, self.wpx, 0, self.hpx]
+        if stack is None:
+            return
+        self._live_shape = self.wpx, self.hpx
+        self.replay = replay.ReplaySource(stack, speed=speed, loop=loop,
+                                          nframes=self.ring_size)
+        self.wpx, self.hpx = stack.shape
+        self.roixy = [0, self.wpx, 0, self.hpx]
+        if running:
+            self.startAcquisition()
+        self.showSource()
+
     def onUpdate(self, event):
-        if self.mypv.connected == True:
-            self.inten_val.SetLabel("%.4e" % (np.sum(self.mypv.get())))
+        if self.replay is not None or self.mypv.connected == True:
+            frame = self.getFrame()
+            if frame is None:  # no new frame
+                return
+            self.inten_val.SetLabel("%.4e" % (frame.intensity))
 
-            self.imgpanel.z = self.mypv.get()[0:self.wpx * self.hpx].reshape(
-                (self.wpx, self.hpx
-                 ))[self.roixy[0]:self.roixy[1], self.roixy[2]:self.roixy[3]]
+            self.imgpanel.setFrame(frame)
             try:
                 cmin_now = float(self.imgcr_min_tc.GetValue())
                 cmax_now = float(self.imgcr_max_tc.GetValue())
@@ -1367,10 +1646,9 @@ class ImageViewer(wx.Frame):
                 cmin_now = None
                 cmax_now = None
             self.imgpanel.im.set_clim(vmin=cmin_now, vmax=cmax_now)
-            self.imgpanel.im.set_array(self.imgpanel.z)
-            self.imgpanel.repaint()
+            self.imgpanel.repaint(frame.histx, frame.histy)
             # update fitting report box
-            self._fit_update(self.imgpanel)
+            self._fit_update(self.imgpanel, frame)
             try:
                 self.fit_popframe.plotpanel.repaint(self.fit_model_x,
                                                     self.fit_model_y)
@@ -1385,6 +1663,7 @@ class ImageViewer(wx.Frame):
                 style=wx.OK | wx.ICON_ERROR | wx.CENTRE)
             if dial.ShowModal() == wx.ID_OK:
                 self.timer.Stop()
+                self.stopAcquisition()
                 self.min_slider.Enable()
                 self.max_slider.Enable()
                 self.daqtgl_btn.SetLabel('START')
@@ -1394,12 +1673,23 @@ class ImageViewer(wx.Frame):
         """
         set image data source and show in the image panel
         """
+        self.setReplay(None)
         self.mypv = epics.PV(
             event.GetEventObject().GetValue(), auto_monitor=True)
+        if self.timer.IsRunning():
+            self.startAcquisition()
+        self.showSource()
 
-        self.imgpanel.z = self.mypv.get()[0:self.wpx * self.hpx].reshape(
-            (self.wpx, self.hpx
-             ))[self.roixy[0]:self.roixy[1], self.roixy[2]:self.roixy[3]]
+    def showSource(self):
+        """
+        show the current frame of image source, reset color range
+        """
+        frame = self.getFrame()
+        if frame is None:  # acquiring, no new frame yet
+            raw, timestamp = self.fetchRaw()
+            frame = imgframe.ImageFrame(raw, (self.wpx, self.hpx),
+                                        self.roixy, timestamp)
+        self.imgpanel.setFrame(frame)
         self.imgpanel.cmin = self.imgpanel.z.min()
         self.imgpanel.cmax = self.imgpanel.z.max()
         cmin_now = self.imgpanel.cmin
@@ -1417,10 +1707,9 @@ class ImageViewer(wx.Frame):
         self.imgcr_min_tc.SetValue('%.1f' % cmin_now)
         self.imgcr_max_tc.SetValue('%.1f' % cmax_now)
         self.imgpanel.im.set_clim(vmin=cmin_now, vmax=cmax_now)
-        self.imgpanel.im.set_array(self.imgpanel.z)
-        self.imgpanel.repaint()
-        self.inten_val.SetLabel("%.4e" % (np.sum(self.mypv.get())))
-        self._fit_update(self.imgpanel)
+        self.imgpanel.repaint(frame.histx, frame.histy)
+        self.inten_val.SetLabel("%.4e" % (frame.intensity))
+        self._fit_update(self.imgpanel, frame)
 
     def onCheckRCM(self, event):
         if event.GetEventObject().IsChecked():  # checked
@@ -1794,7 +2083,7 @@ class AutoSavePanel(wx.Frame):
         self.parent.saveTimerLife = total_setval
 
         #self.testtimer.Start(tperiod_setval/cntpert_setval*1000)
-        self.parent.savetimer.Start(self.parent.savedict['save_tfreq_msec'])
+        self.parent.startAutoSave()
         self.Close(True)
 
     def onCancel(self, event):
@@ -2800,6 +3089,11 @@ class ImagePanel(wx.Panel):
         self.bgcolor = bgcolor
         self.hratio = heightratio
         self.func = func
+        self.blit = False  # blit image and projections only, if True
+        self._bg = None  # cached background for blit
+        self._shape = None  # image shape of present geometry
+        self.decimation = None  # display decimation: None, 'mean' or 'max'
+        self._pyramid = None  # display pyramid of present image
         self.figure = Figure(self.figsize, self.dpi)
         self.canvas = FigureCanvasWxAgg(self, -1, self.figure)
         self.cmaptype = 'jet'
@@ -2815,6 +3109,9 @@ class ImagePanel(wx.Panel):
         self.canvas.mpl_connect('button_press_event', self.onPress)
         self.canvas.mpl_connect('button_release_event', self.onRelease)
         self.canvas.mpl_connect('motion_notify_event', self.onMotion)
+        self.canvas.mpl_connect('draw_event', self.onDraw)
+        self.axes.callbacks.connect('xlim_changed', self.onZoom)
+        self.axes.callbacks.connect('ylim_changed', self.onZoom)
 
         self.mkc1 = wx.Colour(255, 0, 0).GetAsString(wx.C2S_HTML_SYNTAX)
         self.mkc2 = wx.Colour(240, 230, 140).GetAsString(wx.C2S_HTML_SYNTAX)
@@ -2850,30 +3147,117 @@ class ImagePanel(wx.Panel):
     def refresh(self):
         self.canvas.draw_idle()
 
-    def repaint(self):
-        self.onSetHist()
-        self.figure.canvas.draw_idle()
+    def setBlit(self, flag=True):
+        """
+        blit mode: cache the static background (axes, ticks, etc.),
+        redraw image, projections and markers only for new frames,
+        full redraw only when geometry (image shape) changes
+        """
+        self.blit = flag and self.canvas.supports_blit
+        self.im.set_animated(self.blit)
+        self._bg = None
+        self.canvas.draw_idle()
+
+    def setImage(self, z, pyramid=None):
+        """
+        set full resolution image z (for projections and statistics),
+        if decimation is on, the pyramid level fitting the widget is shown
+
+        :param pyramid: ImagePyramid of z, built here if None
+        """
+        self.z = z
+        if self.decimation:
+            self._pyramid = pyramid if pyramid is not None else \
+                imgframe.ImagePyramid(z, self.decimation)
+        else:
+            self._pyramid = None
+        self.im.set_array(self.displayImage())
+
+    def setFrame(self, frame):
+        """
+        set ROI of ImageFrame as image, reuse its cached pyramid
+        """
+        self.setImage(frame.roi, frame.pyramid(self.decimation)
+                      if self.decimation else None)
+
+    def displayImage(self):
+        """
+        image array for display, decimated to the visible pixels of
+        the widget (zoom considered), full resolution otherwise
+        """
+        if self._pyramid is None:
+            return self.z
+        x0, x1 = self.axes.get_xlim()
+        y0, y1 = self.axes.get_ylim()
+        fx = abs(x1 - x0) / max(self.xyscalar[1] - self.xyscalar[0], 1)
+        fy = abs(y1 - y0) / max(self.xyscalar[3] - self.xyscalar[2], 1)
+        bbox = self.axes.bbox
+        return self._pyramid.fit(bbox.width / min(fx, 1.0),
+                                 bbox.height / min(fy, 1.0))
+
+    def onZoom(self, axes):
+        if self._pyramid is not None:
+            self.im.set_array(self.displayImage())
+
+    def _blitArtists(self):
+        artists = [self.im] + list(self.axes.lines) + list(self.axes.texts)
+        return [a for a in artists if a.get_visible()]
+
+    def onDraw(self, event):
+        """
+        full draw done, cache background and draw animated image over it
+        """
+        if not self.blit:
+            return
+        self._bg = self.canvas.copy_from_bbox(self.axes.bbox)
+        for a in self._blitArtists():
+            self.axes.draw_artist(a)
+
+    def savefig(self, filename, **kwargs):
+        """
+        save figure, animated image (blit mode) is included
+        """
+        self.im.set_animated(False)
+        try:
+            self.figure.savefig(filename, **kwargs)
+        finally:
+            self.im.set_animated(self.blit)
+
+    def repaint(self, histx=None, histy=None):
+        changed = self.onSetHist(histx, histy)
+        if self.blit and self._bg is not None and not changed:
+            self.canvas.restore_region(self._bg)
+            for a in self._blitArtists():
+                self.axes.draw_artist(a)
+            self.canvas.blit(self.axes.bbox)
+        else:
+            self.figure.canvas.draw_idle()
 
     def onSetcm(self, cmap):
         self.cmaptype = cmap
         self.im.set_cmap(self.cmaptype)
-        self.im.set_array(self.z)
+        self.im.set_array(self.displayImage())
         self.repaint()
 
-    def onSetHist(self):
-        self.histx = self.z.sum(axis=0)
-        self.histy = self.z.sum(axis=1)
-        idxmaxx, idxmaxy = np.where(self.histx == self.histx.max()), np.where(
-            self.histy == self.histy.max())
-        self.maxidx, self.maxidy = idxmaxx[0][0], idxmaxy[0][0]
+    def onSetHist(self, histx=None, histy=None):
+        """
+        update projections, histx/histy: precomputed sums of self.z
+        along axis 0/1, e.g. from ImageFrame;
+        return True if geometry (extent, limits) is updated
+        """
+        self.histx = self.z.sum(axis=0) if histx is None else histx
+        self.histy = self.z.sum(axis=1) if histy is None else histy
+        self.maxidx, self.maxidy = self.histx.argmax(), self.histy.argmax()
+        hxmax, hymax = self.histx[self.maxidx], self.histy[self.maxidy]
         self.xx = np.arange(self.histx.size) + 1
         self.yy = np.arange(self.histy.size) + 1
         self.linex.set_xdata(self.xx)
-        self.linex.set_ydata(
-            self.histx / self.histx.max() * self.maxidy * self.hratio)
-        self.liney.set_xdata(
-            self.histy / self.histy.max() * self.maxidx * self.hratio)
+        self.linex.set_ydata(self.histx / hxmax * self.maxidy * self.hratio)
+        self.liney.set_xdata(self.histy / hymax * self.maxidx * self.hratio)
         self.liney.set_ydata(self.yy)
+        if self.z.shape == self._shape:
+            return False
+        self._shape = self.z.shape
         self.xyscalar = [
             self.xx.min(),
             self.xx.max(),
@@ -2883,6 +3267,7 @@ class ImagePanel(wx.Panel):
         self.im.set_extent(self.xyscalar)
         self.axes.set_xlim(self.xyscalar[0:2])
         self.axes.set_ylim(self.xyscalar[2:4])
+        return True
 
     def onSetCr(self, crange):
         self.im.set_clim(crange)
@@ -2905,8 +3290,10 @@ class ImagePanel(wx.Panel):
             cmap=plt.get_cmap(self.cmaptype),
             origin='lower left',
             vmin=self.cmin,
-            vmax=self.cmax)
+            vmax=self.cmax,
+            animated=self.blit)
         self.im.set_extent(self.xyscalar)
+        self._shape = self.z.shape
         self.linex.set_visible(False)
         self.liney.set_visible(False)
         self.axes.set_xlim(self.xyscalar[0:2])
@@ -2950,6 +3337,7 @@ class ImagePanel(wx.Panel):
             top=0.9999, bottom=0.0001, left=0.0001, right=0.9999)
 
     def onSize(self, event):
+        self._bg = None
         self.canvas.SetSize(self.GetSize())
         self.figure.set_tight_layout(True)
         self.figure.subplots_adjust(
@@ -3271,23 +3659,36 @@ class FitPlotFrame(wx.Frame):
         filelabel = time.strftime('%H%M%S', time.localtime())
         savetofilename = self._parent.save_path_str + '/' + 'fitdata' + filelabel + '.hdf5'
         try:
-            funutils.ExportData(data_raw, data_fit, self._model_x,
-                                self._model_y, savetofilename)
+            funutils.ExportData(
+                data_raw,
+                data_fit,
+                self._model_x,
+                self._model_y,
+                savetofilename,
+                writer=writeservice.getWriter(),
+                h5opts=self._parent.save_h5opts,
+                callback=lambda res: wx.CallAfter(self._onExportDone, res, True),
+                errback=lambda err: wx.CallAfter(self._onExportDone, savetofilename, False))
+        except:
+            self._onExportDone(savetofilename, False)
+
+    def _onExportDone(self, savetofilename, success):
+        if not self:  # frame closed
+            return
+        if success:
             dial = wx.MessageDialog(
                 self,
                 message=u"Data saved into " + savetofilename + ".",
                 caption=u"Successfully Saved Data",
                 style=wx.OK | wx.ICON_WARNING | wx.CENTRE)
-            if dial.ShowModal() == wx.ID_OK:
-                dial.Destroy()
-        except:
+        else:
             dial = wx.MessageDialog(
                 self,
                 message=u"Data cannot saved into " + savetofilename + ".",
                 caption=u"Saved Data Failure",
                 style=wx.OK | wx.ICON_WARNING | wx.CENTRE)
-            if dial.ShowModal() == wx.ID_OK:
-                dial.Destroy()
+        if dial.ShowModal() == wx.ID_OK:
+            dial.Destroy()
 
     def onSetRange(self, event):
         obj = event.GetEventObject()
@@ -3531,8 +3932,8 @@ class ImagePanelxy(wx.Panel):
     def repaint(self):
         self.xyplot.set_xdata(self.x)
         self.xyplot.set_ydata(self.y)
-        self.axes.set_xlim(min(self.x), max(self.x))
-        self.axes.set_ylim(min(self.y), max(self.y))
+        self.axes.set_xlim(np.min(self.x), np.max(self.x))
+        self.axes.set_ylim(np.min(self.y), np.max(self.y))
         self.figure.canvas.draw_idle()
 
     def doPlot(self):
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+replay of recorded frames as image source, without IOC:
+    FrameStack  : recorded frame stack, HDF5 file of ``FrameWriter`` (or of
+                  ``SaveData``, one frame) or .npy file; stacks of
+                  ``FrameWriter`` are chunked (extendable), frames are read
+                  on demand chunk by chunk, i.e. one frame per read for the
+                  default chunk of one frame; .npy files and contiguous
+                  uncompressed HDF5 datasets are memory mapped
+    ReplaySource: feed frames of FrameStack into ``FrameRing`` at native,
+                  scaled or maximum rate, with seeking and looping, same
+                  interface as ``imgframe.PVAcquirer``
+
+Usage:
+>>> stack = FrameStack('imagedat20170101_120000.hdf5')
+>>> source = ReplaySource(stack, speed=2.0)  # twice the recorded rate
+>>> source.start()
+>>> seq, raw, timestamp = source.ring.latest()
+"""
+
+from __future__ import division
+
+import threading
+import time
+
+import numpy as np
+import h5py
+
+from . import imgframe
+
+
+class FrameStack(object):
+    """ recorded frames, shape (n, rows, cols)
+
+    :param fname: HDF5 file (dataset ``dataset``, timestamps from
+                  'image/timestamp' if recorded) or .npy file
+    :param dataset: path of frames in HDF5 file
+
+    Raise ValueError if there is no frame.
+    """
+
+    def __init__(self, fname, dataset='image/data'):
+        self.fname = fname
+        self.file = None
+        self.timestamps = None
+        if fname.endswith('.npy'):
+            data = np.load(fname, mmap_mode='r')
+        else:
+            try:  # file could be still written by SWMR writer
+                f = h5py.File(fname, 'r', libver='latest', swmr=True)
+            except (OSError, ValueError):
+                f = h5py.File(fname, 'r')
+            self.file = f
+            dset = f[dataset]
+            data = self._mmap(dset)
+            if data is None:
+                data = dset
+            if 'image/timestamp' in f and dataset == 'image/data':
+                self.timestamps = f['image/timestamp'][:]
+        if data.ndim == 2:
+            data = data[None, ...] if isinstance(data, np.ndarray) else \
+                data[()][None, ...]
+        if data.ndim != 3 or data.shape[0] == 0:
+            self.close()
+            raise ValueError("no frames in %s, shape %s" %
+                             (fname, data.shape))
+        self.data = data
+        self.shape = tuple(data.shape[1:])
+        self.dtype = data.dtype
+
+    def _mmap(self, dset):
+        """ memory map of contiguous, uncompressed dataset, None if not
+        possible (chunked or filtered, e.g. stacks of ``FrameWriter``,
+        which are read through h5py)
+        """
+        if dset.chunks is not None or dset.compression is not None:
+            return None
+        offset = dset.id.get_offset()
+        if offset is None:  # not allocated
+            return None
+        return np.memmap(self.fname, mode='r', dtype=dset.dtype,
+                         shape=dset.shape, offset=offset)
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def __getitem__(self, i):
+        return self.data[i]
+
+    def period(self):
+        """ median interval of recorded frames [s], None if not recorded
+        """
+        if self.timestamps is None or len(self.timestamps) < 2:
+            return None
+        dt = np.diff(self.timestamps[:len(self)])
+        dt = dt[dt > 0]
+        return float(np.median(dt)) if dt.size else None
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class ReplaySource(object):
+    """ replay FrameStack into FrameRing by background thread
+
+    :param stack: FrameStack instance
+    :param ring: FrameRing, created for the frame size if None
+    :param speed: 1.0: native rate (recorded intervals), > 1: faster,
+                  0: maximum rate (no waiting)
+    :param loop: restart from the first frame after the last one
+    :param rate: frame rate [Hz] for native speed if intervals not recorded
+    :param nframes: capacity of the created ring
+    """
+
+    pv = None  # not a PV source
+
+    def __init__(self, stack, ring=None, speed=1.0, loop=True, rate=10.0,
+                 nframes=8):
+        self.stack = stack
+        if ring is None:
+            ring = imgframe.FrameRing(nframes, int(np.prod(stack.shape)),
+                                      stack.dtype)
+        self.ring = ring
+        self.speed = speed
+        self.loop = loop
+        self.rate = rate
+        self.played = 0
+        self._pos = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def position(self):
+        """ index of the next frame to play
+        """
+        return self._pos
+
+    def seek(self, index):
+        """ play from frame ``index`` (negative from the end)
+        """
+        with self._lock:
+            self._pos = int(index) % len(self.stack)
+
+    def _interval(self, i):
+        """ waiting time [s] after frame i
+        """
+        if not self.speed:
+            return 0.0
+        ts = self.stack.timestamps
+        if ts is not None and i + 1 < min(len(ts), len(self.stack)):
+            dt = ts[i + 1] - ts[i]
+        else:
+            dt = self.stack.period() or 1.0 / self.rate
+        return max(dt, 0.0) / self.speed
+
+    def _run(self):
+        due = time.time()
+        while not self._stop.is_set():
+            with self._lock:
+                i = self._pos
+                if i >= len(self.stack):
+                    if not self.loop:
+                        break
+                    i = 0
+                self._pos = i + 1
+            self.ring.put(self.stack[i], time.time())
+            self.played += 1
+            due += self._interval(i)
+            wait = due - time.time()
+            if wait > 0:
+                self._stop.wait(wait)
+            elif wait < -1.0:  # fell behind (e.g. seeking), no catching up
+                due = time.time()
+        self._thread = None
+
+    def start(self):
+        if self.isRunning():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='replay')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        thread = self._thread
+        self._stop.set()
+        if thread is not None:
+            thread.join()
+
+    def isRunning(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def current(self):
+        """ last played frame (the first one if not played), as (raw,
+        timestamp), raw is 1-D as PV waveform
+        """
+        i = max(self._pos - 1, 0) % len(self.stack)
+        return np.asarray(self.stack[i]).ravel(), time.time()
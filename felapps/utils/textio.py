@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+text (.asc, .dat) array files, whitespace separated columns:
+    writeText: vectorized writer, integer format for integral data
+    readText : parser of text in memory, int64 result for integral data
+    loadText : readText with optional binary sidecar cache (see
+               ``sidecarName``), reused (memory mapped) while the text
+               file is unchanged, thus the text is parsed only once
+
+Usage:
+>>> writeText('imagedat.asc', image)
+>>> image = loadText('imagedat.asc', cache=True)  # parse once, then cached
+"""
+
+from __future__ import division
+
+import io
+import os
+import re
+
+import numpy as np
+
+_INTEGRAL_MAX = 2**53  # floats below are exactly integers in text
+_NOT_INT = re.compile(br'[.eEnNiI]')  # decimal point, exponent, nan, inf
+
+
+def isIntegral(data):
+    """ if all elements of data could be written as integers exactly
+    """
+    data = np.asarray(data)
+    if data.dtype.kind in 'iub':
+        return True
+    if data.dtype.kind != 'f' or data.size == 0:
+        return False
+    with np.errstate(invalid='ignore'):
+        return bool(
+            np.all(np.abs(data) < _INTEGRAL_MAX) and
+            np.all(np.floor(data) == data))
+
+
+def writeText(fname, data, fmt=None, delimiter=' ', chunk=4096):
+    """ write 1D/2D array as text, one row per line
+
+    :param fname: file name
+    :param data: array
+    :param fmt: format of one element, '%d' for integral data, '%.17g'
+                (exact round trip of float64) otherwise if None
+    :param delimiter: column separator
+    :param chunk: rows to be formatted at once
+    """
+    data = np.asarray(data)
+    if data.ndim == 1:
+        data = data.reshape(-1, 1)
+    if fmt is None:
+        if isIntegral(data):
+            fmt = '%d'
+            data = data.astype(np.int64)
+        else:
+            fmt = '%.17g'
+    rowfmt = delimiter.join([fmt] * data.shape[1]) + '\n'
+    with open(fname, 'w') as f:
+        # one formatting operation of C level per block of rows
+        for i in range(0, data.shape[0], chunk):
+            block = data[i:i + chunk]
+            f.write((rowfmt * block.shape[0]) % tuple(block.ravel().tolist()))
+
+
+def readText(fname, dtype=None, comments='#'):
+    """ read text array file, the whole file is parsed at once from memory
+    by the C parser of ``np.loadtxt``
+
+    :param fname: file name
+    :param dtype: data type of result, if None: int64 if no decimal
+                  point, exponent or nan/inf found (e.g. files written by
+                  ``writeText`` for integral data), float64 otherwise
+    :param comments: lines starting with it are skipped
+    :return: array of the shape as ``np.loadtxt``: 2D, 1D for one row or
+             one column
+
+    Parsing text is not faster than ``np.loadtxt``, use ``loadText`` for
+    files read repeatedly.
+    """
+    with open(fname, 'rb') as f:
+        buf = f.read()
+    cbytes = comments.encode() if comments else None
+    if cbytes and cbytes in buf:
+        buf = b'\n'.join(
+            line for line in buf.splitlines()
+            if not line.lstrip().startswith(cbytes))
+    if b',' in buf:
+        buf = buf.replace(b',', b' ')
+    if not buf.strip():
+        return np.empty((0, ))
+    if dtype is None:
+        dtype = np.float64 if _NOT_INT.search(buf) else np.int64
+    return np.loadtxt(io.BytesIO(buf), dtype=dtype, comments=None)
+
+
+def sidecarName(fname, dtype=None, comments='#'):
+    """ name of binary cache file of text file ``fname`` read with
+    ``dtype`` and ``comments``, e.g. 'imagedat.asc.auto-23.npy'
+    """
+    dtype = 'auto' if dtype is None else np.dtype(dtype).str.lstrip('<>=|')
+    comments = (comments or '').encode().hex()
+    return '%s.%s-%s.npy' % (fname, dtype, comments)
+
+
+def loadText(fname, cache=False, mmap=True, dtype=None, comments='#'):
+    """ read text array file, with optional binary sidecar cache
+
+    If ``cache``, the cache ``sidecarName(fname, dtype, comments)`` is used
+    if its modification time equals the one of the text file (set when the
+    cache is written), otherwise the text file is parsed by ``readText``
+    and the cache is written (skipped silently if the directory is not
+    writable).
+
+    :param cache: use and write the sidecar cache
+    :param mmap: return read-only memory map of the cache
+    :param dtype: data type, see ``readText``
+    :param comments: comment prefix, see ``readText``
+    """
+    if not cache:
+        return readText(fname, dtype=dtype, comments=comments)
+    npyfile = sidecarName(fname, dtype, comments)
+    try:
+        if os.stat(npyfile).st_mtime_ns == os.stat(fname).st_mtime_ns:
+            return np.load(npyfile, mmap_mode='r' if mmap else None)
+    except (OSError, ValueError):
+        pass
+    mtime = os.stat(fname).st_mtime_ns
+    data = readText(fname, dtype=dtype, comments=comments)
+    tmpfile = npyfile + '.tmp%d' % os.getpid()
+    try:
+        with open(tmpfile, 'wb') as f:
+            np.save(f, data)
+        # cache is valid for this version of text file only
+        os.utime(tmpfile, ns=(mtime, mtime))
+        os.replace(tmpfile, npyfile)
+    except OSError:
+        try:
+            os.remove(tmpfile)
+        except OSError:
+            pass
+    return data
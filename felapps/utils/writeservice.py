@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+background writing service, file saving off the acquisition and GUI
+threads:
+    WriterService: bounded queue of writing jobs done in order by one
+                   writer thread, producers block (backpressure) or give up
+                   when the queue is full, errors are reported by callback
+                   and kept in ``errors``
+    getWriter    : shared WriterService of the application, flushed at exit
+    writeFile    : job writing bytes rendered in producer thread, e.g.
+                   figures saved to memory buffer in GUI thread
+
+Jobs are called later in the writer thread, thus arrays handed over must
+not be modified afterwards by the producer; new arrays from PV fetching
+or computing are safe without copy, buffers reused in place (e.g. slots
+of ``FrameRing``, preallocated scan arrays) should be copied.
+"""
+
+from __future__ import division
+
+import atexit
+import collections
+import threading
+import time
+import traceback
+
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+
+
+class WriterService(object):
+    """ writer thread with bounded job queue
+
+    :param maxsize: maximum queued jobs, producers wait when reached
+    :param nerrors: recent errors to be kept
+    """
+
+    def __init__(self, maxsize=64, nerrors=16):
+        self._queue = queue.Queue(maxsize)
+        self.errors = collections.deque(maxlen=nerrors)
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='felapps-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, func, *args, **kws):
+        """ queue job ``func(*args, **kws)``, return True if queued
+
+        Keyword arguments of ``submit`` itself (not passed to ``func``):
+
+        :param callback: called as ``callback(result)`` in writer thread
+                         after the job is done
+        :param errback: called as ``errback(exc)`` in writer thread if the
+                        job raises, GUI callers should forward both to main
+                        thread, e.g. by ``wx.CallAfter``
+        :param block: if False, do not wait for free space of queue
+        :param timeout: seconds to wait for free space of queue, forever if
+                        None; return False (job dropped) if the queue is
+                        still full
+        """
+        callback = kws.pop('callback', None)
+        errback = kws.pop('errback', None)
+        block = kws.pop('block', True)
+        timeout = kws.pop('timeout', None)
+        if self._closed:
+            raise RuntimeError("writer service is closed")
+        try:
+            self._queue.put((func, args, kws, callback, errback), block,
+                            timeout)
+        except queue.Full:
+            self.rejected += 1
+            return False
+        self.submitted += 1
+        return True
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                func, args, kws, callback, errback = job
+                try:
+                    result = func(*args, **kws)
+                except Exception as err:
+                    self.failed += 1
+                    self.errors.append((time.time(), repr(err),
+                                        traceback.format_exc()))
+                    if errback is not None:
+                        errback(err)
+                else:
+                    self.completed += 1
+                    if callback is not None:
+                        callback(result)
+            except Exception:
+                # failure of callbacks should not stop the writer
+                self.errors.append((time.time(), 'callback error',
+                                    traceback.format_exc()))
+            finally:
+                self._queue.task_done()
+
+    def pending(self):
+        """ number of queued jobs (approximate)
+        """
+        return self._queue.qsize()
+
+    def isFull(self):
+        return self._queue.full()
+
+    def flush(self, timeout=None):
+        """ wait until all queued jobs are done, return True if done, False
+        if ``timeout`` [s] expired
+        """
+        if timeout is None:
+            self._queue.join()
+            return True
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks:
+            if time.time() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self, timeout=None):
+        """ write all queued jobs and stop the writer thread
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+
+_writer = None
+_wlock = threading.Lock()
+
+
+def getWriter():
+    """ return shared WriterService of the application, queued jobs are
+    written before the interpreter exits
+    """
+    global _writer
+    with _wlock:
+        if _writer is None:
+            _writer = WriterService()
+            atexit.register(_writer.close)
+    return _writer
+
+
+def writeFile(fname, data):
+    """ write bytes ``data`` to file ``fname``, return number of bytes
+    """
+    with open(fname, 'wb') as f:
+        return f.write(data)
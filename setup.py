@@ -26,6 +26,7 @@ appScriptsName = ['imageviewer',
                   'imageviewer.py',
                   'felformula',
                   'felformula.py',
+                  'felformula-batch',
                   'cornalyzer', 
                   'cornalyzer.py',
                   'dataworkshop',
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# benchmark for the physics kernels of felapps package:
+#   felbase: FELcalc.onFELAnalyse, FELcalc.findSatFactor, solveSatFactor,
+#            HalbachPerm.findGap, aupmu
+#   chicane: r56chi, bchi
+#   fldprop: FieldPropagator.farfield, readfld
+#
+# only physics modules are imported, runs without GUI packages
+#
+# usage: python bench_physics.py [--save out.json] [--compare base.json]
+#                                [--max-size 1000000] [--threshold 1.5]
+#
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from felapps.physics import felbase
+from felapps.physics import chicane
+from felapps.physics import fldprop
+
+
+def measure(func, repeat=3):
+    """ return best wall time [s] and peak traced memory [bytes] of func()
+    """
+    func()  # warm up
+    best = np.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def write_dfl(filename, ncar=121, nslice=1, seed=1):
+    """ synthetic Genesis .dfl file, gaussian field with random phase noise
+    """
+    rng = np.random.RandomState(seed)
+    x = np.linspace(-1, 1, ncar)
+    amp = np.exp(-(x[:, None]**2 + x[None, :]**2) / 0.1)
+    with open(filename, 'wb') as f:
+        for _ in range(nslice):
+            field = amp * np.exp(1j * rng.uniform(-0.1, 0.1, amp.shape))
+            f.write(field.astype(np.complex128).tobytes())
+
+
+def cases(max_size):
+    """ yield (name, size, func) of benchmark cases
+    """
+    args = (17500, 8.5714e-5, 0.08, 15, 1.3e-9, 1.4e-6, 5000, 1.0e-9, 100)
+    yield ('FELcalc.onFELAnalyse', 1,
+           lambda: felbase.FELcalc(*args).onFELAnalyse())
+
+    sizes = [n for n in (10**3, 10**5, 10**6) if n <= max_size]
+    for n in sizes:
+        energy = np.linspace(17000, 18000, n)
+        yield ('FELcalc.onFELAnalyse', n,
+               lambda e=energy: felbase.FELcalc(e, *args[1:]).onFELAnalyse())
+
+    for n in sizes:
+        nl = np.linspace(1e5, 1e7, n)
+        l3 = np.linspace(0.5, 5, n)
+        yield ('felbase.solveSatFactor', n,
+               lambda nl=nl, l3=l3: felbase.solveSatFactor(nl, l3, 0.03))
+        yield ('FELcalc.findSatFactor', n,
+               lambda nl=nl, l3=l3: felbase.FELcalc().findSatFactor(
+                   nl, l3, 0.03))
+
+    for n in sizes:
+        bu = np.linspace(0.2, 2.0, n)
+        yield ('HalbachPerm.findGap', n,
+               lambda bu=bu: felbase.HalbachPerm(_Bu=bu).findGap())
+
+    for n in sizes:
+        gap = np.linspace(5, 30, n)
+        yield ('felbase.aupmu', n, lambda g=gap: felbase.aupmu(g, 50))
+        field = np.linspace(0.01, 0.5, n)
+        yield ('chicane.r56chi', n,
+               lambda b=field: chicane.r56chi(587.87, b))
+        r56 = np.linspace(0, 1e-3, n)
+        yield ('chicane.bchi', n, lambda r=r56: chicane.bchi(587.87, r))
+
+    # files are removed when the cases are consumed
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for ncar in (121, 241):
+            dfl = os.path.join(tmpdir, 'bench%d.dfl' % ncar)
+            write_dfl(dfl, ncar=ncar)
+            yield ('fldprop.readfld', ncar * ncar,
+                   lambda f=dfl, n=ncar: fldprop.readfld(f, ncar=n))
+
+    rng = np.random.RandomState(1)
+    for ncar in (512, 1024):
+        efield = rng.randn(ncar, ncar) + 1j * rng.randn(ncar, ncar)
+        prop = fldprop.getPropagator(ncar)
+        yield ('FieldPropagator.farfield', ncar * ncar,
+               lambda e=efield, p=prop: p.farfield(e))
+    efield = rng.randn(16, 512, 512) + 1j * rng.randn(16, 512, 512)
+    yield ('FieldPropagator.farfield', efield.size,
+           lambda e=efield: fldprop.getPropagator(512).farfield(e))
+
+
+def compare(results, baseline, threshold):
+    """ print ratios to baseline, return names of regressed cases
+    """
+    base = {(r['name'], r['size']): r for r in baseline['results']}
+    regressed = []
+    for r in results:
+        b = base.get((r['name'], r['size']))
+        if b is None:
+            continue
+        ratio = r['time'] / b['time']
+        flag = ''
+        if ratio > threshold:
+            flag = '  <-- REGRESSION'
+            regressed.append('%s[%d]' % (r['name'], r['size']))
+        print("{0:<26s} {1:>9d} {2:>8.2f}x time {3:>8.2f}x memory{4}".format(
+            r['name'], r['size'], ratio,
+            r['peak_mem'] / max(b['peak_mem'], 1), flag))
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark physics kernels of felapps.")
+    parser.add_argument('--save', help="save results to json file.")
+    parser.add_argument('--compare', help="json file of baseline results.")
+    parser.add_argument('--max-size', type=int, default=10**6,
+                        help="largest array size, default: 1000000.")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="repeat times, best time is taken.")
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help="time ratio over baseline as regression.")
+    args = parser.parse_args(argv)
+
+    results = []
+    for name, size, func in cases(args.max_size):
+        t, mem = measure(func, args.repeat)
+        results.append({'name': name, 'size': size, 'time': t,
+                        'peak_mem': mem})
+        print("{0:<26s} {1:>9d} {2:>12.3e} s {3:>10.2f} MB".format(
+            name, size, t, mem / 1e6))
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'results': results,
+    }
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressed = compare(results, json.load(f), args.threshold)
+        if regressed:
+            print("Regression: " + ', '.join(regressed))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# consistency and round-trip tests of the GUI-free physics modules,
+# run by: python -m pytest tests
+#
+
+import csv
+
+import numpy as np
+import h5py
+import pytest
+
+from felapps.physics import felbase
+from felapps.physics import felbatch
+from felapps.physics import felexplore
+from felapps.physics import felinverse
+from felapps.physics import felsens
+from felapps.physics import felsurrogate
+from felapps.physics import fldprop
+from felapps.physics import hghg
+from felapps.physics import chicane
+
+# resonant parameters of 8 nm FEL, finite results for 800-900 MeV
+FIXED = {'radWavelength': 8e-9, 'unduPeriodLength': 0.03,
+         'avgBetaFunc': 10, 'normEmittance': 1e-6}
+
+
+def test_felsweep_grid_matches_scalar():
+    energy = np.linspace(800, 900, 3)
+    current = np.array([300, 600])
+    r = felbase.felsweep(beamEnergy=energy, peakCurrent=current, **FIXED)
+    assert r['08-Lg3D'].shape == (3, 2)
+    s = felbase.felsweep(beamEnergy=energy[1], peakCurrent=current[0],
+                         **FIXED)
+    assert np.isclose(r['08-Lg3D'][1, 0], s['08-Lg3D'])
+    assert np.isfinite(r['12-Lsat']).all()
+
+
+def test_result_has_saturation_mask():
+    r = felbase.felsweep(beamEnergy=np.linspace(800, 900, 3), **FIXED)
+    assert r['19-satConverged'].dtype == bool
+    assert r['19-satConverged'].shape == (3, ) and r['19-satConverged'].all()
+
+
+def test_unknown_bunch_shape_raises():
+    with pytest.raises(ValueError, match='parabolic'):
+        felbase.felsweep(bunchShape=['gaussian', 'parabolic'], **FIXED)
+
+
+def test_aupmu_gapau_round_trip():
+    gap = np.linspace(8, 30, 5)
+    au = felbase.aupmu(gap, 50)
+    assert np.allclose(felbase.gapau(au, 50), gap)
+
+
+def test_chicane_r56_field_round_trip():
+    field = np.linspace(0.04, 0.30, 5)
+    r56 = chicane.r56chi(587.87, field)
+    assert np.allclose(chicane.bchi(587.87, r56), field)
+    assert chicane.getChicane(0.15, 0.285) is chicane.getChicane(0.15, 0.285)
+    assert np.isnan(chicane.bchi(587.87, -1e-3))
+
+
+def test_felbatch_csv_round_trip(tmp_path):
+    infile, outfile = str(tmp_path / 'in.csv'), str(tmp_path / 'out.csv')
+    with open(infile, 'w') as f:
+        f.write('beamEnergy,peakCurrent\n800,300\n850,400\n900,500\n')
+    fixed = felbatch._parseFixed(['%s=%r' % kv for kv in FIXED.items()])
+    assert felbatch.run(infile, outfile, chunk=2, fixed=fixed,
+                        verbose=False) == 3
+    with open(outfile) as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 3
+    assert float(rows[0]['radWavelength']) == FIXED['radWavelength']
+    exact = felbase.felsweep(grid=False, beamEnergy=np.array([800, 850, 900.]),
+                             peakCurrent=np.array([300, 400, 500.]), **FIXED)
+    assert np.allclose([float(r['08-Lg3D']) for r in rows], exact['08-Lg3D'],
+                       rtol=1e-7)
+
+
+def test_felbatch_rejects_ragged_hdf5(tmp_path):
+    infile = str(tmp_path / 'in.h5')
+    with h5py.File(infile, 'w') as f:
+        f['beamEnergy'] = [800., 850, 900]
+        f['peakCurrent'] = [300., 400]
+    with pytest.raises(ValueError):
+        felbatch.run(infile, str(tmp_path / 'out.h5'), verbose=False)
+
+
+def test_felexplore_matches_sweep_and_resumes(tmp_path):
+    outfile = str(tmp_path / 'scan.h5')
+    axes = {'beamEnergy': np.linspace(800, 900, 7),
+            'peakCurrent': np.linspace(300, 600, 3)}
+    exp = felexplore.FELExplorer(outfile, chunk=5, workers=1, **dict(
+        axes, **FIXED))
+    assert exp.run(verbose=False) == len(exp.blocks)
+    assert exp.run(verbose=False) == 0  # all done
+    exact = felbase.felsweep(**dict(axes, **FIXED))
+    with h5py.File(outfile, 'r') as f:
+        assert np.allclose(f['data/08-Lg3D'][...], exact['08-Lg3D'])
+    other = dict(FIXED, radWavelength=9e-9)
+    with pytest.raises(ValueError):
+        felexplore.FELExplorer(outfile, chunk=5, workers=1,
+                               **dict(axes, **other)).run(verbose=False)
+
+
+def test_felinverse_solves_forward_results():
+    r = felinverse.felDesign(
+        {'12-Lsat': [16, 18, 20], '16-PhotonEnergy': 40.0},
+        {'unduPeriodLength': (0.015, 0.05), 'gap': (4, 30)},
+        fixed={'beamEnergy': 800, 'peakCurrent': 600, 'undulatorLength': 30},
+        mingap=4.0)
+    assert r['success'].all() and r['feasible'].all()
+    assert np.allclose(r['result']['12-Lsat'], [16, 18, 20], rtol=1e-4)
+    wl = felinverse.gap2wavelength(r['gap'], r['unduPeriodLength'], 800)
+    fwd = felbase.felsweep(grid=False, beamEnergy=800, peakCurrent=600,
+                           unduPeriodLength=r['unduPeriodLength'],
+                           radWavelength=wl)
+    assert np.allclose(fwd['12-Lsat'], [16, 18, 20], rtol=1e-4)
+
+
+def test_felinverse_singular_problem_does_not_raise():
+    r = felinverse.felDesign(
+        {'12-Lsat': [20, 25], '16-PhotonEnergy': 40.0},
+        {'unduPeriodLength': (0.015, 0.05), 'avgBetaFunc': (1, 30)},
+        fixed={'beamEnergy': 800, 'peakCurrent': 600, 'radWavelength': 3e-8})
+    assert r['status'].shape == (2, )
+    assert not r['success'].any()
+
+
+def test_felsens_jacobian_matches_differences():
+    e0 = 850.0
+    jac = felsens.felJacobian(dict(FIXED, beamEnergy=e0),
+                              inputs=['beamEnergy'], outputs=['08-Lg3D'])
+    h = 1e-3 * e0
+    f = [felbase.felsweep(beamEnergy=e, **FIXED)['08-Lg3D']
+         for e in (e0 - h, e0 + h)]
+    assert np.isclose(jac[0, 0, 0], (f[1] - f[0]) / (2 * h), rtol=1e-4)
+
+
+def test_felsurrogate_round_trip(tmp_path):
+    s = felsurrogate.FELsurrogate(
+        {'beamEnergy': (800, 900), 'peakCurrent': (300, 600)},
+        fixed=FIXED, keys=['08-Lg3D', '12-Lsat'])
+    error = s.build(tol=1e-3, nvalid=200)
+    assert s.converged and max(error.values()) <= 1e-3
+    e, i = np.array([820., 870]), np.array([350., 550])
+    exact = felbase.felsweep(grid=False, beamEnergy=e, peakCurrent=i, **FIXED)
+    approx = s.evaluate(beamEnergy=e, peakCurrent=i)
+    assert np.allclose(approx['08-Lg3D'], exact['08-Lg3D'], rtol=1e-2)
+    fname = str(tmp_path / 'surrogate.npz')
+    s.save(fname)
+    t = felsurrogate.FELsurrogate.load(fname)
+    assert np.allclose(t.evaluate(beamEnergy=e, peakCurrent=i)['12-Lsat'],
+                       approx['12-Lsat'])
+
+
+def test_felsurrogate_warns_if_stopped():
+    s = felsurrogate.FELsurrogate(
+        {'beamEnergy': (800, 1200), 'peakCurrent': (300, 1000)},
+        fixed={'radWavelength': 30e-9})
+    with pytest.warns(RuntimeWarning, match='not converged'):
+        error = s.build(tol=1e-4, maxiter=1)
+    assert not s.converged and max(error.values()) > 1e-4
+
+
+def test_fldprop_energy_and_propagation():
+    rng = np.random.RandomState(1)
+    ncar = 64
+    efield = rng.randn(ncar, ncar) + 1j * rng.randn(ncar, ncar)
+    prop = fldprop.FieldPropagator(ncar, workers=1)
+    # Parseval: far-field power equals near-field power times grid size
+    assert np.isclose(prop.farfield(efield).sum(),
+                      prop.intensity(efield) * ncar**2)
+    fields = prop.propagate(efield, [0.0, 1.0], dx=1e-5, wavelength=1e-8)
+    assert np.allclose(fields[0], efield)
+    assert np.isclose(prop.intensity(fields[1]), prop.intensity(efield))
+    # propagation is additive in distance
+    two = prop.propagate(prop.propagate(efield, 0.5, 1e-5, 1e-8), 0.5, 1e-5,
+                         1e-8)
+    assert np.allclose(two, fields[1])
+
+
+def test_readfld_of_written_dfl(tmp_path):
+    ncar = 16
+    rng = np.random.RandomState(2)
+    slices = rng.randn(3, ncar, ncar) + 1j * rng.randn(3, ncar, ncar)
+    fname = str(tmp_path / 'rad.dfl')
+    slices.astype(np.complex128).tofile(fname)
+    intp, farfield = fldprop.readfld(fname, ncar=ncar, islice=1)
+    assert np.isclose(intp, np.sum(np.abs(slices[1])**2))
+    hist, farsum = fldprop.fldhistory(fname, ncar=ncar, chunk=2)
+    assert np.allclose(hist, np.sum(np.abs(slices)**2, axis=(1, 2)))
+    assert np.isclose(farsum.sum(), hist.sum() * ncar**2)
+
+
+def test_hghg_bunching_matches_theory():
+    ps = hghg.HGHGPhaseSpace(npart=200000, seed=1)
+    ps.modulate(amp=3.0)
+    ps.disperse(bchi=1.0 / 3.0)
+    b, theory = ps.bunching([1, 2, 3]), ps.bunchingTheory([1, 2, 3])
+    assert np.allclose(b, theory, atol=0.01)
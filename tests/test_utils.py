@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# round-trip tests of the GUI-free data modules of felapps.utils,
+# run by: python -m pytest tests
+#
+
+import os
+import threading
+
+import numpy as np
+import h5py
+import pytest
+
+from felapps.utils import textio
+from felapps.utils import framewriter
+from felapps.utils import writeservice
+from felapps.utils import fitservice
+from felapps.utils import replay
+from felapps.utils import imgframe
+
+
+def test_text_round_trip(tmp_path):
+    fname = str(tmp_path / 'a.asc')
+    data = np.arange(12).reshape(3, 4)
+    textio.writeText(fname, data)
+    r = textio.readText(fname)
+    assert r.dtype == np.int64 and np.array_equal(r, data)
+    fdata = np.random.RandomState(0).randn(5, 3)
+    textio.writeText(fname, fdata)
+    assert np.array_equal(textio.readText(fname), fdata)  # exact float64
+
+
+def test_text_shapes_as_loadtxt(tmp_path):
+    fname = str(tmp_path / 'a.asc')
+    with open(fname, 'w') as f:
+        f.write('# comment\n1 2 3\n')
+    assert textio.readText(fname).shape == np.loadtxt(fname).shape
+    with open(fname, 'w') as f:
+        f.write('1.5\n2\n3\n')
+    r = textio.readText(fname)
+    assert r.dtype == np.float64 and r.shape == (3, )
+
+
+def test_text_cache_keyed_by_dtype_and_comments(tmp_path):
+    fname = str(tmp_path / 'a.asc')
+    with open(fname, 'w') as f:
+        f.write('%1 2\n3 4\n')
+    textio.loadText(fname, comments='%')
+    assert not [n for n in os.listdir(str(tmp_path)) if n.endswith('.npy')]
+    a = textio.loadText(fname, cache=True, comments='%')
+    b = textio.loadText(fname, cache=True, dtype=np.float64, comments='%')
+    assert a.dtype == np.int64 and b.dtype == np.float64
+    assert os.path.exists(textio.sidecarName(fname, comments='%'))
+    assert os.path.exists(textio.sidecarName(fname, np.float64, '%'))
+    assert np.array_equal(textio.loadText(fname, cache=True, comments='%'),
+                          [3, 4])
+    # updated text file invalidates the cache
+    with open(fname, 'w') as f:
+        f.write('5 6\n')
+    st = os.stat(fname)
+    os.utime(fname, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert np.array_equal(textio.loadText(fname, cache=True, comments='%'),
+                          [5, 6])
+
+
+def test_framewriter_round_trip(tmp_path):
+    fname = str(tmp_path / 'frames.h5')
+    frames = np.random.RandomState(0).rand(4, 6, 5) * 100
+    opts = framewriter.storageOptions('gzip', chunk=2, dtype='uint16')
+    with framewriter.FrameWriter(fname, (6, 5), **opts) as w:
+        for i, frame in enumerate(frames):
+            assert w.append(frame, timestamp=float(i)) == i
+    with h5py.File(fname, 'r') as f:
+        data = f['image/data'][...]
+        assert data.dtype == np.uint16
+        assert np.array_equal(data, np.rint(frames))
+        assert np.array_equal(f['image/timestamp'][...], np.arange(4.0))
+        assert np.allclose(f['image/sumint'][...], frames.sum(axis=(1, 2)))
+    with pytest.raises(ValueError):
+        framewriter.FrameWriter(fname, (6, 5)).append(np.zeros((5, 6)))
+
+
+def test_to_storage_rounds_and_keeps_type():
+    data = np.array([0.4, 1.6, 2.5])
+    assert np.array_equal(framewriter.toStorage(data, np.uint8), [0, 2, 2])
+    assert framewriter.toStorage(data) is data
+
+
+def test_clipping_is_counted(tmp_path):
+    data = np.array([[-3.0, 10.0], [np.nan, 300.0]])
+    with pytest.warns(RuntimeWarning, match='3 of 4 values clipped'):
+        stored, nclipped = framewriter.toStorage(data, np.uint8, True)
+    assert nclipped == 3 and np.array_equal(stored, [[0, 10], [0, 255]])
+    fname = str(tmp_path / 'frames.h5')
+    with pytest.warns(RuntimeWarning):
+        with framewriter.FrameWriter(fname, (2, 2), store_dtype='uint8') as w:
+            w.append(np.ones((2, 2)))
+            w.append(data)
+            w.append(data)
+    with h5py.File(fname, 'r') as f:
+        assert f['image/data'].attrs['clipped'] == 6
+
+
+def test_writer_service_callbacks(tmp_path):
+    ws = writeservice.WriterService(maxsize=4)
+    done, errors = [], []
+    fname = str(tmp_path / 'a.bin')
+    assert ws.submit(writeservice.writeFile, fname, b'abc',
+                     callback=done.append)
+    assert ws.submit(writeservice.writeFile, str(tmp_path / 'no/b.bin'), b'',
+                     errback=errors.append)
+    assert ws.flush(timeout=10)
+    assert done == [3] and len(errors) == 1 and ws.failed == 1
+    with open(fname, 'rb') as f:
+        assert f.read() == b'abc'
+    # full queue, non-blocking submit is rejected
+    gate = threading.Event()
+    ws.submit(gate.wait)
+    for i in range(4):
+        ws.submit(len, '')
+    assert not ws.submit(len, '', block=False) and ws.rejected == 1
+    gate.set()
+    ws.close()
+    assert ws.completed == 6
+    with pytest.raises(RuntimeError):
+        ws.submit(len, '')
+
+
+def test_fit_many_async():
+    x = np.linspace(-5, 5, 101)
+    profiles = [(x, 2.0 * np.exp(-(x - x0)**2 / 2.0) + 0.1)
+                for x0 in (-1.0, 0.0, 1.5)]
+    got = threading.Event()
+    out = []
+
+    def callback(results):
+        out.extend(results)
+        got.set()
+
+    service = fitservice.FitService(workers=2)
+    service.fitManyAsync(profiles, callback)
+    assert got.wait(30)
+    service.shutdown()
+    assert all(r.success for r in out)
+    assert np.allclose([r.values()['x0'] for r in out], [-1.0, 0.0, 1.5])
+    assert np.allclose([abs(r.values()['xstd']) for r in out], 1.0)
+
+
+def test_replay_of_written_frames(tmp_path):
+    fname = str(tmp_path / 'frames.h5')
+    frames = np.arange(3 * 4 * 2, dtype=np.float64).reshape(3, 4, 2)
+    with framewriter.FrameWriter(fname, (4, 2)) as w:
+        for i, frame in enumerate(frames):
+            w.append(frame, timestamp=0.1 * i)
+    stack = replay.FrameStack(fname)
+    assert len(stack) == 3 and np.isclose(stack.period(), 0.1)
+    src = replay.ReplaySource(stack, speed=0, loop=False)
+    src.start()
+    thread = src._thread  # cleared by the thread when done
+    if thread is not None:
+        thread.join(10)
+    assert src.played == 3
+    seq, data, ts = src.ring.latest()
+    assert seq == 2 and np.array_equal(data, frames[2].ravel())
+    stack.close()
+    empty = str(tmp_path / 'empty.h5')
+    with h5py.File(empty, 'w') as f:
+        f.create_dataset('image/data', shape=(0, 4, 2), dtype='f8')
+    with pytest.raises(ValueError):
+        replay.FrameStack(empty)
+
+
+def test_frame_ring_counters():
+    ring = imgframe.FrameRing(4, 3, ordered=True)
+    for i in range(6):
+        ring.put(np.full(3, i))
+    seq, data, ts = ring.latest()
+    assert seq == 5 and data[0] == 5
+    assert ring.skipped == 5 and ring.shown == 1 and ring.dropped == 2
+    assert ring.latest() is None
+    assert [ring.get()[0] for i in range(4)] == [2, 3, 4, 5]